@@ -10,29 +10,56 @@
 # sudo apt-get install -y libayatana-appindicator3-1 gir1.2-ayatanaappindicator3-0.1
 
 import sys
+import os
+import time
+# Startup time is reported in the log, see create_app()
+_process_started = time.perf_counter()
 if getattr(sys, 'frozen', False) and sys.stdout is None:
     sys.stdout = open(os.devnull, 'w')
     sys.stderr = open(os.devnull, 'w')
 
+# Speed tests run in a child process started as `app.py --measure-worker <job>`.
+# Handle that before the heavy imports below so the worker starts quickly.
+MEASURE_WORKER_FLAG = "--measure-worker"
+if __name__ == '__main__' and len(sys.argv) > 2 and sys.argv[1] == MEASURE_WORKER_FLAG:
+    from measurement import worker_main
+    sys.exit(worker_main(sys.argv[2]))
+
+# `app.py --throughput-server [port]` only serves the endpoints the built-in
+# HTTP measurement engine tests against, e.g. on the far end of a link.
+THROUGHPUT_SERVER_FLAG = "--throughput-server"
+if __name__ == '__main__' and len(sys.argv) > 1 and sys.argv[1] == THROUGHPUT_SERVER_FLAG:
+    from measurement import run_throughput_server
+    sys.exit(run_throughput_server(int(sys.argv[2]) if len(sys.argv) > 2 else 5011))
+
 import sqlite3
-from flask import Flask, jsonify, request, render_template, redirect, url_for
-from apscheduler.schedulers.background import BackgroundScheduler # pip install apscheduler
-from datetime import datetime, timedelta
-import speedtest #pip install speedtest-cli
-import webbrowser, os
+from flask import Flask, jsonify, request, render_template, redirect, url_for, g
+from datetime import datetime, timedelta, timezone
 from threading import Timer
-import statistics
+import math
 import json
+import copy
+import hashlib
+import hmac
+import gzip
+from collections import OrderedDict
 import logging
-from waitress import serve # pip install waitress
+from probes import LatencyProber
+from metrics import Registry
+from streaming import Broadcaster, format_event
+from measurement import BACKENDS, UPLOAD_INBUF_BYTES, create_throughput_blueprint, http_engine_test_seconds
+from detection import Detector, METRIC_DIRECTIONS
+from export import EXPORT_COLUMNS, FORMATS as EXPORT_FORMATS, ExportLimiter, iter_batches, open_export_cursor
 import subprocess
-
-from PIL import Image
-try:
-    from pystray import Icon as TrayIcon, MenuItem as item, Menu #pip install pystray
-except ValueError:
-     subprocess.run(['sudo', 'apt', 'install', '-y', 'libayatana-appindicator3-1', 'gir1.2-ayatanaappindicator3-0.1'])
+import socket
+# Heavy modules that are only needed once the app runs (apscheduler, waitress,
+# urllib.request, PIL, pystray, webbrowser) are imported where they are used,
+# so that importing this module stays cheap.
 import threading
+try:
+    import brotli # Optional: pip install brotli
+except ImportError:
+    brotli = None
 
 VERSION = "2025.11.28"
 APP_NAME = "internetTester"
@@ -44,6 +71,32 @@ def get_default_settings():
         "show_median_lines": True,
         "open_on_startup": True,
         "test_interval_minutes": 15,
+        "test_timeout_seconds": 180,
+        "speedtest_server_id": "",
+        "speedtest_cache_hours": 24,
+        "measurement_backend": "speedtest",
+        "http_engine_url": "",
+        "http_engine_streams": 4,
+        "http_engine_duration_seconds": 10,
+        "throughput_server_enabled": False,
+        "adaptive_tests": False,
+        "test_byte_budget_mb": 100,
+        "daily_data_budget_mb": 0,
+        "probe_enabled": False,
+        "probe_targets": ["1.1.1.1:443", "8.8.8.8:443"],
+        "probe_interval_seconds": 5,
+        "probe_window_seconds": 60,
+        "response_cache_size": 64,
+        "stream_max_clients": 32,
+        "ingest_token": "",
+        "agent_enabled": False,
+        "agent_central_url": "",
+        "agent_probe_id": "",
+        "agent_token": "",
+        "detection_enabled": True,
+        "raw_retention_days": 0,
+        "hourly_retention_days": 0,
+        "probe_retention_days": 0,
         "default_time_frame": "1hour",
         "time_frames": {
             "1hour": {"label": "Last Hour", "delta": {"hours": 1}},
@@ -68,6 +121,21 @@ def resource_path(relative_path):
     return os.path.join(base_path, relative_path)
 
 app = Flask(__name__, template_folder=resource_path('templates'), static_folder=resource_path('static'))
+# Any instance can act as the far end of another instance's HTTP engine tests,
+# once enabled in the settings: the endpoints let anyone who can reach this
+# instance move unlimited data through its connection.
+app.register_blueprint(create_throughput_blueprint(enabled=lambda: settings.get('throughput_server_enabled', False)))
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    if 'request_start' in g:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, endpoint=endpoint, status=response.status_code)
+    return response
 
 # Determine the base path for the database, which works for development and for a PyInstaller bundle.
 if getattr(sys, 'frozen', False) and hasattr(sys, '_MEIPASS'):
@@ -76,29 +144,149 @@ if getattr(sys, 'frozen', False) and hasattr(sys, '_MEIPASS'):
 else:
     # In a normal Python environment, use the script's directory
     application_path = os.path.dirname(os.path.abspath(__file__))
+# INTERNETTESTER_DATA_DIR keeps the database and log elsewhere, e.g. for benchmark.py
+application_path = os.environ.get('INTERNETTESTER_DATA_DIR', application_path)
 db_path = os.path.join(application_path, 'network_tests.db')
 log_path = os.path.join(application_path, 'app.log')
 
-# Setup logging to file and console
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_path),
-        logging.StreamHandler(sys.stdout)
-    ]
+def configure_logging():
+    """Sets up logging to file and console."""
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(log_path),
+            logging.StreamHandler(sys.stdout)
+        ]
+    )
+
+# Prometheus metrics, served at /metrics
+metrics = Registry()
+LATEST_DOWNLOAD = metrics.gauge("internettester_download_mbps", "Download speed of the newest stored test in Mbps.")
+LATEST_UPLOAD = metrics.gauge("internettester_upload_mbps", "Upload speed of the newest stored test in Mbps.")
+LATEST_LATENCY = metrics.gauge("internettester_latency_ms", "Latency of the newest stored test in milliseconds.")
+LATEST_BYTES = metrics.gauge("internettester_test_bytes_transferred", "Data moved by the newest stored test in bytes.")
+LATEST_TIMESTAMP = metrics.gauge("internettester_last_test_timestamp_seconds", "Unix time of the newest stored test.")
+STREAM_CLIENTS = metrics.gauge("internettester_stream_clients", "Dashboards connected to /api/stream.")
+DB_SIZE = metrics.gauge("internettester_db_size_bytes", "Size of the database file(s) in bytes.", ["file"])
+TESTS = metrics.counter(
+    "internettester_tests_total",
+    "Speed tests by outcome (success, error, rate_limited, timeout, cancelled, worker_error, skipped_budget).",
+    ["backend", "outcome"],
+)
+TEST_PHASE_SECONDS = metrics.histogram(
+    "internettester_test_phase_seconds", "Duration of the phases of successful speed tests.",
+    ["backend", "phase"], buckets=(0.25, 0.5, 1, 2, 5, 10, 15, 20, 30, 60, 120, 300),
+)
+DB_INSERT_SECONDS = metrics.histogram(
+    "internettester_db_insert_seconds", "Time to store a test result and update the rollups.",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+NETWORK_DATA_SECONDS = metrics.histogram(
+    "internettester_network_data_seconds", "Time /api/network_data spends querying and serializing (cache misses only).",
+    ["stage"],
 )
+NETWORK_DATA_BYTES = metrics.histogram(
+    "internettester_network_data_response_bytes", "Body size of /api/network_data responses.",
+    buckets=(1_000, 10_000, 50_000, 100_000, 500_000, 1_000_000, 5_000_000, 10_000_000),
+)
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    "internettester_http_request_seconds", "Time to handle HTTP requests.", ["endpoint", "status"],
+)
+SCHEDULER_LAG_SECONDS = metrics.histogram(
+    "internettester_scheduler_lag_seconds", "Delay between a job's scheduled and actual start.",
+    ["job"], buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300),
+)
+SCHEDULER_MISSED = metrics.counter(
+    "internettester_scheduler_missed_runs_total", "Scheduled job runs that were skipped because they started too late.", ["job"],
+)
+
+# Each thread (waitress workers, scheduler jobs) keeps one connection open,
+# so statement caches and pragmas survive between requests.
+_db_local = threading.local()
+
+def get_db():
+    """Returns this thread's connection to the database, opening and tuning it on first use."""
+    conn = getattr(_db_local, "conn", None)
+    if conn is None or _db_local.path != db_path:
+        conn = sqlite3.connect(db_path, timeout=30, cached_statements=256)
+        conn.row_factory = sqlite3.Row # Access columns by name
+        # WAL lets the web server read while the scheduler writes
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-8000") # 8 MB
+        conn.execute("PRAGMA mmap_size=67108864") # 64 MB
+        _db_local.conn = conn
+        _db_local.path = db_path
+    return conn
+
+def to_epoch_ms(when):
+    """Converts a (local, naive) datetime to the integer timestamps stored in the database."""
+    return round(when.timestamp() * 1000)
+
+def from_epoch_ms(epoch_ms):
+    """Converts a stored integer timestamp back to a local, naive datetime."""
+    return datetime.fromtimestamp(epoch_ms / 1000)
+
+def migrate_epoch_timestamps(conn):
+    """Schema v1: timestamps become integer epoch milliseconds instead of ISO text."""
+    conn.execute("ALTER TABLE network_tests RENAME TO network_tests_v0")
+    conn.execute('''
+        CREATE TABLE network_tests (
+            timestamp INTEGER PRIMARY KEY,
+            download_mbps REAL,
+            upload_mbps REAL,
+            latency_ms REAL
+        )
+    ''')
+    rows = conn.execute("SELECT timestamp, download_mbps, upload_mbps, latency_ms FROM network_tests_v0").fetchall()
+    conn.executemany(
+        "INSERT OR IGNORE INTO network_tests (timestamp, download_mbps, upload_mbps, latency_ms) VALUES (?, ?, ?, ?)",
+        ((to_epoch_ms(datetime.fromisoformat(row[0])), row[1], row[2], row[3]) for row in rows)
+    )
+    conn.execute("DROP TABLE network_tests_v0")
+    # Rollups are keyed the same way; init_db rebuilds them from the migrated rows
+    for table in ROLLUP_TABLES.values():
+        conn.execute(f"DROP TABLE IF EXISTS {table}")
+
+def migrate_transfer_columns(conn):
+    """Schema v2: record how much data each test moved and how long it took."""
+    conn.execute("ALTER TABLE network_tests ADD COLUMN bytes_transferred INTEGER")
+    conn.execute("ALTER TABLE network_tests ADD COLUMN duration_ms INTEGER")
+
+# Applied in order to existing databases; PRAGMA user_version counts the ones already applied
+SCHEMA_MIGRATIONS = [migrate_epoch_timestamps, migrate_transfer_columns]
 
 def init_db():
-    """Creates database tables if they don't exist."""
+    """Creates database tables if they don't exist and migrates older schemas."""
     logging.info(f"Initializing database at: {db_path}")
-    with sqlite3.connect(db_path) as conn:
+    conn = get_db()
+    # Retention frees pages that incremental_vacuum hands back to the file system.
+    # Switching an existing database needs one full VACUUM; a new one is empty.
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        logging.info("Enabling incremental vacuum on the database.")
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+    with conn:
+        conn.execute("BEGIN")
+        is_new = not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'network_tests'").fetchone()
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if not is_new:
+            for number, migration in enumerate(SCHEMA_MIGRATIONS[version:], start=version + 1):
+                logging.info(f"Migrating database schema to version {number}.")
+                migration(conn)
+
+        # The INTEGER PRIMARY KEY is the table's own b-tree key, so range scans
+        # on timestamp read the rows directly without a separate index.
         conn.execute('''
             CREATE TABLE IF NOT EXISTS network_tests (
-                timestamp DATETIME PRIMARY KEY,
+                timestamp INTEGER PRIMARY KEY,
                 download_mbps REAL,
                 upload_mbps REAL,
-                latency_ms REAL
+                latency_ms REAL,
+                bytes_transferred INTEGER,
+                duration_ms INTEGER
             )
         ''')
         conn.execute('''
@@ -107,14 +295,83 @@ def init_db():
                 value TEXT
             )
         ''')
+        # speedtest.net configuration and best server, reused between tests
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS speedtest_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT,
+                updated_at INTEGER
+            )
+        ''')
+        # One row per latency probe target and window (see probes.py)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS latency_probes (
+                timestamp INTEGER,
+                target TEXT,
+                sent INTEGER,
+                lost INTEGER,
+                min_ms REAL,
+                avg_ms REAL,
+                max_ms REAL,
+                jitter_ms REAL,
+                PRIMARY KEY (timestamp, target)
+            )
+        ''')
+        # Results pushed by agent instances to this (central) instance through /api/ingest.
+        # Keyed by probe so each probe's history is one contiguous range of the b-tree.
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS probe_results (
+                probe_id TEXT NOT NULL,
+                timestamp INTEGER NOT NULL,
+                download_mbps REAL,
+                upload_mbps REAL,
+                latency_ms REAL,
+                bytes_transferred INTEGER,
+                duration_ms INTEGER,
+                PRIMARY KEY (probe_id, timestamp)
+            ) WITHOUT ROWID
+        ''')
+        # Timestamps of local results an agent has not delivered to the central instance yet
+        conn.execute("CREATE TABLE IF NOT EXISTS agent_outbox (timestamp INTEGER PRIMARY KEY)")
+        # Degradations and outages found by the detector (see detection.py) and failed tests.
+        # `ended` is NULL while an event is ongoing; `detail` is JSON.
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY,
+                kind TEXT NOT NULL,
+                metric TEXT,
+                started INTEGER NOT NULL,
+                ended INTEGER,
+                detail TEXT
+            )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS events_started ON events (started)")
+        # State of the detector, saved with every result
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS detector_state (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        ''')
+        # Hourly/daily aggregates, kept up to date by run_test_and_store
+        metric_columns = ", ".join(
+            f"{metric}_count INTEGER, {metric}_sum REAL, {metric}_min REAL, {metric}_max REAL, {metric}_sketch TEXT"
+            for metric, _ in ROLLUP_METRICS
+        )
+        for table in ROLLUP_TABLES.values():
+            conn.execute(f'CREATE TABLE IF NOT EXISTS {table} (bucket INTEGER PRIMARY KEY, {metric_columns})')
+        conn.execute(f"PRAGMA user_version = {len(SCHEMA_MIGRATIONS)}")
+
+        # Build the rollups from existing history the first time they are created
+        has_rollups = conn.execute(f"SELECT 1 FROM {ROLLUP_TABLES['daily']} LIMIT 1").fetchone()
+        has_tests = conn.execute("SELECT 1 FROM network_tests LIMIT 1").fetchone()
+        if has_tests and not has_rollups:
+            rebuild_rollups(conn)
     logging.info(f"Database '{db_path}' initialized.")
 
 def load_settings():
     """Loads settings from the database, populating with defaults if necessary."""
-    with sqlite3.connect(db_path) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT key, value FROM settings")
-        db_settings = dict(cursor.fetchall())
+    db_settings = {row["key"]: row["value"] for row in get_db().execute("SELECT key, value FROM settings")}
 
     settings = {}
     default_settings = get_default_settings()
@@ -149,136 +406,1765 @@ def load_settings():
 
 def save_settings(settings_dict):
     """Saves the settings dictionary to the database."""
-    with sqlite3.connect(db_path) as conn:
+    with get_db() as conn:
         for key, value in settings_dict.items():
             db_value = json.dumps(value) if isinstance(value, (dict, list)) else str(value)
             conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, db_value))
     logging.info("Settings saved to database.")
 
+ROLLUP_TABLES = {"hourly": "network_tests_hourly", "daily": "network_tests_daily"}
+# (rollup column prefix, network_tests column)
+ROLLUP_METRICS = (("download", "download_mbps"), ("upload", "upload_mbps"), ("latency", "latency_ms"))
+
+class QuantileSketch:
+    """Streaming, mergeable quantile estimator (a log-bucketed histogram in the style of DDSketch).
+
+    Every positive value is counted in bucket ceil(log_gamma(value)), with
+    gamma = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY). Any quantile
+    returned by `quantile` is therefore within RELATIVE_ACCURACY (1%) of the
+    exact order statistic of that rank, no matter how many values were added
+    or how many sketches were merged. Zero and negative values are counted
+    exactly as 0. Memory is bounded by MAX_BINS: if exceeded, the lowest bins
+    are collapsed, which only degrades the lowest quantiles.
+    """
+
+    RELATIVE_ACCURACY = 0.01
+    MAX_BINS = 2048
+    GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+    LOG_GAMMA = math.log(GAMMA)
+
+    def __init__(self, bins=None, zero_count=0):
+        self.bins = bins if bins is not None else {}
+        self.zero_count = zero_count
+
+    @property
+    def count(self):
+        return self.zero_count + sum(self.bins.values())
+
+    def add(self, value):
+        """Adds a single value. O(1)."""
+        if value > 0:
+            key = math.ceil(math.log(value) / self.LOG_GAMMA)
+            self.bins[key] = self.bins.get(key, 0) + 1
+            if len(self.bins) > self.MAX_BINS:
+                self._collapse()
+        else:
+            self.zero_count += 1
+
+    def merge(self, other):
+        """Adds the counts of another sketch to this one."""
+        self.zero_count += other.zero_count
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+        if len(self.bins) > self.MAX_BINS:
+            self._collapse()
+
+    def _collapse(self):
+        keys = sorted(self.bins)
+        excess = keys[:len(keys) - self.MAX_BINS + 1]
+        self.bins[excess[-1]] += sum(self.bins.pop(key) for key in excess[:-1])
+
+    def quantile(self, q):
+        """Returns the estimated q-quantile (0 <= q <= 1), or None if the sketch is empty."""
+        total = self.count
+        if not total:
+            return None
+        rank = q * (total - 1)
+        seen = self.zero_count
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                return 2 * self.GAMMA ** key / (self.GAMMA + 1)
+        return 2 * self.GAMMA ** max(self.bins) / (self.GAMMA + 1)
+
+    def to_dict(self):
+        data = {str(key): count for key, count in self.bins.items()}
+        if self.zero_count:
+            data["z"] = self.zero_count
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        zero_count = data.get("z", 0)
+        return cls({int(key): count for key, count in data.items() if key != "z"}, zero_count)
+
+def rollup_bucket(resolution, when):
+    """Returns the start of the hourly or daily bucket containing `when`."""
+    if resolution == "hourly":
+        return when.replace(minute=0, second=0, microsecond=0)
+    return when.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def empty_rollup():
+    return {metric: {"count": 0, "sum": 0.0, "min": None, "max": None, "sketch": QuantileSketch()} for metric, _ in ROLLUP_METRICS}
+
+def rollup_add(rollup, row):
+    """Adds one network_tests row to a rollup."""
+    for metric, column in ROLLUP_METRICS:
+        value = row[column]
+        if value is None:
+            continue
+        stats = rollup[metric]
+        stats["count"] += 1
+        stats["sum"] += value
+        stats["min"] = value if stats["min"] is None else min(stats["min"], value)
+        stats["max"] = value if stats["max"] is None else max(stats["max"], value)
+        stats["sketch"].add(value)
+
+def rollup_from_row(row):
+    """Converts a row of a rollup table to a rollup."""
+    rollup = empty_rollup()
+    for metric, _ in ROLLUP_METRICS:
+        rollup[metric] = {
+            "count": row[f"{metric}_count"] or 0,
+            "sum": row[f"{metric}_sum"] or 0.0,
+            "min": row[f"{metric}_min"],
+            "max": row[f"{metric}_max"],
+            "sketch": QuantileSketch.from_dict(json.loads(row[f"{metric}_sketch"] or "{}")),
+        }
+    return rollup
+
+def store_rollup(conn, table, bucket, rollup):
+    columns = ["bucket"]
+    values = [to_epoch_ms(bucket)]
+    for metric, _ in ROLLUP_METRICS:
+        stats = rollup[metric]
+        columns += [f"{metric}_count", f"{metric}_sum", f"{metric}_min", f"{metric}_max", f"{metric}_sketch"]
+        values += [stats["count"], stats["sum"], stats["min"], stats["max"], json.dumps(stats["sketch"].to_dict())]
+    conn.execute(
+        f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+        values
+    )
+
+def update_rollups(conn, when, row):
+    """Folds a newly stored measurement into its hourly and daily buckets."""
+    for resolution, table in ROLLUP_TABLES.items():
+        bucket = rollup_bucket(resolution, when)
+        existing = conn.execute(f"SELECT * FROM {table} WHERE bucket = ?", (to_epoch_ms(bucket),)).fetchone()
+        rollup = rollup_from_row(existing) if existing else empty_rollup()
+        rollup_add(rollup, row)
+        store_rollup(conn, table, bucket, rollup)
+
+def rebuild_rollups(conn):
+    """Recomputes the rollup tables from the raw measurements.
+
+    Buckets older than the oldest raw row are kept: their raw rows may have
+    been removed by apply_retention, which only ever removes whole days.
+    """
+    logging.info("Building rollup tables from existing measurements.")
+    rollups = {resolution: {} for resolution in ROLLUP_TABLES}
+    oldest = conn.execute("SELECT MIN(timestamp) FROM network_tests").fetchone()[0]
+    if oldest is None:
+        return
+    cursor = conn.execute("SELECT timestamp, download_mbps, upload_mbps, latency_ms FROM network_tests")
+    for row in cursor:
+        when = from_epoch_ms(row["timestamp"])
+        for resolution, buckets in rollups.items():
+            bucket = rollup_bucket(resolution, when)
+            if bucket not in buckets:
+                buckets[bucket] = empty_rollup()
+            rollup_add(buckets[bucket], row)
+
+    for resolution, table in ROLLUP_TABLES.items():
+        first_bucket = to_epoch_ms(rollup_bucket(resolution, from_epoch_ms(oldest)))
+        conn.execute(f"DELETE FROM {table} WHERE bucket >= ?", (first_bucket,))
+        for bucket, rollup in rollups[resolution].items():
+            store_rollup(conn, table, bucket, rollup)
+
+FAILED_RESULT = {"download": None, "upload": None, "ping": None}
+
+# The worker process of the test in progress, if any
+_worker_process = None
+_worker_lock = threading.Lock()
+_worker_cancelled = threading.Event()
+
+def load_speedtest_cache():
+    """Returns the cached speedtest.net 'config' and 'server' that are younger than the TTL."""
+    max_age_ms = settings.get('speedtest_cache_hours', 24) * 3600 * 1000
+    oldest = to_epoch_ms(datetime.now()) - max_age_ms
+    rows = get_db().execute("SELECT key, value FROM speedtest_cache WHERE updated_at >= ?", (oldest,))
+    return {row["key"]: json.loads(row["value"]) for row in rows}
+
+def save_speedtest_cache(values):
+    now_ms = to_epoch_ms(datetime.now())
+    with get_db() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO speedtest_cache (key, value, updated_at) VALUES (?, ?, ?)",
+            [(key, json.dumps(value), now_ms) for key, value in values.items()]
+        )
+
+def clear_speedtest_cache():
+    with get_db() as conn:
+        conn.execute("DELETE FROM speedtest_cache")
+
+def build_speedtest_job():
+    """Builds the worker job, reusing the cached configuration and server when still valid."""
+    server_id = str(settings.get('speedtest_server_id', '')).strip()
+    job = {"secure": True, "server_id": server_id or None} # Use HTTPS
+    try:
+        job.update(load_speedtest_cache())
+    except sqlite3.Error:
+        logging.error("Could not read the speedtest cache.", exc_info=True)
+    # A pin that changed since the server was cached wins over the cache
+    if server_id and str(job.get("server", {}).get("id")) != server_id:
+        job.pop("server", None)
+    return job
+
+def update_speedtest_cache(results):
+    """Caches a freshly selected configuration and server, or drops the cache after a failure."""
+    try:
+        if results.get("error"):
+            # Re-validate the configuration and server on the next run
+            clear_speedtest_cache()
+        elif results.pop("refreshed", False):
+            save_speedtest_cache({"config": results.pop("config"), "server": results.pop("server")})
+    except sqlite3.Error:
+        logging.error("Could not update the speedtest cache.", exc_info=True)
+
+def build_measurement_job():
+    """Builds the worker job for the measurement backend selected in the settings."""
+    backend = settings.get('measurement_backend', 'speedtest')
+    job = {
+        "backend": backend,
+        "adaptive": settings.get('adaptive_tests', False),
+        "byte_budget": settings.get('test_byte_budget_mb', 100) * 1_000_000 or None,
+    }
+    if backend == 'http':
+        job.update({
+            "url": settings.get('http_engine_url', ''),
+            "streams": settings.get('http_engine_streams', 4),
+            "duration": settings.get('http_engine_duration_seconds', 10),
+        })
+    else:
+        job.update(build_speedtest_job())
+    return job
+
+def measure_worker_command(job):
+    """Returns the command line that runs `job` in a measurement worker process."""
+    if getattr(sys, 'frozen', False):
+        return [sys.executable, MEASURE_WORKER_FLAG, json.dumps(job)]
+    return [sys.executable, os.path.abspath(__file__), MEASURE_WORKER_FLAG, json.dumps(job)]
+
 def measure_network_quality():
-    """ Measures network quality (download, upload, and latency).
+    """ Measures network quality (download, upload, and latency) in a worker process.
+
+    The test is killed if it takes longer than the `test_timeout_seconds`
+    setting, or if cancel_network_test() is called.
 
     Returns:
         dict: A dictionary containing 'download' (Mbps), 'upload' (Mbps), and
               'ping' (ms).
     """
+    global _worker_process
+    timeout = settings.get('test_timeout_seconds', 180)
+    job = build_measurement_job()
+    backend = job["backend"]
+    with _worker_lock:
+        process = subprocess.Popen(
+            measure_worker_command(job),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            stdin=subprocess.DEVNULL,
+        )
+        _worker_process = process
+        _worker_cancelled.clear()
     try:
-        st = speedtest.Speedtest(secure=True) # Use HTTPS
-        st.get_best_server()
-        download_speed = st.download()
-        upload_speed = st.upload()
-        ping = st.results.ping
-
-        # Convert speeds from bits/s to Mbit/s
-        download_speed_mbps = download_speed / 1_000_000
-        upload_speed_mbps = upload_speed / 1_000_000
-
-        return {
-            "download": download_speed_mbps,
-            "upload": upload_speed_mbps,
-            "ping": ping,
-        }
-    except speedtest.SpeedtestException as e:
-        if '429' in str(e):
-            logging.warning(f"Speedtest rate limit hit: {e}. Consider increasing the test interval in the settings.")
+        stdout, stderr = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.communicate()
+        logging.error(f"Speed test did not finish within {timeout} seconds and was stopped.")
+        TESTS.inc(backend=backend, outcome="timeout")
+        return dict(FAILED_RESULT, error=f"Test did not finish within {timeout} seconds.")
+    finally:
+        with _worker_lock:
+            _worker_process = None
+
+    if _worker_cancelled.is_set():
+        logging.warning("Speed test was cancelled.")
+        TESTS.inc(backend=backend, outcome="cancelled")
+        return dict(FAILED_RESULT, cancelled=True)
+    if process.returncode != 0:
+        logging.error(f"Speed test worker exited with code {process.returncode}: {stderr.decode(errors='replace').strip()}")
+        TESTS.inc(backend=backend, outcome="worker_error")
+        return dict(FAILED_RESULT, error=f"Worker exited with code {process.returncode}.", worker_error=True)
+
+    try:
+        results = json.loads(stdout.decode().strip().splitlines()[-1])
+    except (ValueError, IndexError):
+        logging.error(f"Could not read speed test result from worker: {stdout!r} {stderr!r}")
+        TESTS.inc(backend=backend, outcome="worker_error")
+        return dict(FAILED_RESULT, error="Could not read the result of the worker.", worker_error=True)
+
+    error = results.get("error")
+    if backend == "speedtest":
+        update_speedtest_cache(results)
+    if error:
+        if results.get("rate_limited"):
+            logging.warning(f"Speedtest rate limit hit: {error}. Consider increasing the test interval in the settings.")
+            TESTS.inc(backend=backend, outcome="rate_limited")
         else:
-            logging.error(f"A speedtest error occurred: {e}")
-        return {"download": None, "upload": None, "ping": None}
-    except Exception as e:
-        logging.error("An unexpected error during speed test.", exc_info=True)
-        return {"download": None, "upload": None, "ping": None}
+            if results.get("unexpected"):
+                logging.error(f"An unexpected error during speed test.\n{error}")
+            else:
+                logging.error(f"A speedtest error occurred: {error}")
+            TESTS.inc(backend=backend, outcome="error")
+    else:
+        TESTS.inc(backend=backend, outcome="success")
+        for phase, seconds in results.pop("phases", {}).items():
+            TEST_PHASE_SECONDS.observe(seconds, backend=backend, phase=phase)
+    return results
+
+def cancel_network_test():
+    """Kills the worker process of the test in progress. Returns True if there was one."""
+    with _worker_lock:
+        if _worker_process is None:
+            return False
+        _worker_cancelled.set()
+        _worker_process.kill()
+        return True
+
+def get_last_measurement_time():
+    """Returns the time of the newest stored measurement, or now if there is none."""
+    latest = get_db().execute("SELECT MAX(timestamp) FROM network_tests").fetchone()[0]
+    return from_epoch_ms(latest) if latest else datetime.now()
+
+def data_used_today():
+    """Returns the number of bytes moved since local midnight by the tests that were stored."""
+    midnight = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    used = get_db().execute(
+        "SELECT SUM(bytes_transferred) FROM network_tests WHERE timestamp >= ?", (to_epoch_ms(midnight),)
+    ).fetchone()[0]
+    return used or 0
+
+def estimated_test_bytes():
+    """Estimates the data the next test will move from the average of the last few tests."""
+    return get_db().execute('''
+        SELECT AVG(bytes_transferred) FROM (
+            SELECT bytes_transferred FROM network_tests
+            WHERE bytes_transferred IS NOT NULL
+            ORDER BY timestamp DESC LIMIT 5
+        )
+    ''').fetchone()[0] or 0
+
+def run_scheduled_test():
+    """Scheduler job: runs a test unless it would exceed the daily data budget."""
+    budget = settings.get('daily_data_budget_mb', 0) * 1_000_000
+    if budget:
+        used = data_used_today()
+        if used + estimated_test_bytes() > budget:
+            logging.warning(f"Skipping speed test: {used / 1_000_000:.0f} MB of the {budget / 1_000_000:.0f} MB daily data budget used.")
+            TESTS.inc(backend=settings.get('measurement_backend', 'speedtest'), outcome="skipped_budget")
+            return
+    run_test_and_store()
+
+# Rows deleted per transaction by apply_retention, so writers are never blocked for long
+RETENTION_BATCH_ROWS = 5000
+# Pages returned to the file system per incremental_vacuum step
+VACUUM_BATCH_PAGES = 1024
+
+def delete_in_batches(conn, table, column, cutoff_ms, key="rowid", prefix=None):
+    """Deletes the rows of `table` with `column` < `cutoff_ms` in small transactions; returns the count.
+
+    `key` identifies the rows: the primary key columns of a WITHOUT ROWID
+    table. With `prefix` (column, value), only the rows with that value are
+    deleted, so that a primary key starting with that column is used.
+    """
+    condition = f"{column} < ?"
+    params = [cutoff_ms]
+    if prefix:
+        condition = f"{prefix[0]} = ? AND {condition}"
+        params.insert(0, prefix[1])
+    deleted = 0
+    while True:
+        with conn:
+            cursor = conn.execute(
+                f"DELETE FROM {table} WHERE ({key}) IN (SELECT {key} FROM {table} WHERE {condition} LIMIT ?)",
+                (*params, RETENTION_BATCH_ROWS)
+            )
+        deleted += cursor.rowcount
+        if cursor.rowcount < RETENTION_BATCH_ROWS:
+            return deleted
+
+def apply_retention():
+    """Scheduler job: drops data older than the retention settings and shrinks the database file.
+
+    Raw tests older than `raw_retention_days` are removed; they remain
+    summarized in the hourly and daily rollups. Hourly rollups older than
+    `hourly_retention_days` are removed too, leaving the daily ones. Latency
+    probe windows and results ingested from agents have no rollups; they are
+    removed after `probe_retention_days`. Cutoffs are aligned to whole days so rollups can still be rebuilt
+    from the raw rows that are left. A setting of 0 keeps the data forever.
+    """
+    global data_last_modified
+    conn = get_db()
+    today = rollup_bucket("daily", datetime.now())
+    deleted = 0
+    raw_days = settings.get('raw_retention_days', 0)
+    if raw_days:
+        cutoff_ms = to_epoch_ms(today - timedelta(days=raw_days))
+        deleted += delete_in_batches(conn, "network_tests", "timestamp", cutoff_ms)
+    hourly_days = settings.get('hourly_retention_days', 0)
+    if hourly_days:
+        cutoff_ms = to_epoch_ms(today - timedelta(days=hourly_days))
+        deleted += delete_in_batches(conn, ROLLUP_TABLES["hourly"], "bucket", cutoff_ms)
+    probe_days = settings.get('probe_retention_days', 0)
+    if probe_days:
+        cutoff_ms = to_epoch_ms(today - timedelta(days=probe_days))
+        deleted += delete_in_batches(conn, "latency_probes", "timestamp", cutoff_ms)
+        for (probe_id,) in conn.execute("SELECT DISTINCT probe_id FROM probe_results").fetchall():
+            deleted += delete_in_batches(
+                conn, "probe_results", "timestamp", cutoff_ms, key="probe_id, timestamp", prefix=("probe_id", probe_id)
+            )
 
+    freed_pages = 0
+    while (free := conn.execute("PRAGMA freelist_count").fetchone()[0]) > 0:
+        conn.execute(f"PRAGMA incremental_vacuum({min(free, VACUUM_BATCH_PAGES)})").fetchall()
+        freed_pages += min(free, VACUUM_BATCH_PAGES)
+    if deleted:
+        data_last_modified = datetime.now()
+        response_cache.clear()
+    if deleted or freed_pages:
+        logging.info(f"Retention removed {deleted} rows and freed {freed_pages} database pages.")
+
+def database_stats():
+    """Size of the database file(s) and the range of raw measurements, for the settings page."""
+    conn = get_db()
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    oldest, newest, count = conn.execute("SELECT MIN(timestamp), MAX(timestamp), COUNT(*) FROM network_tests").fetchone()
+    wal_path = db_path + "-wal"
+    return {
+        "size_bytes": conn.execute("PRAGMA page_count").fetchone()[0] * page_size,
+        "free_bytes": conn.execute("PRAGMA freelist_count").fetchone()[0] * page_size,
+        "wal_bytes": os.path.getsize(wal_path) if os.path.exists(wal_path) else 0,
+        "raw_tests": count,
+        "oldest_raw": from_epoch_ms(oldest) if oldest else None,
+        "newest_raw": from_epoch_ms(newest) if newest else None,
+    }
+
+# Held while a test runs so two tests never overlap, whoever starts them
+_test_lock = threading.Lock()
 
 def run_test_and_store():
     """Runs the network test and stores the results in the database."""
+    if not _test_lock.acquire(blocking=False):
+        logging.warning("A speed test is already running, skipping this run.")
+        return
+    try:
+        set_test_status("running", started=datetime.now().isoformat(), backend=settings.get('measurement_backend', 'speedtest'))
+        stored = False
+        try:
+            stored = _run_test_and_store()
+        finally:
+            set_test_status("idle", last_result="success" if stored else "failed", finished=datetime.now().isoformat())
+    finally:
+        _test_lock.release()
+
+# Whether a test is running, sent to dashboards as it changes
+test_status = {"state": "idle"}
+
+def set_test_status(state, **details):
+    global test_status
+    test_status = {"state": state, **details}
+    broadcaster.publish("status", test_status)
+
+def _run_test_and_store():
+    """Measures and stores one result; returns True if it was stored."""
+    global data_last_modified
     logging.info(f"Attempting to run test at {datetime.now()}")
     results = measure_network_quality()
     if results["download"] is not None: # Only store if test was successful
         try:
-            timestamp = datetime.now().isoformat()
-            with sqlite3.connect(db_path) as conn:
+            now = datetime.now()
+            timestamp = now.isoformat()
+            insert_start = time.perf_counter()
+            with get_db() as conn:
                 conn.execute('''
-                    INSERT INTO network_tests (timestamp, download_mbps, upload_mbps, latency_ms)
-                    VALUES (?, ?, ?, ?)
-                ''', (timestamp, results['download'], results['upload'], results['ping']))
+                    INSERT INTO network_tests (timestamp, download_mbps, upload_mbps, latency_ms, bytes_transferred, duration_ms)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (to_epoch_ms(now), results['download'], results['upload'], results['ping'],
+                      results.get('bytes_transferred'), results.get('duration_ms')))
+                values = {
+                    "download_mbps": results['download'],
+                    "upload_mbps": results['upload'],
+                    "latency_ms": results['ping'],
+                }
+                update_rollups(conn, now, values)
+                event_changes = record_test_events(conn, now, values)
+                if settings.get('agent_enabled'):
+                    conn.execute("INSERT OR IGNORE INTO agent_outbox (timestamp) VALUES (?)", (to_epoch_ms(now),))
+            DB_INSERT_SECONDS.observe(time.perf_counter() - insert_start)
+            data_last_modified = now
+            response_cache.clear()
+            publish_events(event_changes)
+            broadcaster.publish("measurement", {
+                "timestamp": timestamp,
+                "download_mbps": results['download'],
+                "upload_mbps": results['upload'],
+                "latency_ms": results['ping'],
+            })
             logging.info(f"Test run at {timestamp}: Download={results['download']:.2f} Mbps, Upload={results['upload']:.2f} Mbps, Latency={results['ping']:.2f} ms")
+            return True
         except sqlite3.Error as e:
             logging.error("Database error when storing results.", exc_info=True)
     else:
         logging.warning("Speed test failed, not storing results.")
+        if not results.get("cancelled"):
+            try:
+                with get_db() as conn:
+                    event_changes = record_failed_test(conn, datetime.now(), results)
+                publish_events(event_changes)
+            except sqlite3.Error:
+                logging.error("Database error when storing a failed test.", exc_info=True)
+    return False
 
-# Initialize database tables and load settings
-init_db()
-settings = load_settings()
-
-# Initialize and start the scheduler
-scheduler = BackgroundScheduler(daemon=True)
-scheduler.add_job(
-    run_test_and_store,
-    'interval',
-    minutes=settings.get('test_interval_minutes', 5),
-    id='speedtest_job',
-    next_run_time=datetime.now()
-)
-scheduler.start()
-logging.info(f"Scheduler started. Interval: {settings.get('test_interval_minutes', 15)} minutes.")
+# Learns the normal speeds per hour of day and reports degradations (see detection.py)
+detector = Detector()
+
+def load_detector(conn):
+    """Restores the detector state, or learns it from the last 30 days of history the first time."""
+    global detector
+    row = conn.execute("SELECT value FROM detector_state WHERE key = 'local'").fetchone()
+    if row:
+        detector = Detector.from_dict(json.loads(row["value"]))
+        return
+    detector = Detector()
+    since = to_epoch_ms(datetime.now() - timedelta(days=30))
+    rows = conn.execute(
+        "SELECT timestamp, download_mbps, upload_mbps, latency_ms FROM network_tests WHERE timestamp >= ? ORDER BY timestamp",
+        (since,)
+    )
+    learned = 0
+    for row in rows:
+        # Past degradations are not turned into events
+        detector.learn(dict(row), from_epoch_ms(row["timestamp"]))
+        learned += 1
+    with conn:
+        save_detector(conn)
+    logging.info(f"Detector baselines learned from {learned} stored results.")
+
+def save_detector(conn):
+    conn.execute("INSERT OR REPLACE INTO detector_state (key, value) VALUES ('local', ?)", (json.dumps(detector.to_dict()),))
+
+def insert_event(conn, kind, started, ended=None, metric=None, detail=None):
+    cursor = conn.execute(
+        "INSERT INTO events (kind, metric, started, ended, detail) VALUES (?, ?, ?, ?, ?)",
+        (kind, metric, to_epoch_ms(started), to_epoch_ms(ended) if ended else None, json.dumps(detail or {}))
+    )
+    return cursor.lastrowid
+
+def publish_events(changes):
+    """Tells the dashboards about events that were opened or closed, once they are committed."""
+    for event_id, kind, change in changes:
+        broadcaster.publish("event", {"id": event_id, "kind": kind, "change": change})
+
+def record_test_events(conn, when, values):
+    """Runs the detector on a stored result, in the transaction that stores it.
+
+    Opens, extends and closes degradation events, and closes an ongoing
+    outage now that a test succeeded again. Returns the (id, kind, change)
+    of the events that were opened or closed.
+    """
+    changes = []
+    outage = conn.execute("SELECT id FROM events WHERE kind = 'outage' AND ended IS NULL").fetchone()
+    if outage:
+        conn.execute("UPDATE events SET ended = ? WHERE id = ?", (to_epoch_ms(when), outage["id"]))
+        changes.append((outage["id"], "outage", "end"))
+    if not settings.get('detection_enabled', True):
+        return changes
+
+    for metric, change, info in detector.update(values, when):
+        if change == "start":
+            event_id = insert_event(conn, "degradation", when, metric=metric, detail={
+                "baseline": info["baseline"], "worst": info["value"], "tests": 1,
+            })
+            logging.warning(f"Degradation of {metric}: {info['value']:.2f} against a usual {info['baseline']:.2f}.")
+            changes.append((event_id, "degradation", "start"))
+            continue
+        event = conn.execute(
+            "SELECT id, detail FROM events WHERE kind = 'degradation' AND metric = ? AND ended IS NULL", (metric,)
+        ).fetchone()
+        if event is None:
+            continue
+        detail = json.loads(event["detail"])
+        if change == "continue":
+            worse = max if METRIC_DIRECTIONS[metric] > 0 else min
+            detail["worst"] = worse(detail["worst"], info["value"])
+            detail["tests"] += 1
+            conn.execute("UPDATE events SET detail = ? WHERE id = ?", (json.dumps(detail), event["id"]))
+        elif info.get("level_shift"):
+            # Lasted so long that it is the new normal, e.g. after a plan change
+            detail["level_shift"] = True
+            conn.execute("UPDATE events SET ended = ?, detail = ? WHERE id = ?", (to_epoch_ms(when), json.dumps(detail), event["id"]))
+            logging.info(f"Degradation of {metric} lasted {detail['tests']} tests and is now taken as the usual level.")
+            changes.append((event["id"], "degradation", "end"))
+        else:
+            conn.execute("UPDATE events SET ended = ? WHERE id = ?", (to_epoch_ms(when), event["id"]))
+            logging.info(f"Degradation of {metric} ended after {detail['tests']} tests.")
+            changes.append((event["id"], "degradation", "end"))
+    save_detector(conn)
+    return changes
+
+# Failures of the test itself rather than of the network: rate limits, setup
+# errors, crashed workers and unexpected exceptions
+TEST_FAILURE_FLAGS = ("rate_limited", "misconfigured", "worker_error", "unexpected")
 
+def record_failed_test(conn, when, results):
+    """Stores a failed test: a 'failed_test' event if the test itself failed (see TEST_FAILURE_FLAGS).
+
+    Any other failure is blamed on the network and extends or opens an outage.
+    Returns the (id, kind, change) of the event if one was opened.
+    """
+    error = results.get("error") or "Unknown error."
+    flags = [flag for flag in TEST_FAILURE_FLAGS if results.get(flag)]
+    if flags:
+        if results.get("unexpected"):
+            error = error.strip().splitlines()[-1] # The exception, without its traceback
+        event_id = insert_event(conn, "failed_test", when, ended=when, detail={"error": error, **dict.fromkeys(flags, True)})
+        return [(event_id, "failed_test", "start")]
+    outage = conn.execute("SELECT id, detail FROM events WHERE kind = 'outage' AND ended IS NULL").fetchone()
+    if outage:
+        detail = json.loads(outage["detail"])
+        detail["failed_tests"] += 1
+        detail["error"] = error
+        conn.execute("UPDATE events SET detail = ? WHERE id = ?", (json.dumps(detail), outage["id"]))
+        return []
+    event_id = insert_event(conn, "outage", when, detail={"failed_tests": 1, "error": error})
+    return [(event_id, "outage", "start")]
+
+def store_probe_window(window_start, summaries):
+    """Stores one window of latency probe summaries."""
+    timestamp = round(window_start * 1000)
+    with get_db() as conn:
+        conn.executemany('''
+            INSERT OR REPLACE INTO latency_probes (timestamp, target, sent, lost, min_ms, avg_ms, max_ms, jitter_ms)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (timestamp, target, s["sent"], s["lost"], s["min_ms"], s["avg_ms"], s["max_ms"], s["jitter_ms"])
+            for target, s in summaries.items()
+        ])
+
+# Columns of a result as exchanged between agents and the central instance
+INGEST_COLUMNS = ("timestamp", "download_mbps", "upload_mbps", "latency_ms", "bytes_transferred", "duration_ms")
+# Results per /api/ingest request
+INGEST_BATCH_SIZE = 500
+
+def agent_probe_id():
+    return settings.get('agent_probe_id') or socket.gethostname()
+
+def push_outbox():
+    """Scheduler job (agent mode): delivers spooled results to the central instance in batches.
+
+    Results stay in the outbox until the central instance confirms them, so
+    they are retried on the next run while it is unreachable. The central
+    instance ignores results it already has, so a retry after a lost
+    response does no harm.
+    """
+    if not settings.get('agent_enabled') or not settings.get('agent_central_url'):
+        return
+    import urllib.request
+    import urllib.error
+    url = settings['agent_central_url'].rstrip('/') + '/api/ingest'
+    conn = get_db()
+    while True:
+        rows = conn.execute(f'''
+            SELECT {", ".join("t." + column for column in INGEST_COLUMNS)}
+            FROM agent_outbox o JOIN network_tests t ON t.timestamp = o.timestamp
+            ORDER BY o.timestamp LIMIT ?
+        ''', (INGEST_BATCH_SIZE,)).fetchall()
+        if not rows:
+            # Drop entries whose results were removed by retention in the meantime
+            with conn:
+                conn.execute("DELETE FROM agent_outbox WHERE timestamp NOT IN (SELECT timestamp FROM network_tests)")
+            return
+        body = json.dumps({"probe_id": agent_probe_id(), "results": [dict(row) for row in rows]}).encode()
+        push = urllib.request.Request(url, data=body, method="POST", headers={
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {settings.get('agent_token', '')}",
+        })
+        try:
+            with urllib.request.urlopen(push, timeout=30) as response:
+                response.read()
+        except (urllib.error.URLError, OSError) as e:
+            pending = conn.execute("SELECT COUNT(*) FROM agent_outbox").fetchone()[0]
+            logging.warning(f"Could not push results to {url}, {pending} results spooled: {e}")
+            return
+        with conn:
+            conn.executemany("DELETE FROM agent_outbox WHERE timestamp = ?", [(row["timestamp"],) for row in rows])
+        logging.info(f"Pushed {len(rows)} results to {url}.")
+
+latency_prober = None
+
+def restart_latency_prober():
+    """(Re)starts the latency prober with the current settings, or stops it if disabled."""
+    global latency_prober
+    if latency_prober is not None:
+        latency_prober.stop()
+        latency_prober = None
+    targets = settings.get('probe_targets', [])
+    if settings.get('probe_enabled') and targets:
+        latency_prober = LatencyProber(
+            targets,
+            store_probe_window,
+            interval=settings.get('probe_interval_seconds', 5),
+            window=settings.get('probe_window_seconds', 60),
+        )
+        latency_prober.start()
+        logging.info(f"Latency probes started for {', '.join(targets)}.")
+
+# Set up by create_app(); these defaults only serve until then
+settings = get_default_settings()
+# Used for ETag/Last-Modified on the data API; bumped on every stored measurement
+data_last_modified = datetime.fromtimestamp(0)
+# Pushes new measurements and test status to the dashboards on /api/stream
+broadcaster = Broadcaster()
+scheduler = None
+
+def record_scheduler_lag(event):
+    """Scheduler listener: observes how late job runs start, and counts the missed ones."""
+    from apscheduler.events import EVENT_JOB_MISSED
+    if event.code == EVENT_JOB_MISSED:
+        SCHEDULER_MISSED.inc(job=event.job_id)
+        return
+    lag = datetime.now(timezone.utc) - max(event.scheduled_run_times)
+    SCHEDULER_LAG_SECONDS.observe(max(lag.total_seconds(), 0), job=event.job_id)
+
+def create_scheduler():
+    """Returns a scheduler with the speed test, agent push and retention jobs, not yet started."""
+    from apscheduler.schedulers.background import BackgroundScheduler # pip install apscheduler
+    from apscheduler.events import EVENT_JOB_SUBMITTED, EVENT_JOB_MISSED
+
+    new_scheduler = BackgroundScheduler(daemon=True)
+    new_scheduler.add_listener(record_scheduler_lag, EVENT_JOB_SUBMITTED | EVENT_JOB_MISSED)
+    new_scheduler.add_job(
+        run_scheduled_test,
+        'interval',
+        minutes=settings.get('test_interval_minutes', 5),
+        id='speedtest_job',
+        next_run_time=datetime.now(),
+        max_instances=1, # Never start a test while the previous one is still running
+        coalesce=True
+    )
+    new_scheduler.add_job(
+        push_outbox,
+        'interval',
+        minutes=1,
+        id='agent_push_job',
+        max_instances=1,
+        coalesce=True
+    )
+    new_scheduler.add_job(
+        apply_retention,
+        'interval',
+        hours=1,
+        id='retention_job',
+        next_run_time=datetime.now() + timedelta(minutes=1),
+        max_instances=1,
+        coalesce=True
+    )
+    return new_scheduler
+
+SERIES_KEYS = ("download_mbps", "upload_mbps", "latency_ms")
+
+def lttb_indices(xs, ys, threshold):
+    """Largest-Triangle-Three-Buckets downsampling.
+
+    Returns the indices of the points to keep so that the visual shape of the
+    series is preserved. Runs in a single O(n) pass over the input.
+    """
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+
+    every = (n - 2) / (threshold - 2)
+    selected = [0]
+    a = 0
+    for i in range(threshold - 2):
+        # Average point of the next bucket, used as the third triangle vertex
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        avg_len = avg_end - avg_start
+        avg_x = sum(xs[avg_start:avg_end]) / avg_len
+        avg_y = sum(ys[avg_start:avg_end]) / avg_len
+
+        # Pick the point in the current bucket forming the largest triangle
+        range_start = int(i * every) + 1
+        range_end = int((i + 1) * every) + 1
+        ax, ay = xs[a], ys[a]
+        max_area = -1.0
+        next_a = range_start
+        for j in range(range_start, range_end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                next_a = j
+        selected.append(next_a)
+        a = next_a
+
+    selected.append(n - 1)
+    return selected
+
+def downsample_rows(rows, max_points):
+    """Downsamples the series in `rows` with LTTB to at most `max_points` rows.
+
+    Each series is downsampled on its own and the rows picked for any series
+    are kept, so every series keeps its shape while the response stays in the
+    usual row format. The series rarely pick the same rows, so the per-series
+    target is lowered until the union fits.
+    """
+    if len(rows) <= max_points:
+        return rows
+
+    all_xs = [row['timestamp'] for row in rows]
+    series = []
+    for key in SERIES_KEYS:
+        row_indices = [i for i, row in enumerate(rows) if row[key] is not None]
+        series.append((row_indices, [all_xs[i] for i in row_indices], [rows[i][key] for i in row_indices]))
+
+    min_threshold = max(max_points // len(SERIES_KEYS), 3)
+    threshold = max_points
+    while True:
+        keep = set()
+        for row_indices, xs, ys in series:
+            keep.update(row_indices[i] for i in lttb_indices(xs, ys, threshold))
+        if len(keep) <= max_points or threshold <= min_threshold:
+            break
+        # The union grows roughly linearly with the per-series target
+        threshold = max(threshold * max_points // len(keep), min_threshold)
+
+    keep = sorted(keep)
+    if len(keep) > max_points:
+        # Only reachable for tiny max_points, where LTTB cannot go lower
+        step = (len(keep) - 1) / (max_points - 1)
+        keep = [keep[round(i * step)] for i in range(max_points)]
+    return [rows[i] for i in keep]
+
+
+RESOLUTIONS = ("raw", "hourly", "daily")
+# Longest windows served from raw rows and from the hourly rollup; anything
+# longer is served from the daily rollup. Open-ended windows ("all") are
+# sized by the results actually stored, see open_window_resolution().
+RAW_MAX_SPAN = timedelta(days=7)
+HOURLY_MAX_SPAN = timedelta(days=90)
+
+def choose_resolution(span):
+    """Picks the cheapest data source that still gives a useful chart for a window of length `span`."""
+    if span is None:
+        return "daily"
+    if span <= RAW_MAX_SPAN:
+        return "raw"
+    if span <= HOURLY_MAX_SPAN:
+        return "hourly"
+    return "daily"
+
+def covering_resolution(resolution, start_time):
+    """Returns `resolution`, or a coarser one if retention removed its data from the start of the window.
+
+    Rollups outlive the raw rows (and daily rollups the hourly ones), so a
+    window starting before the oldest raw row is served from the hourly
+    rollups if those reach back further, and likewise from the daily ones.
+    """
+    conn = get_db()
+    sources = {"raw": ("network_tests", "timestamp"), **{name: (table, "bucket") for name, table in ROLLUP_TABLES.items()}}
+    # Both columns are primary keys, so these are single index lookups
+    oldest = {name: conn.execute(f'SELECT MIN({column}) FROM {table}').fetchone()[0] for name, (table, column) in sources.items()}
+    for finer, coarser in (("raw", "hourly"), ("hourly", "daily")):
+        if resolution != finer or oldest[coarser] is None:
+            continue
+        if oldest[finer] is None:
+            resolution = coarser
+        elif start_time < from_epoch_ms(oldest[finer]) and oldest[coarser] < to_epoch_ms(rollup_bucket(coarser, from_epoch_ms(oldest[finer]))):
+            resolution = coarser
+    return resolution
+
+# Open-ended windows holding at most this many results are served raw, whatever their span
+RAW_MAX_ROWS = 2016 # A week of tests every 5 minutes
+
+def open_window_resolution(end_time=None):
+    """Picks the resolution for a window without a start ("all") from the results actually stored.
+
+    The history starts at the oldest daily rollup, which outlives the raw
+    rows that retention removes. Raw rows are only used if they still reach
+    back that far and there are few of them.
+    """
+    conn = get_db()
+    # Both are primary keys, so these are single index lookups
+    oldest = conn.execute(f'SELECT MIN(bucket) FROM {ROLLUP_TABLES["daily"]}').fetchone()[0]
+    oldest_raw = conn.execute('SELECT MIN(timestamp) FROM network_tests').fetchone()[0]
+    if oldest is None:
+        return "raw"
+    if oldest_raw is not None and rollup_bucket("daily", from_epoch_ms(oldest_raw)) <= from_epoch_ms(oldest):
+        condition = 'WHERE timestamp < ?' if end_time else ''
+        params = [to_epoch_ms(end_time)] if end_time else []
+        # Whether there are more than RAW_MAX_ROWS results, without counting all of them
+        beyond = conn.execute(f'SELECT 1 FROM network_tests {condition} LIMIT 1 OFFSET ?', params + [RAW_MAX_ROWS]).fetchone()
+        if beyond is None:
+            return "raw"
+    return choose_resolution((end_time or datetime.now()) - from_epoch_ms(oldest))
+
+def query_raw(start_time, since=None, probe_id=None, end_time=None):
+    """Returns the raw rows since `start_time` (and before `end_time`) and a quantile sketch per metric.
+
+    If `since` is given, only rows newer than it are returned, but the
+    sketches still cover the whole window. With `probe_id`, the results
+    ingested from that agent are read instead of this instance's own.
+    """
+    conditions = []
+    params = []
+    if probe_id:
+        table = "probe_results"
+        conditions.append('probe_id = ?')
+        params.append(probe_id)
+    else:
+        table = "network_tests"
+    if start_time:
+        conditions.append('timestamp >= ?')
+        params.append(to_epoch_ms(start_time))
+    if end_time:
+        conditions.append('timestamp < ?')
+        params.append(to_epoch_ms(end_time))
+
+    query = f'''
+        SELECT timestamp, download_mbps, upload_mbps, latency_ms
+        FROM {table}
+    '''
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+
+    query += ' ORDER BY timestamp ASC'
+
+    since_ms = to_epoch_ms(since) if since else None
+    data = []
+    sketches = {metric: QuantileSketch() for metric, _ in ROLLUP_METRICS}
+    try:
+        for row in get_db().execute(query, tuple(params)):
+            point = dict(row)
+            for metric, column in ROLLUP_METRICS:
+                if point[column] is not None:
+                    sketches[metric].add(point[column])
+            if since_ms is None or point["timestamp"] > since_ms:
+                data.append(point)
+    except sqlite3.Error as e:
+        logging.error("Error fetching data from database.", exc_info=True)
+
+    return data, sketches
+
+def query_rollups(resolution, start_time, since=None, end_time=None):
+    """Returns per-bucket means since `start_time` (and before `end_time`) and the merged quantile sketch per metric.
+
+    If `since` is given, only the bucket containing it and newer buckets are
+    returned, since that bucket may have changed after the client saw it.
+    """
+    since_bucket = to_epoch_ms(rollup_bucket(resolution, since)) if since else None
+    table = ROLLUP_TABLES[resolution]
+    conditions = []
+    params = []
+    if start_time:
+        conditions.append('bucket >= ?')
+        params.append(to_epoch_ms(rollup_bucket(resolution, start_time)))
+    if end_time:
+        conditions.append('bucket < ?')
+        params.append(to_epoch_ms(end_time))
+
+    query = f"SELECT * FROM {table}"
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += ' ORDER BY bucket ASC'
+
+    data = []
+    sketches = {metric: QuantileSketch() for metric, _ in ROLLUP_METRICS}
+    try:
+        for row in get_db().execute(query, tuple(params)):
+            rollup = rollup_from_row(row)
+            point = {"timestamp": row["bucket"]}
+            for metric, column in ROLLUP_METRICS:
+                stats = rollup[metric]
+                point[column] = stats["sum"] / stats["count"] if stats["count"] else None
+                sketches[metric].merge(stats["sketch"])
+            if since_bucket is None or row["bucket"] >= since_bucket:
+                data.append(point)
+    except sqlite3.Error as e:
+        logging.error("Error fetching rollups from database.", exc_info=True)
+
+    return data, sketches
+
+# Page sizes of /api/network_data?limit=
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+
+def query_page(resolution, start_time, end_time, cursor, limit, probe_id=None):
+    """Returns up to `limit` points after `cursor` (epoch ms, exclusive) and the cursor of the next page.
+
+    Keyset pagination: each page is a range scan on the timestamp (or bucket)
+    primary key that starts right after the previous page, so any page costs
+    the same however deep into the history it is. The next cursor is None on
+    the last page.
+    """
+    conditions = []
+    params = []
+    if resolution == "raw":
+        key = "timestamp"
+        if probe_id:
+            table = "probe_results"
+            conditions.append('probe_id = ?')
+            params.append(probe_id)
+        else:
+            table = "network_tests"
+        columns = ", ".join(("timestamp",) + SERIES_KEYS)
+        if start_time:
+            conditions.append('timestamp >= ?')
+            params.append(to_epoch_ms(start_time))
+    else:
+        key = "bucket"
+        table = ROLLUP_TABLES[resolution]
+        # Per-bucket means, computed without decoding the sketches
+        columns = ", ".join(["bucket AS timestamp"] + [
+            f"{metric}_sum / NULLIF({metric}_count, 0) AS {column}" for metric, column in ROLLUP_METRICS
+        ])
+        if start_time:
+            conditions.append('bucket >= ?')
+            params.append(to_epoch_ms(rollup_bucket(resolution, start_time)))
+    if end_time:
+        conditions.append(f'{key} < ?')
+        params.append(to_epoch_ms(end_time))
+    if cursor is not None:
+        conditions.append(f'{key} > ?')
+        params.append(cursor)
+
+    query = f"SELECT {columns} FROM {table}"
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    # One extra row tells whether there is another page
+    query += f' ORDER BY {key} ASC LIMIT ?'
+    params.append(limit + 1)
+
+    try:
+        data = [dict(row) for row in get_db().execute(query, tuple(params))]
+    except sqlite3.Error:
+        logging.error("Error fetching a page from database.", exc_info=True)
+        data = []
+    if len(data) > limit:
+        data = data[:limit]
+        return data, data[-1]["timestamp"]
+    return data, None
+
+PERCENTILES = (5, 25, 50, 75, 95, 99)
+# Rollup metric name -> name used in API responses
+API_METRIC_NAMES = {"download": "download", "upload": "upload", "latency": "ping"}
+
+def summarize_sketches(sketches):
+    """Returns the medians and the PERCENTILES of every metric's sketch."""
+    percentiles = {
+        API_METRIC_NAMES[metric]: {f"p{p}": sketch.quantile(p / 100) for p in PERCENTILES}
+        for metric, sketch in sketches.items()
+    }
+    medians = {name: values["p50"] for name, values in percentiles.items()}
+    return medians, percentiles
+
+class ResponseCache:
+    """Thread-safe LRU cache of serialized API responses.
+
+    Entries expire after `max_age` seconds so that relative windows
+    ("last hour") keep moving even when no new measurement arrives.
+    """
+
+    def __init__(self, max_size, max_age=60):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] <= self.max_age:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries), "max_size": self.max_size}
+
+# Resized from the settings by create_app()
+response_cache = ResponseCache(64)
+
+def data_cache_key(*parts):
+    """Identifies a data API response: the request, the data version and any extra `parts`."""
+    return json.dumps([data_last_modified.isoformat(), sorted(request.args.items(multi=True)), *parts], default=str)
+
+# Responses smaller than this are not worth compressing
+MIN_COMPRESS_BYTES = 1024
+
+def negotiate_content_encoding():
+    """Picks the best compression the client accepts: brotli (if installed), gzip or none."""
+    offers = (["br"] if brotli else []) + ["gzip", "identity"]
+    encoding = request.accept_encodings.best_match(offers, default="identity")
+    return None if encoding == "identity" else encoding
+
+def compress_body(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+COLUMNAR_DECIMALS = 3
+
+def to_columnar(data, delta_encode=False):
+    """Converts rows to parallel arrays with epoch-ms timestamps.
+
+    With `delta_encode`, each timestamp after the first is stored as the
+    difference from the previous one, which keeps the numbers short. Values
+    are rounded to COLUMNAR_DECIMALS places, well below measurement noise.
+    """
+    timestamps = [point["timestamp"] for point in data]
+    if delta_encode:
+        timestamps = timestamps[:1] + [b - a for a, b in zip(timestamps, timestamps[1:])]
+    columns = {"timestamp": timestamps}
+    for key in SERIES_KEYS:
+        columns[key] = [None if point[key] is None else round(point[key], COLUMNAR_DECIMALS) for point in data]
+    return columns
+
+def window_version(start_time):
+    """Returns the start of a relative window ("last hour") to the minute, for cache keys and validators.
+
+    A relative window moves even when no measurement arrives: old points
+    leave it and its medians change, so its responses must not stay valid.
+    """
+    return start_time.replace(second=0, microsecond=0) if start_time else None
+
+def make_conditional_response(response, cache_key, window_start=None):
+    """Adds ETag/Last-Modified validators so unchanged polls get a 304.
+
+    The validators only change when a new measurement is stored, the
+    request changes or, for relative windows, `window_start` (see
+    window_version()) moves on, so clients must revalidate instead of
+    caching blindly.
+    """
+    response.set_etag(hashlib.md5(cache_key.encode()).hexdigest())
+    response.last_modified = max(data_last_modified, window_start or data_last_modified).astimezone()
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+def parse_datetime_arg(name):
+    """Returns the ISO time in request argument `name` as a datetime, or None if it is missing.
+
+    Times with an offset (or Z) are converted to naive local time, like
+    every other time in this app.
+    """
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError as e:
+        raise ValueError(f"{name}: {e}") from None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+def time_frame_start():
+    """Returns the start of the configured `time_frame` in the request (the default one if missing), or None for "all"."""
+    time_frame_key = request.args.get('time_frame', settings.get('default_time_frame', '1hour'))
+    time_frames = settings.get('time_frames', get_default_settings()['time_frames'])
+    delta_args = time_frames.get(time_frame_key, {}).get('delta')
+    return datetime.now() - timedelta(**delta_args) if delta_args else None
 
 @app.route('/api/network_data', methods=['GET'])
 def get_network_data():
-    """API endpoint to retrieve network data with optional time filtering."""
+    """API endpoint to retrieve network data with optional time filtering.
+
+    The window is either a configured `time_frame` or an explicit `start`
+    and/or `end` (ISO times, end exclusive). With `limit` and/or `cursor` the
+    window is returned in pages of `limit` points: pass the `next_cursor` of
+    a page as `cursor` to get the next one. Pages contain points only, no
+    medians or percentiles, and cannot be combined with `max_points` or `since`.
+    """
     time_frame_key = request.args.get('time_frame', settings.get('default_time_frame', '1hour'))
     start_time = None
+    end_time = None
+    span = None
+    window_start = None # Set for relative windows, which move with the clock
+
+    max_points = request.args.get('max_points')
+    if max_points is not None:
+        try:
+            max_points = int(max_points)
+            if max_points < 3:
+                raise ValueError("max_points must be at least 3.")
+        except ValueError as e:
+            return jsonify({"status": "error", "message": f"Invalid max_points: {e}"}), 400
+
+    # Optional cursor: only return points newer than the last one the client has
+    try:
+        since = parse_datetime_arg('since')
+    except ValueError as e:
+        return jsonify({"status": "error", "message": f"Invalid {e}"}), 400
+
+    # Explicit window, instead of a time frame ending now
+    try:
+        range_start = parse_datetime_arg('start')
+        range_end = parse_datetime_arg('end')
+        if range_start and range_end and range_end <= range_start:
+            raise ValueError("end must be after start.")
+    except ValueError as e:
+        return jsonify({"status": "error", "message": f"Invalid range: {e}"}), 400
+
+    # Keyset pagination
+    limit = request.args.get('limit')
+    cursor = request.args.get('cursor')
+    paged = limit is not None or cursor is not None
+    if paged:
+        try:
+            limit = int(limit) if limit is not None else DEFAULT_PAGE_SIZE
+            if not 1 <= limit <= MAX_PAGE_SIZE:
+                raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}.")
+            cursor = int(cursor) if cursor is not None else None
+            if max_points or since:
+                raise ValueError("pages cannot be combined with max_points or since.")
+        except ValueError as e:
+            return jsonify({"status": "error", "message": f"Invalid page: {e}"}), 400
+
+    # Opt-in columnar wire format: {"columns": {"timestamp": [...], "download_mbps": [...], ...}}
+    response_format = request.args.get('format', 'rows')
+    if response_format not in ('rows', 'columnar'):
+        return jsonify({"status": "error", "message": f"Invalid format: {response_format}"}), 400
+    timestamp_encoding = request.args.get('encoding')
+    if timestamp_encoding not in (None, 'delta'):
+        return jsonify({"status": "error", "message": f"Invalid encoding: {timestamp_encoding}"}), 400
 
     time_frames = settings.get('time_frames', get_default_settings()['time_frames'])
-    if time_frame_key != 'all' and time_frame_key in time_frames:
+    if range_start or range_end:
+        start_time = range_start
+        end_time = range_end
+        if range_start:
+            span = (range_end or datetime.now()) - range_start
+    elif time_frame_key != 'all' and time_frame_key in time_frames:
         delta_args = time_frames[time_frame_key].get('delta')
         if delta_args:
-            start_time = datetime.now() - timedelta(**delta_args)
+            span = timedelta(**delta_args)
+            start_time = datetime.now() - span
+            window_start = window_version(start_time)
 
-    query = '''
-        SELECT timestamp, download_mbps, upload_mbps, latency_ms
-        FROM network_tests
-    '''
+    resolution = request.args.get('resolution')
+    if not resolution:
+        resolution = covering_resolution(choose_resolution(span), start_time) if span is not None else open_window_resolution(end_time)
+    if resolution not in RESOLUTIONS:
+        return jsonify({"status": "error", "message": f"Invalid resolution: {resolution}"}), 400
+
+    # Results ingested from agents (see /api/ingest) have no rollups
+    probe_id = request.args.get('probe') or None
+    if probe_id == LOCAL_PROBE_ID:
+        probe_id = None
+    if probe_id:
+        resolution = "raw"
+
+    content_encoding = negotiate_content_encoding()
+    cache_key = data_cache_key(time_frames.get(time_frame_key), content_encoding, window_start)
+    cached = response_cache.get(cache_key)
+    if cached is None:
+        query_start = time.perf_counter()
+        if paged:
+            data, next_cursor = query_page(resolution, start_time, end_time, cursor, limit, probe_id)
+            payload = {"resolution": resolution, "next_cursor": next_cursor}
+        else:
+            if resolution == "raw":
+                data, sketches = query_raw(start_time, since, probe_id, end_time)
+            else:
+                data, sketches = query_rollups(resolution, start_time, since, end_time)
+            medians, percentiles = summarize_sketches(sketches)
+            latest = from_epoch_ms(data[-1]["timestamp"]).isoformat() if data else request.args.get('since')
+
+            # Downsample only after the medians, which must reflect every row
+            if max_points:
+                data = downsample_rows(data, max_points)
+
+            payload = {
+                "medians": medians,
+                "percentiles": percentiles,
+                "resolution": resolution,
+                "latest": latest,
+            }
+        payload["start"] = start_time.isoformat() if start_time else None
+        payload["end"] = end_time.isoformat() if end_time else None
+
+        serialize_start = time.perf_counter()
+        NETWORK_DATA_SECONDS.observe(serialize_start - query_start, stage="query")
+
+        # Return a structured response
+        if response_format == 'columnar':
+            payload["columns"] = to_columnar(data, delta_encode=timestamp_encoding == 'delta')
+            payload["timestamp_encoding"] = timestamp_encoding or "absolute"
+        else:
+            for point in data:
+                point["timestamp"] = from_epoch_ms(point["timestamp"]).isoformat()
+            payload["time_series"] = data
+        body = app.json.dumps(payload).encode()
+        if content_encoding and len(body) >= MIN_COMPRESS_BYTES:
+            body = compress_body(body, content_encoding)
+        else:
+            content_encoding = None
+        NETWORK_DATA_SECONDS.observe(time.perf_counter() - serialize_start, stage="serialize")
+        cached = (body, content_encoding)
+        response_cache.put(cache_key, cached)
+
+    body, content_encoding = cached
+    NETWORK_DATA_BYTES.observe(len(body))
+
+    response = app.response_class(body, mimetype=app.json.mimetype)
+    if content_encoding:
+        response.headers['Content-Encoding'] = content_encoding
+    response.vary.add('Accept-Encoding')
+    return make_conditional_response(response, cache_key, window_start)
+
+HEATMAP_WEEKDAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+
+@app.route('/api/heatmap', methods=['GET'])
+def get_heatmap():
+    """API endpoint returning the median and p95 of every metric per day of week and time of day.
+
+    The grid has 7 rows (Monday first), or a single row with `days=all`,
+    and 24 / `hours` columns (`hours` divides 24, default 1). The window is
+    a `time_frame` or an explicit `start`/`end`, as for /api/network_data.
+    `metric` (download, upload or ping) limits the response to one metric,
+    which is also three times faster to compute than all of them.
+    Cells are merged from the quantile sketches of the hourly rollups, so
+    no raw rows are read; cells without data are null. If hourly retention
+    removed the start of the window, `covered_start` is when the grid starts.
+    """
+    try:
+        start_time = parse_datetime_arg('start')
+        end_time = parse_datetime_arg('end')
+        hours_per_column = int(request.args.get('hours', 1))
+        if hours_per_column < 1 or 24 % hours_per_column:
+            raise ValueError("hours must divide 24.")
+    except ValueError as e:
+        return jsonify({"status": "error", "message": f"Invalid heatmap request: {e}"}), 400
+    by_weekday = request.args.get('days', 'week') == 'week'
+    selected_metrics = [metric for metric, _ in ROLLUP_METRICS if request.args.get('metric', API_METRIC_NAMES[metric]) == API_METRIC_NAMES[metric]]
+    if not selected_metrics:
+        return jsonify({"status": "error", "message": f"Invalid metric: {request.args.get('metric')}"}), 400
+    window_start = None
+    if not start_time and not end_time:
+        start_time = time_frame_start()
+        window_start = window_version(start_time)
+
+    cache_key = data_cache_key("heatmap", window_start)
+    cached = response_cache.get(cache_key)
+    if cached is None:
+        rows = 7 if by_weekday else 1
+        columns = 24 // hours_per_column
+        # Bin counts per cell, keyed like the stored sketches so they can be added up without converting every key
+        grids = {metric: [[{} for _ in range(columns)] for _ in range(rows)] for metric in selected_metrics}
+
+        conditions = []
+        params = []
+        if start_time:
+            conditions.append('bucket >= ?')
+            params.append(to_epoch_ms(rollup_bucket("hourly", start_time)))
+        if end_time:
+            conditions.append('bucket < ?')
+            params.append(to_epoch_ms(end_time))
+        sketch_columns = ", ".join(f"{metric}_sketch" for metric in selected_metrics)
+        query = f"SELECT bucket, {sketch_columns} FROM {ROLLUP_TABLES['hourly']}"
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+
+        for row in get_db().execute(query, tuple(params)):
+            bucket = from_epoch_ms(row["bucket"])
+            row_index = bucket.weekday() if by_weekday else 0
+            column_index = bucket.hour // hours_per_column
+            for metric in selected_metrics:
+                if row[f"{metric}_sketch"]:
+                    bins = grids[metric][row_index][column_index]
+                    for key, count in json.loads(row[f"{metric}_sketch"]).items():
+                        bins[key] = bins.get(key, 0) + count
+
+        grids = {
+            metric: [[QuantileSketch.from_dict(bins) for bins in grid_row] for grid_row in grid]
+            for metric, grid in grids.items()
+        }
+        cells = {
+            API_METRIC_NAMES[metric]: {
+                "median": [[sketch.quantile(0.5) for sketch in grid_row] for grid_row in grid],
+                "p95": [[sketch.quantile(0.95) for sketch in grid_row] for grid_row in grid],
+                "count": [[sketch.count for sketch in grid_row] for grid_row in grid],
+            }
+            for metric, grid in grids.items()
+        }
+        # Times of day only survive in the hourly rollups. If retention removed them
+        # from the start of the window, the grid covers less than asked for.
+        covered_start = None
+        if covering_resolution("hourly", start_time or datetime.min) == "daily":
+            oldest_hourly = get_db().execute(f"SELECT MIN(bucket) FROM {ROLLUP_TABLES['hourly']}").fetchone()[0]
+            covered_start = from_epoch_ms(oldest_hourly).isoformat() if oldest_hourly is not None else None
+        payload = {
+            "row_labels": list(HEATMAP_WEEKDAYS) if by_weekday else ["All days"],
+            "column_labels": [f"{hour:02d}:00" for hour in range(0, 24, hours_per_column)],
+            "hours_per_column": hours_per_column,
+            "cells": cells,
+            "start": start_time.isoformat() if start_time else None,
+            "end": end_time.isoformat() if end_time else None,
+            "covered_start": covered_start,
+        }
+        cached = app.json.dumps(payload).encode()
+        response_cache.put(cache_key, cached)
+
+    response = app.response_class(cached, mimetype=app.json.mimetype)
+    return make_conditional_response(response, cache_key, window_start)
+
+EVENT_KINDS = ("degradation", "outage", "failed_test")
+
+@app.route('/api/events', methods=['GET'])
+def get_events():
+    """API endpoint listing the events that overlap a window, oldest first.
+
+    The window is a `time_frame` or an explicit `start`/`end`, as for
+    /api/network_data; `kind` limits the list to one kind of event.
+    Ongoing events have an `end` of null.
+    """
+    try:
+        start_time = parse_datetime_arg('start')
+        end_time = parse_datetime_arg('end')
+    except ValueError as e:
+        return jsonify({"status": "error", "message": f"Invalid range: {e}"}), 400
+    if not start_time and not end_time:
+        start_time = time_frame_start()
+
+    conditions = []
     params = []
+    kind = request.args.get('kind')
+    if kind:
+        if kind not in EVENT_KINDS:
+            return jsonify({"status": "error", "message": f"Invalid kind: {kind}"}), 400
+        conditions.append('kind = ?')
+        params.append(kind)
+    if start_time:
+        conditions.append('(ended IS NULL OR ended >= ?)')
+        params.append(to_epoch_ms(start_time))
+    if end_time:
+        conditions.append('started < ?')
+        params.append(to_epoch_ms(end_time))
+    query = "SELECT * FROM events"
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += ' ORDER BY started ASC'
+
+    events = [{
+        "id": row["id"],
+        "kind": row["kind"],
+        "metric": row["metric"],
+        "start": from_epoch_ms(row["started"]).isoformat(),
+        "end": from_epoch_ms(row["ended"]).isoformat() if row["ended"] is not None else None,
+        "detail": json.loads(row["detail"] or "{}"),
+    } for row in get_db().execute(query, tuple(params))]
+    return jsonify({"events": events})
+
+# Points per probe target when the dashboard does not ask for a number
+DEFAULT_PROBE_POINTS = 1000
+
+@app.route('/api/probe_data', methods=['GET'])
+def get_probe_data():
+    """API endpoint to retrieve latency probe windows, grouped by target.
+
+    Windows are merged into equal buckets so that each target has at most
+    `max_points` points (default DEFAULT_PROBE_POINTS): latency and jitter
+    are averaged, min and max kept and loss computed over the whole bucket.
+    """
+    try:
+        max_points = int(request.args.get('max_points', DEFAULT_PROBE_POINTS))
+        if max_points < 1:
+            raise ValueError("max_points must be at least 1.")
+    except ValueError as e:
+        return jsonify({"status": "error", "message": f"Invalid max_points: {e}"}), 400
+    start_time = time_frame_start()
+    window_start = window_version(start_time)
+
+    # Probe windows are stored every minute, independent of data_last_modified,
+    # so responses are only cached for the cache's max_age and get no validators
+    cache_key = data_cache_key("probes", window_start)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return app.response_class(cached, mimetype=app.json.mimetype)
+
+    targets = {}
+    try:
+        conn = get_db()
+        if start_time:
+            start_ms = to_epoch_ms(start_time)
+        else:
+            start_ms = conn.execute("SELECT MIN(timestamp) FROM latency_probes").fetchone()[0] or 0
+        bucket_ms = max(math.ceil((to_epoch_ms(datetime.now()) - start_ms) / max_points), 1)
+        query = """
+            SELECT target, timestamp - (timestamp - ?) % ? AS bucket, SUM(sent) AS sent, SUM(lost) AS lost,
+                   MIN(min_ms) AS min_ms, AVG(avg_ms) AS avg_ms, MAX(max_ms) AS max_ms, AVG(jitter_ms) AS jitter_ms
+            FROM latency_probes WHERE timestamp >= ?
+            GROUP BY target, bucket ORDER BY bucket ASC
+        """
+        for row in conn.execute(query, (start_ms, bucket_ms, start_ms)):
+            series = targets.setdefault(row["target"], {
+                "timestamp": [], "avg_ms": [], "min_ms": [], "max_ms": [], "jitter_ms": [], "loss_pct": []
+            })
+            series["timestamp"].append(row["bucket"])
+            for key in ("avg_ms", "min_ms", "max_ms", "jitter_ms"):
+                series[key].append(row[key])
+            series["loss_pct"].append(100 * row["lost"] / row["sent"] if row["sent"] else None)
+    except sqlite3.Error:
+        logging.error("Error fetching latency probes from database.", exc_info=True)
+        return jsonify({"targets": targets})
+    body = app.json.dumps({"targets": targets, "bucket_seconds": bucket_ms / 1000}).encode()
+    response_cache.put(cache_key, body)
+    return app.response_class(body, mimetype=app.json.mimetype)
+
+# Stands for this instance's own results wherever a probe ID is expected
+LOCAL_PROBE_ID = "local"
+# Largest number of results accepted in one /api/ingest request
+MAX_INGEST_RESULTS = 5000
+
+def parse_ingest_result(result):
+    """Validates one ingested result and returns it as a row tuple in INGEST_COLUMNS order."""
+    if not isinstance(result, dict) or not isinstance(result.get("timestamp"), int):
+        raise ValueError("every result needs an integer epoch-ms 'timestamp'.")
+    row = [result["timestamp"]]
+    for column in INGEST_COLUMNS[1:]:
+        value = result.get(column)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+            raise ValueError(f"'{column}' must be a number or null.")
+        row.append(value)
+    return tuple(row)
+
+@app.route('/api/ingest', methods=['POST'])
+def ingest_results():
+    """Central instance: accepts a batch of results pushed by an agent.
+
+    Body: {"probe_id": "...", "results": [{"timestamp": epoch_ms, "download_mbps": ..., ...}]}.
+    The batch is inserted in one transaction; results that were already
+    received are ignored, so agents can safely retry.
+    """
+    token = settings.get('ingest_token')
+    if not token:
+        return jsonify({"status": "error", "message": "Ingestion is disabled on this instance."}), 403
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+        return jsonify({"status": "error", "message": "Invalid ingest token."}), 401
+
+    payload = request.get_json(silent=True) or {}
+    probe_id = payload.get('probe_id')
+    results = payload.get('results')
+    try:
+        if not isinstance(probe_id, str) or not probe_id.strip() or probe_id == LOCAL_PROBE_ID:
+            raise ValueError(f"'probe_id' must be a non-empty string other than '{LOCAL_PROBE_ID}'.")
+        if not isinstance(results, list) or len(results) > MAX_INGEST_RESULTS:
+            raise ValueError(f"'results' must be a list of at most {MAX_INGEST_RESULTS} results.")
+        rows = [(probe_id.strip(), *parse_ingest_result(result)) for result in results]
+    except ValueError as e:
+        return jsonify({"status": "error", "message": f"Invalid ingest data: {e}"}), 400
 
+    global data_last_modified
+    conn = get_db()
+    with conn:
+        before = conn.total_changes
+        conn.executemany(f'''
+            INSERT OR IGNORE INTO probe_results (probe_id, {", ".join(INGEST_COLUMNS)})
+            VALUES (?, {", ".join("?" * len(INGEST_COLUMNS))})
+        ''', rows)
+        accepted = conn.total_changes - before
+    if accepted:
+        data_last_modified = datetime.now()
+        response_cache.clear()
+        broadcaster.publish("measurement", {"probe_id": probe_id.strip(), "count": accepted})
+    return jsonify({"status": "success", "accepted": accepted, "duplicates": len(rows) - accepted})
+
+def probe_summary(probe_id, start_time):
+    """Returns the number of results of a probe since `start_time` and the median of each metric.
+
+    Only counts and ordered lookups run, in SQLite, instead of loading every
+    row. For this instance's own results, windows that /api/network_data
+    would serve from rollups use the merged rollup sketches instead.
+    """
+    if probe_id == LOCAL_PROBE_ID:
+        resolution = covering_resolution(choose_resolution(datetime.now() - start_time), start_time) if start_time else open_window_resolution()
+        if resolution != "raw":
+            _, sketches = query_rollups(resolution, start_time)
+            medians, _ = summarize_sketches(sketches)
+            return max(sketch.count for sketch in sketches.values()), medians
+        table, conditions, params = "network_tests", [], []
+    else:
+        table, conditions, params = "probe_results", ['probe_id = ?'], [probe_id]
     if start_time:
-        query += ' WHERE timestamp >= ?'
-        params.append(start_time.isoformat())
+        conditions.append('timestamp >= ?')
+        params.append(to_epoch_ms(start_time))
+
+    conn = get_db()
+    query = f'SELECT COUNT(*), {", ".join(f"COUNT({column})" for _, column in ROLLUP_METRICS)} FROM {table}'
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    counts = conn.execute(query, tuple(params)).fetchone()
+    medians = {}
+    for (metric, column), count in zip(ROLLUP_METRICS, counts[1:]):
+        # The middle value, or the two middle values of an even count
+        query = f"""
+            SELECT {column} FROM {table} WHERE {' AND '.join(conditions + [f'{column} IS NOT NULL'])}
+            ORDER BY {column} LIMIT ? OFFSET ?
+        """
+        middle = [row[0] for row in conn.execute(query, (*params, 2 - count % 2, (count - 1) // 2))] if count else []
+        medians[API_METRIC_NAMES[metric]] = sum(middle) / len(middle) if middle else None
+    return counts[0], medians
+
+@app.route('/api/probes', methods=['GET'])
+def get_probes():
+    """Lists this instance and the agents that pushed results, with their medians over the time frame.
+
+    Used by the dashboard to pick a probe and to compare probes side by side.
+    """
+    start_time = time_frame_start()
+    window_start = window_version(start_time)
+
+    cache_key = data_cache_key("probe_list", window_start)
+    cached = response_cache.get(cache_key)
+    if cached is None:
+        conn = get_db()
+        last_seen = {LOCAL_PROBE_ID: conn.execute("SELECT MAX(timestamp) FROM network_tests").fetchone()[0]}
+        last_seen.update(conn.execute("SELECT probe_id, MAX(timestamp) FROM probe_results GROUP BY probe_id ORDER BY probe_id"))
+
+        probes = []
+        for probe_id, last_timestamp in last_seen.items():
+            tests, medians = probe_summary(probe_id, start_time)
+            probes.append({
+                "probe_id": probe_id,
+                "tests": tests,
+                "medians": medians,
+                "last_seen": from_epoch_ms(last_timestamp).isoformat() if last_timestamp else None,
+            })
+        cached = app.json.dumps({"probes": probes}).encode()
+        response_cache.put(cache_key, cached)
+
+    response = app.response_class(cached, mimetype=app.json.mimetype)
+    return make_conditional_response(response, cache_key, window_start)
 
+@app.route('/api/speedtest/cancel', methods=['POST'])
+def cancel_speedtest():
+    """API endpoint to stop the speed test in progress."""
+    if cancel_network_test():
+        return jsonify({"status": "success", "message": "Speed test cancelled."})
+    return jsonify({"status": "error", "message": "No speed test is running."}), 409
+
+@app.route('/api/stream', methods=['GET'])
+def stream_events():
+    """Server-Sent Events: 'measurement' when a result is stored, 'status' when a test starts or ends."""
+    client = broadcaster.subscribe()
+    if client is None:
+        # Dashboards fall back to polling
+        return jsonify({"status": "error", "message": "Too many open dashboards."}), 503, {"Retry-After": "60"}
+    initial = [format_event("status", test_status)]
+    return app.response_class(
+        broadcaster.stream(client, initial),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# Exports hold a server thread until the download ends
+export_limiter = ExportLimiter(max_exports=2)
+
+@app.route('/api/export', methods=['GET'])
+def export_data():
+    """Streams the test results between `start` and `end` (ISO times, both optional) as a download.
+
+    `format` is csv (default), ndjson or, if pyarrow is installed, parquet.
+    With `probe`, the results ingested from that agent are exported instead.
+    """
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"status": "error", "message": f"Invalid format: {export_format}. Available: {', '.join(EXPORT_FORMATS)}"}), 400
+    conditions = []
+    params = []
+    probe_id = request.args.get('probe') or None
+    if probe_id and probe_id != LOCAL_PROBE_ID:
+        table = "probe_results"
+        conditions.append('probe_id = ?')
+        params.append(probe_id)
+    else:
+        table = "network_tests"
+    for name, operator in (('start', '>='), ('end', '<')):
+        try:
+            value = parse_datetime_arg(name)
+        except ValueError as e:
+            return jsonify({"status": "error", "message": f"Invalid {e}"}), 400
+        if value:
+            conditions.append(f'timestamp {operator} ?')
+            params.append(to_epoch_ms(value))
+
+    query = f"SELECT {', '.join(EXPORT_COLUMNS)} FROM {table}"
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
     query += ' ORDER BY timestamp ASC'
 
-    data = []
+    if not export_limiter.acquire():
+        return jsonify({"status": "error", "message": "Too many exports running, try again later."}), 503, {"Retry-After": "30"}
     try:
-        with sqlite3.connect(db_path) as conn:
-            conn.row_factory = sqlite3.Row # Access columns by name
-            cursor = conn.cursor()
-            cursor.execute(query, tuple(params))
-            for row in cursor.fetchall():
-                data.append(dict(row))
+        cursor = open_export_cursor(db_path, query, tuple(params))
     except sqlite3.Error as e:
-        logging.error("Error fetching data from database.", exc_info=True)
+        export_limiter.release()
+        logging.error(f"Could not start export: {e}")
+        return jsonify({"status": "error", "message": "Could not read the database."}), 500
+    encode, content_type, extension = EXPORT_FORMATS[export_format]
+    source = "".join(c if c.isalnum() or c in "-_." else "_" for c in probe_id or LOCAL_PROBE_ID)
+    filename = f"{APP_NAME}-{source}-{datetime.now():%Y%m%d-%H%M%S}.{extension}"
+    return app.response_class(
+        export_limiter.stream(encode(iter_batches(cursor)), on_close=cursor.connection.close),
+        content_type=content_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "X-Accel-Buffering": "no"},
+    )
 
-    # Calculate medians
-    medians = {
-        "download": None,
-        "upload": None,
-        "ping": None
-    }
-    if data:
-        downloads = [d['download_mbps'] for d in data if d['download_mbps'] is not None]
-        uploads = [d['upload_mbps'] for d in data if d['upload_mbps'] is not None]
-        pings = [d['latency_ms'] for d in data if d['latency_ms'] is not None]
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus scrape endpoint."""
+    latest = get_db().execute('''
+        SELECT timestamp, download_mbps, upload_mbps, latency_ms, bytes_transferred
+        FROM network_tests ORDER BY timestamp DESC LIMIT 1
+    ''').fetchone()
+    if latest:
+        LATEST_TIMESTAMP.set(latest["timestamp"] / 1000)
+        LATEST_DOWNLOAD.set(latest["download_mbps"])
+        LATEST_UPLOAD.set(latest["upload_mbps"])
+        LATEST_LATENCY.set(latest["latency_ms"])
+        LATEST_BYTES.set(latest["bytes_transferred"])
+    STREAM_CLIENTS.set(broadcaster.client_count())
+    stats = database_stats()
+    DB_SIZE.set(stats["size_bytes"], file="main")
+    DB_SIZE.set(stats["wal_bytes"], file="wal")
+    return app.response_class(metrics.render(), content_type=Registry.CONTENT_TYPE)
+
+@app.route('/api/cache_stats', methods=['GET'])
+def get_cache_stats():
+    """API endpoint reporting hit/miss counters of the response cache."""
+    return jsonify(response_cache.stats())
 
-        if downloads:
-            medians["download"] = statistics.median(downloads)
-        if uploads:
-            medians["upload"] = statistics.median(uploads)
-        if pings:
-            medians["ping"] = statistics.median(pings)
+# Settings that grant access to this or another instance; never sent to browsers or API clients
+SECRET_SETTINGS = ("ingest_token", "agent_token")
 
-    # Return a structured response
-    return jsonify({"time_series": data, "medians": medians})
+def public_settings():
+    """Returns the settings without SECRET_SETTINGS; `<name>_set` tells whether each one is set."""
+    public = {key: value for key, value in settings.items() if key not in SECRET_SETTINGS}
+    for key in SECRET_SETTINGS:
+        public[f"{key}_set"] = bool(settings.get(key))
+    return public
 
 @app.route('/')
 def index():
@@ -288,12 +2174,12 @@ def index():
 @app.route('/dashboard')
 def dashboard():
     """Serves the main dashboard HTML page."""
-    return render_template('index.html', settings=settings, version=VERSION)
+    return render_template('index.html', settings=public_settings(), version=VERSION)
 
 @app.route('/settings')
 def settings_page():
     """Serves the settings page."""
-    return render_template('settings.html', settings=settings, version=VERSION)
+    return render_template('settings.html', settings=public_settings(), version=VERSION, db_stats=database_stats())
 
 @app.route('/api/settings', methods=['GET', 'POST'])
 def manage_settings():
@@ -302,29 +2188,155 @@ def manage_settings():
     if request.method == 'POST':
         try:
             new_settings_data = request.json
+            # Validate into a copy, so that a rejected request changes nothing
+            updated = copy.deepcopy(settings)
 
             # Handle port
             new_port = new_settings_data.get('port')
-            if new_port and new_port != settings.get('port'):
-                settings['port'] = int(new_port)
+            if new_port and new_port != updated.get('port'):
+                updated['port'] = int(new_port)
 
             # Handle the new checkbox setting
             open_on_startup = new_settings_data.get('open_on_startup')
             if isinstance(open_on_startup, bool):
-                settings['open_on_startup'] = open_on_startup
+                updated['open_on_startup'] = open_on_startup
 
             new_interval = int(new_settings_data.get('test_interval_minutes'))
 
             # Handle show_median_lines
             show_median = new_settings_data.get('show_median_lines')
             if isinstance(show_median, bool):
-                settings['show_median_lines'] = show_median
+                updated['show_median_lines'] = show_median
 
             # Handle test interval
-            if new_interval > 0 and new_interval != settings.get('test_interval_minutes'):
-                settings['test_interval_minutes'] = new_interval
-                scheduler.reschedule_job('speedtest_job', trigger='interval', minutes=new_interval)
-                logging.info(f"Rescheduled speed test interval to {new_interval} minutes.")
+            if new_interval > 0 and new_interval != updated.get('test_interval_minutes'):
+                updated['test_interval_minutes'] = new_interval
+
+            # Handle speed test server pin (empty for automatic selection)
+            if 'speedtest_server_id' in new_settings_data:
+                server_id = str(new_settings_data['speedtest_server_id'] or '').strip()
+                if server_id and not server_id.isdigit():
+                    raise ValueError("speedtest_server_id must be a number.")
+                updated['speedtest_server_id'] = server_id
+
+            # Handle how long the speedtest configuration and server are reused
+            if 'speedtest_cache_hours' in new_settings_data:
+                cache_hours = int(new_settings_data['speedtest_cache_hours'])
+                if cache_hours < 0:
+                    raise ValueError("speedtest_cache_hours cannot be negative.")
+                updated['speedtest_cache_hours'] = cache_hours
+
+            # Handle the wall-clock limit of a test
+            if 'test_timeout_seconds' in new_settings_data:
+                test_timeout = int(new_settings_data['test_timeout_seconds'])
+                if test_timeout < 1:
+                    raise ValueError("test_timeout_seconds must be at least 1.")
+                updated['test_timeout_seconds'] = test_timeout
+
+            # Handle the measurement backend
+            if 'measurement_backend' in new_settings_data:
+                backend = new_settings_data['measurement_backend']
+                if backend not in BACKENDS:
+                    raise ValueError(f"measurement_backend must be one of {', '.join(BACKENDS)}.")
+                updated['measurement_backend'] = backend
+            if 'http_engine_url' in new_settings_data:
+                engine_url = str(new_settings_data['http_engine_url'] or '').strip()
+                if engine_url and not engine_url.startswith(('http://', 'https://')):
+                    raise ValueError("http_engine_url must start with http:// or https://.")
+                updated['http_engine_url'] = engine_url
+            if 'http_engine_streams' in new_settings_data:
+                streams = int(new_settings_data['http_engine_streams'])
+                if not 1 <= streams <= 64:
+                    raise ValueError("http_engine_streams must be between 1 and 64.")
+                updated['http_engine_streams'] = streams
+            if 'http_engine_duration_seconds' in new_settings_data:
+                duration = int(new_settings_data['http_engine_duration_seconds'])
+                if duration < 1:
+                    raise ValueError("http_engine_duration_seconds must be at least 1.")
+                updated['http_engine_duration_seconds'] = duration
+            # Both directions of an HTTP engine test have to fit into the test timeout
+            needed_seconds = http_engine_test_seconds(updated.get('http_engine_duration_seconds', 10))
+            if needed_seconds > updated.get('test_timeout_seconds', 180):
+                raise ValueError(
+                    f"http_engine_duration_seconds is too long for test_timeout_seconds: "
+                    f"an HTTP engine test can take {needed_seconds} seconds."
+                )
+            throughput_server_enabled = new_settings_data.get('throughput_server_enabled')
+            if isinstance(throughput_server_enabled, bool):
+                updated['throughput_server_enabled'] = throughput_server_enabled
+
+            # Handle adaptive tests and data budgets (0 MB means unlimited)
+            adaptive_tests = new_settings_data.get('adaptive_tests')
+            if isinstance(adaptive_tests, bool):
+                updated['adaptive_tests'] = adaptive_tests
+            for budget_key in ('test_byte_budget_mb', 'daily_data_budget_mb'):
+                if budget_key in new_settings_data:
+                    budget = int(new_settings_data[budget_key])
+                    if budget < 0:
+                        raise ValueError(f"{budget_key} cannot be negative.")
+                    updated[budget_key] = budget
+
+            # Handle data retention (0 days keeps the data forever). The dashboard
+            # reads raw rows (and probe data, which has no rollups) and hourly
+            # rollups for short windows, so keep at least those.
+            retention_minimums = (
+                ('raw_retention_days', RAW_MAX_SPAN.days),
+                ('hourly_retention_days', HOURLY_MAX_SPAN.days),
+                ('probe_retention_days', RAW_MAX_SPAN.days),
+            )
+            for retention_key, minimum in retention_minimums:
+                if retention_key in new_settings_data:
+                    retention_days = int(new_settings_data[retention_key])
+                    if retention_days and retention_days < minimum:
+                        raise ValueError(f"{retention_key} must be 0 (keep forever) or at least {minimum}.")
+                    updated[retention_key] = retention_days
+
+            detection_enabled = new_settings_data.get('detection_enabled')
+            if isinstance(detection_enabled, bool):
+                updated['detection_enabled'] = detection_enabled
+
+            # Handle fleet ingestion (central instance) and agent mode. Tokens are
+            # never sent back to the form, so an empty one keeps the stored token
+            # and `<name>_clear` removes it.
+            for secret_key in SECRET_SETTINGS:
+                if new_settings_data.get(f"{secret_key}_clear") is True:
+                    updated[secret_key] = ''
+                elif str(new_settings_data.get(secret_key) or '').strip():
+                    updated[secret_key] = str(new_settings_data[secret_key]).strip()
+            agent_enabled = new_settings_data.get('agent_enabled')
+            if isinstance(agent_enabled, bool):
+                updated['agent_enabled'] = agent_enabled
+            if 'agent_central_url' in new_settings_data:
+                central_url = str(new_settings_data['agent_central_url'] or '').strip()
+                if central_url and not central_url.startswith(('http://', 'https://')):
+                    raise ValueError("agent_central_url must start with http:// or https://.")
+                updated['agent_central_url'] = central_url
+            if 'agent_probe_id' in new_settings_data:
+                updated['agent_probe_id'] = str(new_settings_data['agent_probe_id'] or '').strip()
+            if updated.get('agent_probe_id') == LOCAL_PROBE_ID:
+                raise ValueError(f"agent_probe_id cannot be '{LOCAL_PROBE_ID}'.")
+
+            # Handle latency probes
+            probe_settings_changed = False
+            probe_enabled = new_settings_data.get('probe_enabled')
+            if isinstance(probe_enabled, bool) and probe_enabled != updated.get('probe_enabled'):
+                updated['probe_enabled'] = probe_enabled
+                probe_settings_changed = True
+            if 'probe_targets' in new_settings_data:
+                probe_targets = new_settings_data['probe_targets']
+                if not isinstance(probe_targets, list) or not all(isinstance(t, str) and t.strip() for t in probe_targets):
+                    raise ValueError("probe_targets must be a list of host:port or URL strings.")
+                probe_targets = [t.strip() for t in probe_targets]
+                if probe_targets != updated.get('probe_targets'):
+                    updated['probe_targets'] = probe_targets
+                    probe_settings_changed = True
+            if 'probe_interval_seconds' in new_settings_data:
+                probe_interval = int(new_settings_data['probe_interval_seconds'])
+                if probe_interval < 1:
+                    raise ValueError("probe_interval_seconds must be at least 1.")
+                if probe_interval != updated.get('probe_interval_seconds'):
+                    updated['probe_interval_seconds'] = probe_interval
+                    probe_settings_changed = True
 
             # Handle time frames update
             if 'time_frames' in new_settings_data:
@@ -336,23 +2348,68 @@ def manage_settings():
                 if 'all' not in new_time_frames:
                     new_time_frames['all'] = get_default_settings()['time_frames']['all']
                 
-                settings['time_frames'] = new_time_frames
+                updated['time_frames'] = new_time_frames
 
             # Handle default time frame, ensuring it's valid
             new_default_frame = new_settings_data.get('default_time_frame')
-            if new_default_frame in settings.get('time_frames', {}):
-                settings['default_time_frame'] = new_default_frame
+            if new_default_frame in updated.get('time_frames', {}):
+                updated['default_time_frame'] = new_default_frame
             else:
                 # If the old default was deleted or is invalid, pick a new one.
-                available_keys = [k for k in settings.get('time_frames', {}).keys() if k != 'all']
-                settings['default_time_frame'] = available_keys[0] if available_keys else 'all'
+                available_keys = [k for k in updated.get('time_frames', {}).keys() if k != 'all']
+                updated['default_time_frame'] = available_keys[0] if available_keys else 'all'
 
+            interval_changed = updated.get('test_interval_minutes') != settings.get('test_interval_minutes')
+            settings = updated
             save_settings(settings)
+            if interval_changed:
+                scheduler.reschedule_job('speedtest_job', trigger='interval', minutes=settings['test_interval_minutes'])
+                logging.info(f"Rescheduled speed test interval to {settings['test_interval_minutes']} minutes.")
+            if probe_settings_changed:
+                restart_latency_prober()
             return jsonify({"status": "success", "message": "Settings saved successfully."})
         except (ValueError, KeyError, TypeError) as e:
             logging.error(f"Invalid settings data received: {e}", exc_info=True)
             return jsonify({"status": "error", "message": f"Invalid settings data: {e}"}), 400
-    return jsonify(settings)
+    return jsonify(public_settings())
+
+STARTUP_SECONDS = metrics.gauge("internettester_startup_seconds", "Time from the start of the import of app.py until create_app() finished.")
+
+def create_app(background=None):
+    """Initializes the database, settings, caches and scheduler, and returns the Flask app.
+
+    None of this happens on import, so the module can be imported cheaply,
+    e.g. by benchmark.py. Calling it again returns the app unchanged. With
+    `background` False only the stored data is served, without running tests
+    or probes; by default that is the case if INTERNETTESTER_NO_BACKGROUND=1.
+    """
+    global settings, data_last_modified, broadcaster, response_cache, scheduler
+    if scheduler is not None:
+        return app
+    initialize_started = time.perf_counter()
+    configure_logging()
+    init_db()
+    settings = load_settings()
+    data_last_modified = get_last_measurement_time()
+    load_detector(get_db())
+    broadcaster = Broadcaster(max_clients=settings.get('stream_max_clients', 32))
+    response_cache = ResponseCache(settings.get('response_cache_size', 64))
+    scheduler = create_scheduler()
+
+    if background is None:
+        background = os.environ.get('INTERNETTESTER_NO_BACKGROUND') != '1'
+    if background:
+        scheduler.start()
+        logging.info(f"Scheduler started. Interval: {settings.get('test_interval_minutes', 15)} minutes.")
+        restart_latency_prober()
+
+    finished = time.perf_counter()
+    STARTUP_SECONDS.set(finished - _process_started)
+    logging.info(
+        f"Started in {finished - _process_started:.2f} s "
+        f"(imports {initialize_started - _process_started:.2f} s, initialization {finished - initialize_started:.2f} s)."
+    )
+    return app
 
 def open_browser():
     """
@@ -363,17 +2420,26 @@ def open_browser():
     if sys.platform.startswith('linux'):
         subprocess.Popen(['firefox', dashboard_url])
     else:
+        import webbrowser
         webbrowser.open_new_tab(dashboard_url)
 
 def exit_action(icon, item):
     """Function to be called when 'Exit' is clicked."""
     logging.info("Exit command received. Shutting down.")
+    cancel_network_test()
     icon.stop()
     # A hard exit is the most reliable way to ensure all threads (like waitress) are terminated.
     os._exit(0)
 
 def run_tray_icon():
     """Creates and runs the system tray icon."""
+    try:
+        from pystray import Icon as TrayIcon, MenuItem as item, Menu #pip install pystray
+    except ValueError:
+        # The indicator libraries are missing (Linux/Raspberry Pi); handled in __main__
+        subprocess.run(['sudo', 'apt', 'install', '-y', 'libayatana-appindicator3-1', 'gir1.2-ayatanaappindicator3-0.1'])
+        raise
+    from PIL import Image
     try:
         image = Image.open(resource_path("icon.png"))
         menu = (
@@ -388,23 +2454,32 @@ def run_tray_icon():
     except Exception as e:
         logging.error(f"Failed to create system tray icon: {e}", exc_info=True)
 
-def run_web_server():
+def run_web_server(open_dashboard=True):
     """Starts the Flask web server using Waitress."""
+    from waitress import serve # pip install waitress
     host = "0.0.0.0"
     port = settings.get("port", 5010)
     logging.info(f"Starting server on http://{host}:{port}")
-    if settings.get("open_on_startup", True):
+    if open_dashboard and settings.get("open_on_startup", True):
         logging.info(f"Dashboard will open automatically at: http://127.0.0.1:{port}/dashboard")
         Timer(1, open_browser).start()
     else:
         logging.info(f"Dashboard is available at: http://127.0.0.1:{port}/dashboard")
-    serve(app, host=host, port=port)
+    # Every open /api/stream (and up to two /api/export downloads) holds a worker thread, so leave room for normal requests
+    serve(app, host=host, port=port, threads=settings.get('stream_max_clients', 32) + 8, inbuf_overflow=UPLOAD_INBUF_BYTES)
+
+# `app.py --headless` runs without tray icon and browser, e.g. as a service on a Raspberry Pi
+HEADLESS_FLAG = "--headless"
 
-if __name__ == '__main__':
+if __name__ == '__main__' and HEADLESS_FLAG in sys.argv[1:]:
+    create_app()
+    run_web_server(open_dashboard=False)
+elif __name__ == '__main__':
+    create_app()
     try:
         # On Linux, explicitly setting the backend can prevent Gdk warnings.
         if sys.platform.startswith('linux'):
-            os.environ['PYSTRAY_BACKEND'] = 'appindicator'
+            os.environ.setdefault('PYSTRAY_BACKEND', 'appindicator')
 
         # Run the web server in a separate thread
         server_thread = threading.Thread(target=run_web_server, daemon=True)
@@ -0,0 +1,262 @@
+# Benchmarks the data API, settings and dashboard against synthetic histories.
+#
+#   python benchmark.py run --rows 10000 1000000 --output report.json
+#   python benchmark.py compare before.json after.json
+#
+# For each size a synthetic network_tests database is generated once (with a
+# daily congestion pattern, noise, slow spells and outage gaps) and kept in
+# --data-dir for later runs. Every configured time frame is then requested
+# through the Flask test client, measuring latency, peak Python memory and
+# response size. The report is plain JSON with stable keys, so reports from
+# two versions can be diffed or compared with the `compare` command.
+
+import argparse
+import gzip
+import json
+import logging
+import math
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+DEFAULT_DATA_DIR = os.path.join(tempfile.gettempdir(), "internettester-benchmark")
+INSERT_BATCH = 100_000
+
+# Requests made for every time frame: name -> extra query parameters and headers.
+# "dashboard" is what static/script.js asks for on a ~1000 px wide chart.
+VARIANTS = {
+    "rows": ({}, {}),
+    "rows_1000": ({"max_points": 1000}, {}),
+    "dashboard": ({"max_points": 1000, "format": "columnar", "encoding": "delta"}, {"Accept-Encoding": "gzip"}),
+}
+
+def synthetic_rows(rows, days, seed):
+    """Yields `rows` synthetic tests (timestamp ms, download, upload, latency, bytes, duration ms), newest first.
+
+    Speeds dip and latency rises in the evening (busiest around 21:00), a few
+    percent of tests catch a slow spell, and every few days an outage of ten
+    minutes to twelve hours leaves a gap in the history.
+    """
+    rng = random.Random(seed)
+    interval_ms = max(days * 86_400_000 // rows, 1)
+    gap_probability = interval_ms / (3 * 86_400_000) # One outage every ~3 days
+    timestamp = int(time.time() * 1000)
+    for _ in range(rows):
+        timestamp -= interval_ms
+        if rng.random() < gap_probability:
+            timestamp -= rng.randint(10 * 60_000, 12 * 3_600_000)
+        hour = datetime.fromtimestamp(timestamp / 1000).hour
+        congestion = 0.5 * (1 + math.cos(2 * math.pi * (hour - 21) / 24))
+        slow = 0.2 if rng.random() < 0.02 else 1.0
+        download = 300 * (1 - 0.35 * congestion) * rng.lognormvariate(0, 0.08) * slow
+        upload = 40 * (1 - 0.15 * congestion) * rng.lognormvariate(0, 0.05) * slow
+        latency = 12 + 15 * congestion + rng.expovariate(1 / 3)
+        if rng.random() < 0.01:
+            latency *= 10
+        duration_ms = rng.randint(18_000, 25_000)
+        transferred = int((download + upload) * 1_000_000 / 8 * 10) # About 10 s per direction
+        yield (timestamp, download, upload, latency, transferred, duration_ms)
+
+def use_database(app, path):
+    """Points the imported app at `path` and resets the state derived from the previous database."""
+    app.db_path = path
+    app.init_db()
+    app.settings = app.load_settings()
+    app.data_last_modified = app.get_last_measurement_time()
+    app.response_cache.clear()
+
+def prepare_database(app, data_dir, rows, days, seed):
+    """Opens (generating it first if needed) the synthetic database of `rows` tests.
+
+    Returns the number of seconds generation took, or None if it was reused.
+    """
+    path = os.path.join(data_dir, f"history_{rows}_{days}d_{seed}.db")
+    if os.path.exists(path):
+        use_database(app, path)
+        return None
+
+    start = time.perf_counter()
+    partial_path = path + ".partial"
+    if os.path.exists(partial_path):
+        os.remove(partial_path)
+    use_database(app, partial_path)
+    conn = app.get_db()
+    batch = []
+    with conn:
+        for row in synthetic_rows(rows, days, seed):
+            batch.append(row)
+            if len(batch) >= INSERT_BATCH:
+                conn.executemany("INSERT OR IGNORE INTO network_tests VALUES (?, ?, ?, ?, ?, ?)", batch)
+                batch = []
+        conn.executemany("INSERT OR IGNORE INTO network_tests VALUES (?, ?, ?, ?, ?, ?)", batch)
+        app.rebuild_rollups(conn)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    app._db_local.conn = None
+    os.replace(partial_path, path)
+    use_database(app, path)
+    return time.perf_counter() - start
+
+def measure(call, repeat, reset=None):
+    """Times `call` `repeat` times (running `reset` before each) and once more under tracemalloc.
+
+    Returns latency statistics in ms, the peak Python allocation in KiB and the last result.
+    """
+    timings = []
+    result = None
+    for _ in range(repeat):
+        if reset:
+            reset()
+        start = time.perf_counter()
+        result = call()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    if reset:
+        reset()
+    tracemalloc.start()
+    try:
+        call()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "median_ms": round(statistics.median(timings), 3),
+        "min_ms": round(min(timings), 3),
+        "max_ms": round(max(timings), 3),
+        "peak_kib": round(peak / 1024, 1),
+    }, result
+
+def benchmark_dataset(app, repeat):
+    """Runs every benchmark against the database the app currently uses."""
+    client = app.app.test_client()
+    results = {}
+
+    stats, _ = measure(app.load_settings, repeat)
+    results["load_settings"] = stats
+
+    stats, response = measure(lambda: client.get("/dashboard"), repeat)
+    results["dashboard_page"] = {**stats, "bytes": len(response.data), "status": response.status_code}
+
+    for frame in app.settings.get("time_frames", {}):
+        for variant, (params, headers) in VARIANTS.items():
+            query = {"time_frame": frame, **params}
+            get = lambda: client.get("/api/network_data", query_string=query, headers=headers)
+            # Cold: the response cache is emptied before every request
+            stats, response = measure(get, repeat, reset=app.response_cache.clear)
+            # Warm: served from the response cache filled by the last cold request
+            warm, _ = measure(get, repeat)
+            entry = {**stats, "warm_median_ms": warm["median_ms"], "bytes": len(response.data), "status": response.status_code}
+            if response.status_code == 200:
+                body = response.get_data()
+                if response.headers.get("Content-Encoding") == "gzip":
+                    body = gzip.decompress(body)
+                data = json.loads(body)
+                entry["resolution"] = data.get("resolution")
+                entry["points"] = len(data["time_series"]) if "time_series" in data else len(data["columns"]["timestamp"])
+            results[f"network_data/{frame}/{variant}"] = entry
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args):
+    os.makedirs(args.data_dir, exist_ok=True)
+    # Keep the database and log of the app in the data dir
+    os.environ["INTERNETTESTER_DATA_DIR"] = args.data_dir
+    # Templates and static files are found relative to the working directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.getcwd())
+    # Keep stdout for the report: the app leaves an already configured logging alone
+    logging.basicConfig(level=logging.WARNING, stream=sys.stderr)
+    import app
+    app.create_app(background=False)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "days": args.days,
+            "seed": args.seed,
+        },
+        "datasets": {},
+    }
+    for rows in args.rows:
+        print(f"Preparing {rows} rows...", file=sys.stderr)
+        generate_seconds = prepare_database(app, args.data_dir, rows, args.days, args.seed)
+        print(f"Benchmarking {rows} rows...", file=sys.stderr)
+        report["datasets"][str(rows)] = {
+            "db_bytes": os.path.getsize(app.db_path),
+            "generate_seconds": round(generate_seconds, 1) if generate_seconds is not None else None,
+            "results": benchmark_dataset(app, args.repeat),
+        }
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+def compare(args):
+    """Prints the change of every median latency, peak memory and size between two reports."""
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    print(f"{'rows':>10}  {'benchmark':<40} {'metric':<10} {'before':>12} {'after':>12} {'change':>8}")
+    for rows, dataset in after["datasets"].items():
+        old_results = before["datasets"].get(rows, {}).get("results", {})
+        for name, entry in dataset["results"].items():
+            old = old_results.get(name)
+            if old is None:
+                continue
+            for metric in ("median_ms", "peak_kib", "bytes"):
+                if metric not in entry or metric not in old:
+                    continue
+                change = f"{(entry[metric] - old[metric]) / old[metric] * 100:+.0f}%" if old[metric] else "n/a"
+                print(f"{rows:>10}  {name:<40} {metric:<10} {old[metric]:>12} {entry[metric]:>12} {change:>8}")
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark internetTester against synthetic test histories.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="generate histories and benchmark them")
+    run_parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000],
+                            help="history sizes to benchmark (default: 10000 100000 1000000)")
+    run_parser.add_argument("--days", type=int, default=365, help="time span the history covers (default: 365)")
+    run_parser.add_argument("--seed", type=int, default=1, help="random seed of the generator (default: 1)")
+    run_parser.add_argument("--repeat", type=int, default=5, help="timed requests per benchmark (default: 5)")
+    run_parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help=f"where databases are kept (default: {DEFAULT_DATA_DIR})")
+    run_parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser("compare", help="compare two JSON reports")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
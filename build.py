@@ -38,6 +38,11 @@ try:
 except Exception as e:
     print(f"An error occurred while updating version in {MAIN_SCRIPT}: {e}")
 
+# `python build.py --onedir` builds a folder instead of a single file. It starts
+# faster (nothing is unpacked to a temporary folder on every start), which is
+# worth it on a Raspberry Pi.
+BUNDLE_MODE = '--onedir' if '--onedir' in sys.argv[1:] else '--onefile'
+
 # --- Architecture-specific modifications ---
 machine_arch = platform.machine().lower()
 if machine_arch in ('aarch64', 'arm64'):
@@ -52,7 +57,7 @@ if sys.platform == 'win32':
     pyinstaller_command = [
         'pyinstaller', 
         '--name', APP_NAME, 
-        '--onefile', 
+        BUNDLE_MODE,
         '--clean',
         '--add-data', 'templates;templates', 
         '--add-data', 'static;static',
@@ -71,7 +76,7 @@ else:
        pyinstaller_command = [
         'pyinstaller', 
         '--name', APP_NAME, 
-        '--onefile', 
+        BUNDLE_MODE,
         '--clean',
         '--add-data', 'templates:templates',
         '--add-data', 'static:static',
@@ -140,6 +145,8 @@ try:
         executable_path = os.path.join('dist', f'{APP_NAME}.exe')
     else:
         executable_path = os.path.join('dist', APP_NAME)
+    if BUNDLE_MODE == '--onedir':
+        executable_path = os.path.join('dist', APP_NAME, os.path.basename(executable_path))
     print(f"Executable created at: {executable_path}")
 except subprocess.CalledProcessError as e:
     print(f"Build failed!\nError:\n{e.stderr}")
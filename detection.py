@@ -0,0 +1,172 @@
+# Online degradation detection.
+#
+# Every stored result updates, per metric, an exponentially weighted mean and
+# variance for the hour of day it was measured in (connections are slower in
+# the evening than at night, so one baseline for the whole day would flag
+# every evening) plus one for the whole day, used while an hour has not seen
+# enough results yet. The deviation of the new value from its baseline, in
+# standard deviations, feeds a one-sided CUSUM: small deviations cancel out,
+# a sustained shift in the bad direction accumulates until it crosses the
+# alarm threshold and opens a degradation. Each result adds at most
+# CUSUM_MAX_STEP, so a single outlier (a slow spell, a lost packet) never
+# opens one on its own. A degradation closes after RECOVERY_TESTS
+# results in a row are back within the noise. A degradation that outlasts
+# LEVEL_SHIFT_TESTS results is a new normal (a plan change, a new ISP) rather
+# than an incident: it is closed and the baselines move to the new level.
+# Each update takes constant time and the whole state is a small dict that is
+# stored with every result.
+
+import math
+
+# Metric -> +1 if higher values are worse (latency), -1 if lower values are worse (speeds)
+METRIC_DIRECTIONS = {"download_mbps": -1, "upload_mbps": -1, "latency_ms": 1}
+
+ALPHA = 0.05 # Weight of a new value in the baselines, roughly the last 20 values per baseline count
+WARMUP = 10 # Values a baseline needs before it is used
+CUSUM_SLACK = 1.0 # Deviations (in standard deviations) below this are treated as noise
+CUSUM_THRESHOLD = 5.0 # Accumulated deviation that opens a degradation
+CUSUM_MAX_STEP = 2.5 # Largest deviation one result adds: it takes four bad results in a row to open a degradation
+MIN_RELATIVE_SD = 0.05 # Standard deviation floor, as a fraction of the mean: 5% changes never alarm on their own
+RECOVERY_TESTS = 3 # Normal results in a row that close a degradation
+LEVEL_SHIFT_TESTS = 672 # Results after which a degradation becomes the new baseline, a week at the default interval
+
+class Baseline:
+    """Exponentially weighted mean and variance; plain mean and variance until 1/count drops below ALPHA."""
+
+    __slots__ = ("count", "mean", "var")
+
+    def __init__(self, count=0, mean=0.0, var=0.0):
+        self.count = count
+        self.mean = mean
+        self.var = var
+
+    def add(self, value):
+        self.count += 1
+        weight = max(ALPHA, 1 / self.count)
+        diff = value - self.mean
+        increment = weight * diff
+        self.mean += increment
+        self.var = (1 - weight) * (self.var + diff * increment)
+
+    def sd(self):
+        return max(math.sqrt(self.var), MIN_RELATIVE_SD * abs(self.mean), 1e-9)
+
+    def to_list(self):
+        return [self.count, self.mean, self.var]
+
+class MetricState:
+    """Baselines (24 hours of the day plus the whole day) and the CUSUM of one metric."""
+
+    def __init__(self, direction):
+        self.direction = direction
+        self.hours = [Baseline() for _ in range(24)]
+        self.day = Baseline()
+        self.cusum = 0.0
+        self.degraded = False
+        self.recovered = 0 # Normal results in a row while degraded
+        self.shift = Baseline() # Values seen during the current degradation
+
+    def baseline(self, hour):
+        """Returns the baseline to compare against, or None while there is too little history."""
+        if self.hours[hour].count >= WARMUP:
+            return self.hours[hour]
+        if self.day.count >= WARMUP:
+            return self.day
+        return None
+
+    def adopt_shift(self):
+        """Moves every baseline to the level seen during the degradation, keeping the daily profile."""
+        if self.day.mean:
+            ratio = self.shift.mean / self.day.mean
+            for baseline in (*self.hours, self.day):
+                baseline.mean *= ratio
+                baseline.var *= ratio * ratio
+        else:
+            self.hours = [Baseline(*self.shift.to_list()) for _ in range(24)]
+            self.day = Baseline(*self.shift.to_list())
+
+class Detector:
+    """Tracks every metric of METRIC_DIRECTIONS and reports when degradations start and end."""
+
+    def __init__(self):
+        self.metrics = {metric: MetricState(direction) for metric, direction in METRIC_DIRECTIONS.items()}
+
+    def update(self, values, when):
+        """Adds one result (metric -> value) measured at datetime `when`.
+
+        Returns a list of (metric, change, info) for the metrics whose state
+        changed or that are still degraded: change is "start", "continue" or
+        "end", and info holds the value, the baseline mean and the deviation.
+        A degradation closed as a level shift has "level_shift" in its info.
+        """
+        changes = []
+        for metric, state in self.metrics.items():
+            value = values.get(metric)
+            if value is None:
+                continue
+            baseline = state.baseline(when.hour)
+            if baseline is not None:
+                deviation = state.direction * (value - baseline.mean) / baseline.sd()
+                state.cusum = max(0.0, state.cusum + min(deviation, CUSUM_MAX_STEP) - CUSUM_SLACK)
+                info = {"value": value, "baseline": baseline.mean, "deviation": round(deviation, 2)}
+                if not state.degraded and state.cusum > CUSUM_THRESHOLD:
+                    state.degraded = True
+                    state.recovered = 0
+                    state.shift = Baseline()
+                    state.shift.add(value)
+                    changes.append((metric, "start", info))
+                elif state.degraded:
+                    state.shift.add(value)
+                    # Draining the sum could take many results after a deep dip, so count normal results instead
+                    state.recovered = state.recovered + 1 if deviation <= CUSUM_SLACK else 0
+                    if state.recovered >= RECOVERY_TESTS or state.shift.count >= LEVEL_SHIFT_TESTS:
+                        if state.recovered < RECOVERY_TESTS:
+                            state.adopt_shift()
+                            info["level_shift"] = True
+                        state.degraded = False
+                        state.cusum = 0.0
+                        state.shift = Baseline()
+                        changes.append((metric, "end", info))
+                    else:
+                        changes.append((metric, "continue", info))
+            # A degraded period only becomes the new normal through adopt_shift()
+            if not state.degraded:
+                state.hours[when.hour].add(value)
+                state.day.add(value)
+        return changes
+
+    def learn(self, values, when):
+        """Adds one result to the baselines only, e.g. to learn them from past results."""
+        for metric, state in self.metrics.items():
+            value = values.get(metric)
+            if value is not None:
+                state.hours[when.hour].add(value)
+                state.day.add(value)
+
+    def to_dict(self):
+        return {
+            metric: {
+                "hours": [baseline.to_list() for baseline in state.hours],
+                "day": state.day.to_list(),
+                "cusum": state.cusum,
+                "degraded": state.degraded,
+                "recovered": state.recovered,
+                "shift": state.shift.to_list(),
+            }
+            for metric, state in self.metrics.items()
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        detector = cls()
+        for metric, saved in data.items():
+            state = detector.metrics.get(metric)
+            if state is None:
+                continue
+            state.hours = [Baseline(*values) for values in saved["hours"]]
+            state.day = Baseline(*saved["day"])
+            state.cusum = saved["cusum"]
+            state.degraded = saved["degraded"]
+            state.recovered = saved.get("recovered", 0)
+            state.shift = Baseline(*saved.get("shift", ()))
+        return detector
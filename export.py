@@ -0,0 +1,172 @@
+# Streaming export of the measurement history.
+#
+# Exports are generated while they are sent: rows are read from a cursor in
+# batches of EXPORT_BATCH_ROWS and each batch is encoded and yielded before the
+# next one is read, so the memory used does not depend on the size of the
+# export. Every export reads through its own connection, which keeps one
+# consistent snapshot of the database (WAL) for the whole download while
+# measurements continue to be written.
+
+import csv
+import importlib.util
+import io
+import json
+import pathlib
+import sqlite3
+import threading
+from datetime import datetime
+
+EXPORT_BATCH_ROWS = 5000
+# Columns of an export, in order; "timestamp" is stored as epoch ms
+EXPORT_COLUMNS = ("timestamp", "download_mbps", "upload_mbps", "latency_ms", "bytes_transferred", "duration_ms")
+
+def _iso(epoch_ms):
+    return datetime.fromtimestamp(epoch_ms / 1000).isoformat(timespec="milliseconds")
+
+def open_export_cursor(db_path, query, params=()):
+    """Runs `query` on a new read-only connection to `db_path` and returns the cursor.
+
+    Call it before the response starts, so that errors (a missing file or
+    table) can still be answered with an error response. The connection is
+    handed to the streaming response, which may read it from another thread.
+    """
+    # as_uri() escapes characters such as # ? % that would change the meaning of the URI
+    uri = pathlib.Path(db_path).absolute().as_uri() + "?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, timeout=30, check_same_thread=False)
+    try:
+        return conn.execute(query, params)
+    except sqlite3.Error:
+        conn.close()
+        raise
+
+def iter_batches(cursor, batch_rows=EXPORT_BATCH_ROWS):
+    """Yields lists of at most `batch_rows` result tuples of `cursor`, then closes its connection."""
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_rows)
+            if not rows:
+                return
+            yield rows
+    finally:
+        cursor.connection.close()
+
+def csv_chunks(batches, columns=EXPORT_COLUMNS):
+    """Encodes batches as CSV with a header line; timestamps become local ISO 8601 times."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(columns)
+    for rows in batches:
+        writer.writerows((_iso(row[0]), *row[1:]) for row in rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+def ndjson_chunks(batches, columns=EXPORT_COLUMNS):
+    """Encodes batches as one JSON object per line; timestamps become local ISO 8601 times."""
+    for rows in batches:
+        lines = []
+        for row in rows:
+            record = dict(zip(columns, row))
+            record["timestamp"] = _iso(row[0])
+            lines.append(json.dumps(record, separators=(",", ":")))
+        yield ("\n".join(lines) + "\n").encode()
+
+class _ChunkSink:
+    """Write-only file for the Parquet writer that hands out what was written since the last take()."""
+
+    def __init__(self):
+        self.closed = False
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+def parquet_chunks(batches, columns=EXPORT_COLUMNS):
+    """Encodes batches as a Parquet file with one row group per batch (requires pyarrow)."""
+    # Imported on first use, it takes longer to import than the rest of the app
+    import pyarrow
+    import pyarrow.parquet
+    schema = pyarrow.schema(
+        [pyarrow.field("timestamp", pyarrow.timestamp("ms"))]
+        + [pyarrow.field(column, pyarrow.int64() if column in ("bytes_transferred", "duration_ms") else pyarrow.float64())
+           for column in columns[1:]]
+    )
+    sink = _ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema, compression="zstd")
+    try:
+        for rows in batches:
+            arrays = [pyarrow.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+            writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+            yield sink.take()
+    finally:
+        writer.close()
+    yield sink.take()
+
+# Format name -> (encoder, content type, file extension)
+FORMATS = {
+    "csv": (csv_chunks, "text/csv; charset=utf-8", "csv"),
+    "ndjson": (ndjson_chunks, "application/x-ndjson", "ndjson"),
+}
+# Optional, for Parquet: pip install pyarrow
+if importlib.util.find_spec("pyarrow") is not None:
+    FORMATS["parquet"] = (parquet_chunks, "application/vnd.apache.parquet", "parquet")
+
+class _LimitedExport:
+    def __init__(self, chunks, release, on_close):
+        self._chunks = chunks
+        self._release = release
+        self._on_close = on_close
+
+    def __iter__(self):
+        return iter(self._chunks)
+
+    def close(self):
+        # Called by the server when the response ends, also if it was never iterated
+        try:
+            self._chunks.close()
+            if self._on_close is not None:
+                self._on_close()
+        finally:
+            if self._release is not None:
+                self._release()
+                self._release = None
+
+class ExportLimiter:
+    """Caps the number of exports running at once, so long downloads cannot occupy every server thread."""
+
+    def __init__(self, max_exports=2):
+        self._slots = threading.BoundedSemaphore(max_exports)
+
+    def acquire(self):
+        return self._slots.acquire(blocking=False)
+
+    def release(self):
+        """Frees the slot taken by acquire() for an export that could not be started."""
+        self._slots.release()
+
+    def stream(self, chunks, on_close=None):
+        """Wraps the `chunks` generator so that the slot taken by acquire() is freed when the response is closed.
+
+        `on_close` is called then too, e.g. to close the export's connection
+        if the response ends before `chunks` was ever started.
+        """
+        return _LimitedExport(chunks, self._slots.release, on_close)
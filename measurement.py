@@ -0,0 +1,470 @@
+# Network measurements.
+#
+# These functions run inside a separate worker process started by
+# app.measure_network_quality (as `app.py --measure-worker <job>`), so the
+# CPU-heavy transfer loops of speedtest-cli never hold the GIL of the web
+# server, and a hung test can be killed without taking the app down with it.
+# Keep this module free of Flask/tray imports so the worker starts quickly.
+#
+# Measurement backends are functions taking the job dict and returning
+# {'download': Mbps, 'upload': Mbps, 'ping': ms, ...}; they are registered in
+# BACKENDS and selected by the job's 'backend' key:
+#   - "speedtest": speedtest-cli against the public speedtest.net servers.
+#   - "http": the built-in engine, which saturates the link to another
+#     instance of this app (or `app.py --throughput-server`) with parallel
+#     HTTP streams for a fixed duration.
+#
+# With 'adaptive' set, backends ramp the transfer size step by step instead of
+# moving a fixed amount of data, and stop as soon as the throughput is stable
+# or the job's 'byte_budget' would be exceeded (see TransferRamp).
+
+import asyncio
+import copy
+import json
+import logging
+import os
+import ssl
+import statistics
+import time
+import traceback
+from urllib.parse import urlsplit
+
+class MeasurementError(Exception):
+    """An expected measurement failure (network error, rate limit, ...), logged without a traceback.
+
+    `misconfigured` marks failures of the test setup rather than of the
+    network, e.g. a missing or refusing throughput server.
+    """
+
+    def __init__(self, message, rate_limited=False, misconfigured=False):
+        super().__init__(message)
+        self.rate_limited = rate_limited
+        self.misconfigured = misconfigured
+
+# Two consecutive ramp steps whose throughput differs by less than this are considered stable
+STABLE_TOLERANCE = 0.1
+
+class TransferRamp:
+    """Decides when an adaptive measurement of one direction can stop.
+
+    Call record() after each step of increasing transfer size; it returns
+    True once the throughput has stabilized, a step took long enough on its
+    own to be accurate, or the next step (assumed to move about twice as
+    much data) would exceed the byte budget.
+    """
+
+    def __init__(self, byte_budget, max_step_seconds):
+        self.byte_budget = byte_budget
+        self.max_step_seconds = max_step_seconds
+        self.mbps = None
+        self.bytes = 0
+
+    def record(self, mbps, transferred, seconds):
+        previous = self.mbps
+        self.mbps = mbps
+        self.bytes += transferred
+        if previous is not None and abs(mbps - previous) <= STABLE_TOLERANCE * max(mbps, previous):
+            return True
+        if seconds >= self.max_step_seconds:
+            return True
+        return bool(self.byte_budget) and self.bytes + 2 * transferred > self.byte_budget
+
+# get_best_server() reports this latency (ms) when a server failed all its pings
+UNREACHABLE_LATENCY_MS = 1_000_000
+
+def measure_speedtest(job):
+    """ Measures network quality (download, upload, and latency) with speedtest-cli.
+
+    The job may carry the speedtest.net configuration ('config') and the
+    server chosen by an earlier run ('server'). When it does, they are reused
+    and only that server is pinged, so measuring starts immediately; if the
+    cached server does not answer, a new one is selected. 'server_id' pins
+    the test to a specific speedtest.net server.
+
+    Returns:
+        dict: A dictionary containing 'download' (Mbps), 'upload' (Mbps), and
+              'ping' (ms), plus the 'config' and 'server' that were used and
+              whether they were freshly fetched ('refreshed').
+    """
+    import speedtest #pip install speedtest-cli
+
+    try:
+        return _measure_speedtest(job, speedtest)
+    except speedtest.SpeedtestException as e:
+        raise MeasurementError(str(e), rate_limited='429' in str(e)) from e
+
+def _measure_speedtest(job, speedtest):
+    class CachedConfigSpeedtest(speedtest.Speedtest):
+        """Speedtest that can start from a previously downloaded configuration."""
+
+        def __init__(self, cached_config=None, **kwargs):
+            self._cached_config = cached_config
+            super().__init__(**kwargs)
+
+        def get_config(self):
+            if not self._cached_config:
+                return super().get_config()
+            self.config.update(self._cached_config)
+            client = self.config['client']
+            self.lat_lon = (float(client['lat']), float(client['lon']))
+            return self.config
+
+    phases = {}
+    start = time.monotonic()
+    st = CachedConfigSpeedtest(cached_config=job.get("config"), secure=job.get("secure", True)) # Use HTTPS
+    refreshed = not job.get("config")
+
+    server = job.get("server")
+    best = None
+    if server:
+        try:
+            best = st.get_best_server([server])
+        except speedtest.SpeedtestBestServerFailure:
+            best = None
+        if best is None or best['latency'] >= UNREACHABLE_LATENCY_MS:
+            best = None
+            st.closest = []
+    if best is None:
+        refreshed = True
+        server_id = job.get("server_id")
+        st.get_servers([int(server_id)] if server_id else None)
+        best = st.get_best_server()
+
+    phases["server_selection"] = time.monotonic() - start
+
+    # Adaptive runs give half of the byte budget to each direction
+    direction_budget = job["byte_budget"] / 2 if job.get("byte_budget") else None
+    start = time.monotonic()
+    if job.get("adaptive"):
+        download, download_bytes = _ramp_speedtest(st, "download", direction_budget)
+    else:
+        download, download_bytes = st.download() / 1_000_000, st.results.bytes_received
+    phases["download"] = time.monotonic() - start
+
+    start = time.monotonic()
+    if job.get("adaptive"):
+        upload, upload_bytes = _ramp_speedtest(st, "upload", direction_budget)
+    else:
+        upload, upload_bytes = st.upload() / 1_000_000, st.results.bytes_sent
+    phases["upload"] = time.monotonic() - start
+    ping = st.results.ping
+
+    return {
+        "download": download,
+        "upload": upload,
+        "ping": ping,
+        "bytes_transferred": download_bytes + upload_bytes,
+        "phases": phases,
+        "config": st.config,
+        "server": best,
+        "refreshed": refreshed,
+    }
+
+def _ramp_speedtest(st, direction, byte_budget):
+    """Adaptive speedtest-cli run of one direction: one file size per step, smallest first.
+
+    Returns (Mbps, bytes transferred).
+    """
+    config = st.config
+    # The configuration is cached for later runs, so restore what the steps change
+    original = {key: copy.deepcopy(config[key]) for key in ("sizes", "counts", "upload_max")}
+    ramp = TransferRamp(byte_budget, config["length"][direction])
+    try:
+        if direction == "upload":
+            config["counts"]["upload"] = config["threads"]["upload"]
+            config["upload_max"] = config["threads"]["upload"]
+        for size in original["sizes"][direction]:
+            config["sizes"][direction] = [size]
+            start = time.monotonic()
+            if direction == "download":
+                mbps, transferred = st.download() / 1_000_000, st.results.bytes_received
+            else:
+                mbps, transferred = st.upload() / 1_000_000, st.results.bytes_sent
+            if ramp.record(mbps, transferred, time.monotonic() - start):
+                break
+    finally:
+        config.update(original)
+    return ramp.mbps, ramp.bytes
+
+# --- Built-in HTTP throughput engine ---
+
+# Size of each request a stream makes; streams issue requests back to back on
+# a keep-alive connection until the test duration is over.
+REQUEST_BYTES = 4 * 1024 * 1024
+CHUNK_BYTES = 64 * 1024
+# Largest transfer the server side accepts in a single request
+MAX_TRANSFER_BYTES = 1024 * 1024 * 1024
+# Waitress reads a whole request body before the app sees it and spools bodies
+# larger than its inbuf_overflow to a temporary file. Uploads are therefore
+# sent in requests of at most UPLOAD_REQUEST_BYTES, and servers of the
+# throughput endpoints pass UPLOAD_INBUF_BYTES as inbuf_overflow so that
+# those stay in memory instead of being written to disk (an SD card on a Pi).
+UPLOAD_REQUEST_BYTES = 1024 * 1024
+UPLOAD_INBUF_BYTES = 2 * UPLOAD_REQUEST_BYTES
+# Extra time allowed for streams to wind down after the test duration
+STREAM_GRACE_SECONDS = 5
+# Time a test needs besides both directions: worker start, connections and latency round trips
+HTTP_ENGINE_OVERHEAD_SECONDS = 15
+# Per-stream request sizes tried by adaptive runs, doubling from 256 KiB to 256 MiB
+RAMP_REQUEST_BYTES = [256 * 1024 * 2 ** step for step in range(11)]
+PING_COUNT = 5
+
+# Incompressible payload, so proxies and links that compress cannot inflate results
+_PAYLOAD_BLOCK = os.urandom(CHUNK_BYTES)
+
+async def _open_connection(base_url):
+    url = urlsplit(base_url)
+    port = url.port or (443 if url.scheme == "https" else 80)
+    context = ssl.create_default_context() if url.scheme == "https" else None
+    reader, writer = await asyncio.open_connection(url.hostname, port, ssl=context)
+    return reader, writer, url
+
+def _request_head(method, url, path, content_length=None):
+    lines = [f"{method} {url.path.rstrip('/')}{path} HTTP/1.1", f"Host: {url.netloc}", "Connection: keep-alive"]
+    if content_length is not None:
+        lines += [f"Content-Length: {content_length}", "Content-Type: application/octet-stream"]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode()
+
+async def _read_response_head(reader):
+    """Reads the status line and headers; returns (status, headers with lower-case names)."""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("Connection closed by the server.")
+    status = int(status_line.split()[1])
+    headers = {}
+    while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    if status != 200:
+        # The server is reachable, so the network is fine but the far end is not set up for tests
+        raise MeasurementError(f"Throughput server answered HTTP {status}.", misconfigured=True)
+    return status, headers
+
+async def _download_stream(base_url, deadline, counter, request_bytes=REQUEST_BYTES, requests=None):
+    reader, writer, url = await _open_connection(base_url)
+    try:
+        made = 0
+        while time.monotonic() < deadline and made != requests:
+            made += 1
+            writer.write(_request_head("GET", url, f"/api/throughput/download?bytes={request_bytes}"))
+            await writer.drain()
+            _, headers = await _read_response_head(reader)
+            remaining = int(headers.get("content-length", 0))
+            while remaining and time.monotonic() < deadline:
+                chunk = await reader.read(min(CHUNK_BYTES, remaining))
+                if not chunk:
+                    raise ConnectionError("Connection closed during download.")
+                remaining -= len(chunk)
+                counter[0] += len(chunk)
+    finally:
+        writer.close()
+
+async def _upload_stream(base_url, deadline, counter, request_bytes=REQUEST_BYTES, requests=None):
+    reader, writer, url = await _open_connection(base_url)
+    try:
+        made = 0
+        while time.monotonic() < deadline and made != requests:
+            made += 1
+            remaining = request_bytes
+            while remaining > 0:
+                piece = min(remaining, UPLOAD_REQUEST_BYTES)
+                remaining -= piece
+                writer.write(_request_head("POST", url, "/api/throughput/upload", piece))
+                for _ in range(piece // CHUNK_BYTES):
+                    # Abandoning a request mid-body is fine: the server never sees it
+                    if time.monotonic() >= deadline:
+                        return
+                    writer.write(_PAYLOAD_BLOCK)
+                    await writer.drain()
+                    counter[0] += CHUNK_BYTES
+                _, headers = await _read_response_head(reader)
+                await reader.readexactly(int(headers.get("content-length", 0)))
+    finally:
+        writer.close()
+
+async def _measure_direction(stream, base_url, streams, duration, **stream_args):
+    """Runs `streams` parallel copies of `stream` for at most `duration` seconds; returns (Mbps, bytes)."""
+    counter = [0]
+    start = time.monotonic()
+    deadline = start + duration
+    try:
+        async with asyncio.timeout(duration + STREAM_GRACE_SECONDS):
+            await asyncio.gather(*(stream(base_url, deadline, counter, **stream_args) for _ in range(streams)))
+    except TimeoutError:
+        pass
+    elapsed = time.monotonic() - start
+    return counter[0] * 8 / elapsed / 1_000_000, counter[0]
+
+async def _measure_ping(base_url):
+    """Median round-trip time (ms) of small requests over one connection."""
+    reader, writer, url = await _open_connection(base_url)
+    try:
+        rtts = []
+        for _ in range(PING_COUNT):
+            start = time.perf_counter()
+            writer.write(_request_head("GET", url, "/api/throughput/ping"))
+            await writer.drain()
+            _, headers = await _read_response_head(reader)
+            await reader.readexactly(int(headers.get("content-length", 0)))
+            rtts.append((time.perf_counter() - start) * 1000)
+        return statistics.median(rtts)
+    finally:
+        writer.close()
+
+async def _ramp_direction(stream, base_url, streams, duration, byte_budget):
+    """Adaptive run of one direction: every stream makes one request per step, doubling its size."""
+    ramp = TransferRamp(byte_budget, duration)
+    for request_bytes in RAMP_REQUEST_BYTES:
+        start = time.monotonic()
+        mbps, transferred = await _measure_direction(
+            stream, base_url, streams, duration, request_bytes=request_bytes, requests=1
+        )
+        if ramp.record(mbps, transferred, time.monotonic() - start):
+            break
+    return ramp.mbps, ramp.bytes
+
+async def _measure_http_streams(base_url, streams, duration, adaptive=False, byte_budget=None):
+    phases = {}
+    start = time.monotonic()
+    ping = await _measure_ping(base_url)
+    phases["latency"] = time.monotonic() - start
+
+    direction_budget = byte_budget / 2 if byte_budget else None
+    results = {}
+    for direction, stream in (("download", _download_stream), ("upload", _upload_stream)):
+        start = time.monotonic()
+        if adaptive:
+            results[direction] = await _ramp_direction(stream, base_url, streams, duration, direction_budget)
+        else:
+            results[direction] = await _measure_direction(stream, base_url, streams, duration)
+        phases[direction] = time.monotonic() - start
+    (download, download_bytes), (upload, upload_bytes) = results["download"], results["upload"]
+    return {
+        "download": download,
+        "upload": upload,
+        "ping": ping,
+        "bytes_transferred": download_bytes + upload_bytes,
+        "phases": phases,
+    }
+
+def measure_http_streams(job):
+    """ Measures network quality against our own throughput endpoint ('url').
+
+    Download and upload each run 'streams' parallel HTTP streams for
+    'duration' seconds (adaptive runs stop earlier once throughput is
+    stable); latency is the median of a few small round trips.
+    """
+    base_url = job.get("url")
+    if not base_url:
+        raise MeasurementError("No throughput server URL is configured for the HTTP engine.", misconfigured=True)
+    try:
+        return asyncio.run(_measure_http_streams(
+            base_url, job.get("streams", 4), job.get("duration", 10),
+            adaptive=job.get("adaptive", False), byte_budget=job.get("byte_budget"),
+        ))
+    except (OSError, TimeoutError, ValueError, asyncio.IncompleteReadError) as e:
+        raise MeasurementError(f"HTTP throughput test against {base_url} failed: {e!r}") from e
+
+def http_engine_test_seconds(duration):
+    """Longest time a (non-adaptive) HTTP engine test with `duration` seconds per direction can take."""
+    return 2 * (duration + STREAM_GRACE_SECONDS) + HTTP_ENGINE_OVERHEAD_SECONDS
+
+BACKENDS = {
+    "speedtest": measure_speedtest,
+    "http": measure_http_streams,
+}
+
+def create_throughput_blueprint(enabled=None):
+    """Flask endpoints that serve and accept the HTTP engine's payloads.
+
+    If `enabled` is given, it is called on every request and the endpoints
+    answer 403 while it returns False.
+    """
+    from flask import Blueprint, Response, jsonify, request
+
+    blueprint = Blueprint("throughput", __name__)
+
+    if enabled is not None:
+        @blueprint.before_request
+        def check_enabled():
+            if not enabled():
+                return jsonify({"status": "error", "message": "The throughput endpoints are disabled on this instance."}), 403
+
+    @blueprint.route("/api/throughput/ping", methods=["GET"])
+    def throughput_ping():
+        return Response(b"pong", mimetype="text/plain", headers={"Cache-Control": "no-store"})
+
+    @blueprint.route("/api/throughput/download", methods=["GET"])
+    def throughput_download():
+        size = min(max(request.args.get("bytes", REQUEST_BYTES, type=int), 0), MAX_TRANSFER_BYTES)
+
+        def generate():
+            remaining = size
+            while remaining > 0:
+                chunk = _PAYLOAD_BLOCK[:remaining]
+                remaining -= len(chunk)
+                yield chunk
+
+        return Response(generate(), mimetype="application/octet-stream",
+                        headers={"Content-Length": str(size), "Cache-Control": "no-store"})
+
+    @blueprint.route("/api/throughput/upload", methods=["POST"])
+    def throughput_upload():
+        received = 0
+        while chunk := request.stream.read(CHUNK_BYTES):
+            received += len(chunk)
+        return jsonify({"bytes": received})
+
+    return blueprint
+
+def run_throughput_server(port):
+    """Serves only the throughput endpoints (`app.py --throughput-server [port]`)."""
+    from flask import Flask
+    from waitress import serve
+
+    server = Flask(__name__)
+    server.register_blueprint(create_throughput_blueprint())
+    # Runs without the rest of app.py, so only logs to the console, in the same format
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    logging.info(f"Throughput server listening on http://0.0.0.0:{port}")
+    serve(server, host="0.0.0.0", port=port, threads=16, inbuf_overflow=UPLOAD_INBUF_BYTES)
+    return 0
+
+def failed_result(error, rate_limited=False, unexpected=False, misconfigured=False):
+    return {
+        "download": None,
+        "upload": None,
+        "ping": None,
+        "error": error,
+        "rate_limited": rate_limited,
+        "unexpected": unexpected,
+        "misconfigured": misconfigured,
+    }
+
+def run_job(job):
+    """Runs a measurement job with the backend it names and returns its result, never raising.
+
+    Successful results carry the time the measurement took ('duration_ms')
+    and of its phases in seconds ('phases', e.g. server selection, download
+    and upload).
+    Failures are reported in the result ('error', plus 'rate_limited' for
+    HTTP 429 responses, 'misconfigured' for setup errors and 'unexpected' for
+    exceptions with a traceback) so the parent process can log them.
+    """
+    start = time.monotonic()
+    try:
+        backend = BACKENDS[job.get("backend", "speedtest")]
+        result = backend(job)
+        result["duration_ms"] = round((time.monotonic() - start) * 1000)
+        return result
+    except MeasurementError as e:
+        return failed_result(str(e), rate_limited=e.rate_limited, misconfigured=e.misconfigured)
+    except Exception:
+        return failed_result(traceback.format_exc(), unexpected=True)
+
+def worker_main(job_json):
+    """Entry point of the worker process: runs the job and writes the result as JSON to stdout."""
+    result = run_job(json.loads(job_json))
+    # Write to the raw file descriptor: in a windowed build sys.stdout is devnull
+    os.write(1, (json.dumps(result) + "\n").encode())
+    return 0
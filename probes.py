@@ -0,0 +1,117 @@
+# Lightweight latency/jitter/loss probes.
+#
+# Full speed tests are too expensive to run more than every few minutes, so
+# short outages slip between them. The LatencyProber measures the time to
+# open a TCP connection (or to get an answer to an HTTP HEAD request) to a
+# handful of hosts every few seconds, and hands one compact summary per host
+# and window to a callback. It only uses asyncio, so it can be pointed at a
+# local stand-in server (e.g. "127.0.0.1:8080") for testing.
+
+import asyncio
+import logging
+import ssl
+import statistics
+import threading
+import time
+from urllib.parse import urlsplit
+
+def parse_target(target):
+    """Splits a probe target into (kind, host, port, path).
+
+    "host:port" (port defaults to 443) is probed with a TCP connect;
+    "http://..." and "https://..." URLs are probed with an HTTP HEAD request.
+    """
+    target = target.strip()
+    if target.startswith(("http://", "https://")):
+        url = urlsplit(target)
+        port = url.port or (443 if url.scheme == "https" else 80)
+        return (url.scheme, url.hostname, port, url.path or "/")
+    url = urlsplit(f"//{target}")
+    return ("tcp", url.hostname, url.port or 443, None)
+
+async def probe_target(target, timeout):
+    """Returns the latency to `target` in milliseconds, or None if it did not answer in time."""
+    kind, host, port, path = parse_target(target)
+    start = time.perf_counter()
+    writer = None
+    try:
+        async with asyncio.timeout(timeout):
+            reader, writer = await asyncio.open_connection(
+                host, port, ssl=ssl.create_default_context() if kind == "https" else None
+            )
+            if kind != "tcp":
+                writer.write(f"HEAD {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode())
+                await writer.drain()
+                if not (await reader.readline()).startswith(b"HTTP/"):
+                    return None
+        return (time.perf_counter() - start) * 1000
+    except (OSError, TimeoutError, ssl.SSLError):
+        return None
+    finally:
+        if writer is not None:
+            writer.close()
+
+def summarize_samples(samples):
+    """Summarizes one window of samples (latencies in ms, None for a lost probe).
+
+    Jitter is the mean absolute difference between consecutive successful
+    samples.
+    """
+    latencies = [sample for sample in samples if sample is not None]
+    jitter = None
+    if len(latencies) > 1:
+        jitter = statistics.fmean(abs(b - a) for a, b in zip(latencies, latencies[1:]))
+    return {
+        "sent": len(samples),
+        "lost": len(samples) - len(latencies),
+        "min_ms": min(latencies) if latencies else None,
+        "avg_ms": statistics.fmean(latencies) if latencies else None,
+        "max_ms": max(latencies) if latencies else None,
+        "jitter_ms": jitter,
+    }
+
+class LatencyProber:
+    """Probes `targets` every `interval` seconds on a background thread.
+
+    Every `window` seconds, `on_window(window_start, summaries)` is called
+    with the epoch time (seconds) the window started and a dict of
+    target -> summarize_samples() result.
+    """
+
+    def __init__(self, targets, on_window, interval=5, window=60, timeout=2):
+        self.targets = list(targets)
+        self.on_window = on_window
+        self.interval = interval
+        self.window = window
+        self.timeout = timeout
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=lambda: asyncio.run(self._run()), name="latency-prober", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Asks the probe thread to exit after its current round; does not wait for it."""
+        self._stop.set()
+
+    async def _run(self):
+        window_start = time.time()
+        samples = {target: [] for target in self.targets}
+        next_tick = time.monotonic()
+        while not self._stop.is_set():
+            results = await asyncio.gather(*(probe_target(target, self.timeout) for target in self.targets))
+            for target, latency in zip(self.targets, results):
+                samples[target].append(latency)
+
+            if time.time() - window_start >= self.window:
+                summaries = {target: summarize_samples(values) for target, values in samples.items()}
+                try:
+                    self.on_window(window_start, summaries)
+                except Exception:
+                    logging.error("Failed to store latency probe results.", exc_info=True)
+                window_start = time.time()
+                samples = {target: [] for target in self.targets}
+
+            next_tick += self.interval
+            await asyncio.sleep(max(0, next_tick - time.monotonic()))
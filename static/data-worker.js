@@ -0,0 +1,48 @@
+// Fetches and decodes /api/network_data responses off the main thread, so that
+// parsing a large response does not freeze the dashboard. Each request is a
+// message {id, url}; the reply carries the response without its columns
+// (`payload`), the timestamps in epoch ms (`x`) and one Float64Array per
+// series (`series`, NaN where a value is missing). The arrays are transferred,
+// not copied.
+
+self.addEventListener('message', async ({ data: { id, url } }) => {
+    try {
+        const response = await fetch(url);
+        if (response.status === 304) {
+            self.postMessage({ id, notModified: true });
+            return;
+        }
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        const payload = await response.json();
+        const columns = payload.columns;
+        delete payload.columns;
+
+        const count = columns.timestamp.length;
+        const x = new Float64Array(count);
+        const delta = payload.timestamp_encoding === 'delta';
+        let time = 0;
+        for (let i = 0; i < count; i++) {
+            time = delta ? time + columns.timestamp[i] : columns.timestamp[i];
+            x[i] = time;
+        }
+
+        const series = {};
+        for (const [key, values] of Object.entries(columns)) {
+            if (key === 'timestamp') {
+                continue;
+            }
+            const decoded = new Float64Array(count);
+            for (let i = 0; i < count; i++) {
+                decoded[i] = values[i] === null ? NaN : values[i];
+            }
+            series[key] = decoded;
+        }
+
+        const buffers = [x.buffer, ...Object.values(series).map(values => values.buffer)];
+        self.postMessage({ id, payload, x, series }, buffers);
+    } catch (error) {
+        self.postMessage({ id, error: error.message });
+    }
+});
@@ -1,114 +1,207 @@
+// Resolved here because document.currentScript is only set while this file runs
+const dataWorkerUrl = new URL('data-worker.js', document.currentScript.src);
+
 document.addEventListener('DOMContentLoaded', () => {
     const timeFrameSelect = document.getElementById('time-frame');
-    const combinedChartCanvas = document.getElementById('combinedChart').getContext('2d');
+    const probeSelect = document.getElementById('probe');
+    const chartElement = document.getElementById('combinedChart');
+    const combinedChartCanvas = chartElement.getContext('2d');
+    const resetZoomButton = document.getElementById('reset-zoom');
+
+    const SERIES = [
+        { key: 'download_mbps', label: 'Download Speed (Mbps)', color: 'rgb(75, 192, 192)', medianColor: 'rgba(75, 192, 192, 0.7)', axis: 'y-speed', median: 'download' },
+        { key: 'upload_mbps', label: 'Upload Speed (Mbps)', color: 'rgb(255, 99, 132)', medianColor: 'rgba(255, 99, 132, 0.7)', axis: 'y-speed', median: 'upload' },
+        { key: 'latency_ms', label: 'Latency (ms)', color: 'rgb(54, 162, 235)', medianColor: 'rgba(54, 162, 235, 0.7)', axis: 'y-latency', median: 'ping' }
+    ];
+    // Points requested per horizontal pixel: the chart decimates them for drawing, the
+    // surplus keeps detail on screen while a zoom waits for its finer data
+    const POINTS_PER_PIXEL = 4;
 
     let combinedChart;
+    // Every point of every series, kept across refreshes and handed to the chart as is
+    const seriesPoints = Object.fromEntries(SERIES.map(series => [series.key, []]));
+    let chartMedians = {};
+    // Cursor of the newest point on the chart, sent as `since` on refresh polls
+    let latestCursor = null;
+    let chartResolutionKind = null;
+    // Set while the chart shows a zoomed or panned range instead of the selected time frame
+    let zoomed = false;
 
-    // Function to fetch data from the backend
-    async function fetchData(timeFrame) {
-        try {
-            const response = await fetch(`/api/network_data?time_frame=${timeFrame}`);
-            if (!response.ok) {
-                throw new Error(`HTTP error! status: ${response.status}`);
-            }
-            return await response.json();
-        } catch (error) {
-            console.error('Error fetching network data:', error);
-            return [];
+    // Number of points worth drawing: roughly one per horizontal pixel of the chart
+    function chartResolution() {
+        return Math.max(Math.round(chartElement.clientWidth * (window.devicePixelRatio || 1)), 100);
+    }
+
+    // Responses are fetched and decoded by static/data-worker.js, off the main thread
+    const dataWorker = new Worker(dataWorkerUrl);
+    const pendingRequests = new Map();
+    let nextRequestId = 1;
+    dataWorker.addEventListener('message', ({ data }) => {
+        const resolve = pendingRequests.get(data.id);
+        pendingRequests.delete(data.id);
+        if (resolve) {
+            resolve(data);
+        }
+    });
+
+    // Resolves to the decoded response ({payload, x, series}), or null if there is nothing new
+    async function requestData(params) {
+        params.set('format', 'columnar');
+        params.set('encoding', 'delta');
+        if (probeSelect.value !== 'local') {
+            params.set('probe', probeSelect.value);
+        }
+        const id = nextRequestId++;
+        const result = await new Promise(resolve => {
+            pendingRequests.set(id, resolve);
+            dataWorker.postMessage({ id, url: new URL(`/api/network_data?${params}`, window.location.href).href });
+        });
+        if (result.error) {
+            console.error('Error fetching network data:', result.error);
+            return null;
         }
+        return result.notModified ? null : result; // 304: nothing new since the last poll
     }
 
-    // Function to render the combined chart
-    function renderChart(data) {
-        // Destroy existing chart if it exists
-        if (combinedChart) {
-            combinedChart.destroy();
+    // Function to fetch data from the backend. With `since`, only newer points are returned.
+    function fetchData(timeFrame, since = null) {
+        const params = new URLSearchParams({
+            time_frame: timeFrame,
+            max_points: chartResolution() * POINTS_PER_PIXEL
+        });
+        if (since) {
+            params.set('since', since);
         }
+        return requestData(params);
+    }
 
-        const timeSeries = data.time_series;
-        const medians = data.medians;
+    // Local time without an offset, as the API expects; `time` is in epoch ms
+    function toLocalISOString(time) {
+        const offset = new Date(time).getTimezoneOffset() * 60 * 1000;
+        return new Date(time - offset).toISOString().slice(0, 23);
+    }
 
-        const timestamps = timeSeries.map(item => new Date(item.timestamp));
-        const downloads = timeSeries.map(item => item.download_mbps);
-        const uploads = timeSeries.map(item => item.upload_mbps);
-        const latencies = timeSeries.map(item => item.latency_ms);
+    // Fetches the data of a zoomed range; the resolution follows from the span of the range
+    function fetchRange(start, end) {
+        return requestData(new URLSearchParams({
+            start: toLocalISOString(start),
+            end: toLocalISOString(end),
+            max_points: chartResolution() * POINTS_PER_PIXEL
+        }));
+    }
 
-        const chartDatasets = [
-            {
-                label: 'Download Speed (Mbps)',
-                data: downloads,
-                borderColor: 'rgb(75, 192, 192)',
-                yAxisID: 'y-speed',
-                tension: 0.1,
-                fill: false
-            },
-            {
-                label: 'Upload Speed (Mbps)',
-                data: uploads,
-                borderColor: 'rgb(255, 99, 132)',
-                yAxisID: 'y-speed',
-                tension: 0.1,
-                fill: false
-            },
-            {
-                label: 'Latency (ms)',
-                data: latencies,
-                borderColor: 'rgb(54, 162, 235)',
-                yAxisID: 'y-latency',
-                tension: 0.1,
-                fill: false
-            }
-        ];
-
-        // Conditionally add median lines
-        if (appSettings.show_median_lines && timestamps.length > 0) {
-            if (medians.download !== null) {
-                chartDatasets.push({
-                    label: 'Median Download (Mbps)',
-                    data: Array(timestamps.length).fill(medians.download),
-                    borderColor: 'rgba(75, 192, 192, 0.5)',
-                    yAxisID: 'y-speed',
-                    borderDash: [5, 5], // Dashed line
-                    pointRadius: 0, // No points on the line
-                    fill: false
-                });
-            }
-            if (medians.upload !== null) {
-                chartDatasets.push({
-                    label: 'Median Upload (Mbps)',
-                    data: Array(timestamps.length).fill(medians.upload),
-                    borderColor: 'rgba(255, 99, 132, 0.5)',
-                    yAxisID: 'y-speed',
-                    borderDash: [5, 5],
-                    pointRadius: 0,
-                    fill: false
-                });
+    // Degradations, outages and failed tests of the shown window (this instance only)
+    let chartEvents = [];
+    const EVENT_STYLES = {
+        outage: 'rgba(220, 53, 69, 0.15)',
+        degradation: 'rgba(255, 193, 7, 0.2)',
+        failed_test: 'rgba(108, 117, 125, 0.6)'
+    };
+
+    async function refreshEvents() {
+        if (probeSelect.value !== 'local') {
+            chartEvents = [];
+        } else {
+            try {
+                const response = await fetch(`/api/events?time_frame=${timeFrameSelect.value}`);
+                if (!response.ok) {
+                    throw new Error(`HTTP error! status: ${response.status}`);
+                }
+                chartEvents = (await response.json()).events;
+            } catch (error) {
+                console.error('Error fetching events:', error);
+                return;
             }
-            if (medians.ping !== null) {
-                chartDatasets.push({
-                    label: 'Median Latency (ms)',
-                    data: Array(timestamps.length).fill(medians.ping),
-                    borderColor: 'rgba(54, 162, 235, 0.5)',
-                    yAxisID: 'y-latency',
-                    borderDash: [5, 5],
-                    pointRadius: 0,
-                    fill: false
-                });
+        }
+        if (combinedChart) {
+            combinedChart.update('none');
+        }
+    }
+
+    // Shades the time ranges of events behind the lines; failed tests are drawn as thin lines
+    const eventAnnotations = {
+        id: 'eventAnnotations',
+        beforeDatasetsDraw(chart) {
+            const { ctx, chartArea, scales: { x } } = chart;
+            ctx.save();
+            chartEvents.forEach(event => {
+                const start = Math.max(x.getPixelForValue(new Date(event.start).getTime()), chartArea.left);
+                const end = event.end ? Math.min(x.getPixelForValue(new Date(event.end).getTime()), chartArea.right) : chartArea.right;
+                if (end < chartArea.left || start > chartArea.right) {
+                    return;
+                }
+                ctx.fillStyle = EVENT_STYLES[event.kind] || EVENT_STYLES.degradation;
+                ctx.fillRect(start, chartArea.top, Math.max(end - start, 2), chartArea.bottom - chartArea.top);
+            });
+            ctx.restore();
+        }
+    };
+
+    // Draws the medians as dashed horizontal lines across the chart area
+    const medianAnnotations = {
+        id: 'medianAnnotations',
+        afterDatasetsDraw(chart) {
+            if (!appSettings.show_median_lines) {
+                return;
             }
+            const { ctx, chartArea } = chart;
+            ctx.save();
+            ctx.setLineDash([5, 5]);
+            ctx.lineWidth = 1.5;
+            ctx.font = '11px sans-serif';
+            ctx.textAlign = 'right';
+            SERIES.forEach((series, index) => {
+                const median = chartMedians[series.median];
+                if (median === null || median === undefined || !chart.isDatasetVisible(index)) {
+                    return;
+                }
+                const y = chart.scales[series.axis].getPixelForValue(median);
+                if (y < chartArea.top || y > chartArea.bottom) {
+                    return;
+                }
+                ctx.strokeStyle = series.medianColor;
+                ctx.fillStyle = series.medianColor;
+                ctx.beginPath();
+                ctx.moveTo(chartArea.left, y);
+                ctx.lineTo(chartArea.right, y);
+                ctx.stroke();
+                ctx.fillText(`Median ${median.toFixed(1)}`, chartArea.right - 4, y - 4);
+            });
+            ctx.restore();
         }
+    };
 
+    // Creates the combined chart once; refreshes only replace its data
+    function ensureChart() {
+        if (combinedChart) {
+            return combinedChart;
+        }
+        if (window.ChartZoom) {
+            Chart.register(window.ChartZoom);
+        }
         combinedChart = new Chart(combinedChartCanvas, {
             type: 'line',
+            plugins: [eventAnnotations, medianAnnotations],
             data: {
-                labels: timestamps,
-                datasets: chartDatasets
+                datasets: SERIES.map(series => ({
+                    label: series.label,
+                    seriesKey: series.key,
+                    data: seriesPoints[series.key],
+                    borderColor: series.color,
+                    yAxisID: series.axis,
+                    tension: 0.1,
+                    fill: false
+                }))
             },
             options: {
+                animation: false,
+                // Points are {x: epoch ms, y} objects sorted by time, which decimation requires
+                parsing: false,
+                normalized: true,
                 scales: {
                     x: {
                         type: 'time',
                         time: {
-                            unit: 'hour',
                             tooltipFormat: 'MMM d, H:mm:ss'
                         },
                         title: {
@@ -140,37 +233,423 @@ document.addEventListener('DOMContentLoaded', () => {
                     }
                 },
                 plugins: {
+                    // Draws about one point per pixel however many points are loaded
+                    decimation: {
+                        enabled: true,
+                        algorithm: 'lttb'
+                    },
                     tooltip: {
-                        // Filter out tooltips for median lines
-                        filter: function(tooltipItem) {
-                            return !tooltipItem.dataset.label.includes('Median');
-                        },
                         callbacks: {
                             title: function(context) {
-                                return new Date(context[0].label).toLocaleString();
+                                return new Date(context[0].parsed.x).toLocaleString();
                             }
                         }
+                    },
+                    // Wheel or pinch to zoom, drag to pan; the visible range is then fetched in more detail
+                    zoom: {
+                        zoom: {
+                            wheel: { enabled: true },
+                            pinch: { enabled: true },
+                            mode: 'x',
+                            onZoomComplete: scheduleRangeFetch
+                        },
+                        pan: {
+                            enabled: true,
+                            mode: 'x',
+                            onPanComplete: scheduleRangeFetch
+                        },
+                        limits: {
+                            x: { minRange: 60 * 1000 }
+                        }
                     }
                 }
             }
         });
+        return combinedChart;
+    }
+
+    // Hands the point arrays to the chart again. Reading `dataset.data` back would return
+    // the decimated points, so the chart is always given the arrays kept here.
+    function updateChart() {
+        const chart = ensureChart();
+        chart.data.datasets.forEach(dataset => { dataset.data = seriesPoints[dataset.seriesKey]; });
+        chart.update('none');
+    }
+
+    function pointValue(values, i) {
+        return Number.isNaN(values[i]) ? null : values[i];
+    }
+
+    // Replaces the chart data with a decoded response, reusing the existing point objects
+    function showData(result) {
+        const x = result.x;
+        SERIES.forEach(series => {
+            const values = result.series[series.key];
+            const points = seriesPoints[series.key];
+            points.length = x.length;
+            for (let i = 0; i < x.length; i++) {
+                if (points[i]) {
+                    points[i].x = x[i];
+                    points[i].y = pointValue(values, i);
+                } else {
+                    points[i] = { x: x[i], y: pointValue(values, i) };
+                }
+            }
+        });
+        chartMedians = result.payload.medians;
+        latestCursor = result.payload.latest;
+        chartResolutionKind = result.payload.resolution;
+        updateChart();
+    }
+
+    // Merges newer points into the existing chart data
+    function appendData(result) {
+        if (!combinedChart || result.payload.resolution !== chartResolutionKind) {
+            return false;
+        }
+        const x = result.x;
+        const start = result.payload.start ? new Date(result.payload.start).getTime() : null;
+        SERIES.forEach(series => {
+            const values = result.series[series.key];
+            const points = seriesPoints[series.key];
+            for (let i = 0; i < x.length; i++) {
+                // A rollup bucket that was already drawn may have been updated
+                const last = points[points.length - 1];
+                if (last && last.x === x[i]) {
+                    last.y = pointValue(values, i);
+                } else {
+                    points.push({ x: x[i], y: pointValue(values, i) });
+                }
+            }
+
+            // Drop points that have scrolled out of the time window
+            if (start !== null) {
+                let expired = 0;
+                while (expired < points.length && points[expired].x < start) {
+                    expired++;
+                }
+                if (expired > 0) {
+                    points.splice(0, expired);
+                }
+            }
+        });
+        chartMedians = result.payload.medians;
+        latestCursor = result.payload.latest;
+        updateChart();
+        return true;
+    }
+
+    // Fetches the visible range shortly after zooming or panning stops. Half a view
+    // on either side is included so that panning has something to show at once;
+    // the median lines then cover that loaded range.
+    let rangeTimer = null;
+    function scheduleRangeFetch() {
+        zoomed = true;
+        resetZoomButton.hidden = false;
+        clearTimeout(rangeTimer);
+        rangeTimer = setTimeout(async () => {
+            const { min, max } = combinedChart.scales.x;
+            const margin = (max - min) / 2;
+            const result = await fetchRange(min - margin, Math.min(max + margin, Date.now()));
+            if (result && zoomed) {
+                showData(result);
+            }
+        }, 250);
     }
 
     // Function to fetch and render data, respecting the current time frame
     async function refreshData() {
+        // A new time frame or probe leaves a zoomed range
+        if (zoomed) {
+            zoomed = false;
+            clearTimeout(rangeTimer);
+            resetZoomButton.hidden = true;
+            combinedChart.resetZoom('none');
+        }
         const selectedTimeFrame = timeFrameSelect.value;
         console.log(`Refreshing data for time frame: ${selectedTimeFrame}...`);
-        const data = await fetchData(selectedTimeFrame);
-        renderChart(data);
+        const result = await fetchData(selectedTimeFrame);
+        if (result && !zoomed) {
+            showData(result);
+        }
+        refreshEvents();
     }
 
+    // Fetches only the points newer than what is already drawn. A zoomed range stays as
+    // it is; the time frame is reloaded when the zoom is reset.
+    async function pollData() {
+        if (zoomed) {
+            return;
+        }
+        const result = await fetchData(timeFrameSelect.value, latestCursor);
+        if (zoomed) {
+            return;
+        }
+        if (result && !appendData(result)) {
+            await refreshData();
+        } else if (result) {
+            refreshEvents();
+        }
+    }
+
+    resetZoomButton.addEventListener('click', refreshData);
+
+    // Latency probe chart, only present when probes are enabled in the settings
+    const probeChartElement = document.getElementById('probeChart');
+    const PROBE_COLORS = ['rgb(153, 102, 255)', 'rgb(255, 159, 64)', 'rgb(201, 203, 207)', 'rgb(255, 205, 86)'];
+    let probeChart;
+
+    async function refreshProbeData() {
+        if (!probeChartElement) {
+            return;
+        }
+        let data;
+        try {
+            const response = await fetch(`/api/probe_data?time_frame=${timeFrameSelect.value}&max_points=${chartResolution()}`);
+            if (!response.ok) {
+                throw new Error(`HTTP error! status: ${response.status}`);
+            }
+            data = await response.json();
+        } catch (error) {
+            console.error('Error fetching probe data:', error);
+            return;
+        }
+
+        const datasets = [];
+        Object.entries(data.targets).forEach(([target, series], i) => {
+            const color = PROBE_COLORS[i % PROBE_COLORS.length];
+            const points = key => series.timestamp.map((t, j) => ({ x: t, y: series[key][j] }));
+            datasets.push({
+                label: `${target} latency (ms)`,
+                data: points('avg_ms'),
+                borderColor: color,
+                yAxisID: 'y-latency',
+                pointRadius: 0,
+                fill: false
+            });
+            datasets.push({
+                label: `${target} loss (%)`,
+                data: points('loss_pct'),
+                borderColor: color,
+                borderDash: [2, 2],
+                yAxisID: 'y-loss',
+                pointRadius: 0,
+                fill: false
+            });
+        });
+
+        if (probeChart) {
+            probeChart.data.datasets = datasets;
+            probeChart.update('none');
+            return;
+        }
+        probeChart = new Chart(probeChartElement.getContext('2d'), {
+            type: 'line',
+            data: { datasets },
+            options: {
+                parsing: false,
+                scales: {
+                    x: { type: 'time', title: { display: true, text: 'Time' } },
+                    'y-latency': {
+                        type: 'linear',
+                        position: 'left',
+                        title: { display: true, text: 'Latency (ms)' },
+                        beginAtZero: true
+                    },
+                    'y-loss': {
+                        type: 'linear',
+                        position: 'right',
+                        title: { display: true, text: 'Loss (%)' },
+                        min: 0,
+                        max: 100,
+                        grid: { drawOnChartArea: false }
+                    }
+                }
+            }
+        });
+    }
+
+    // Probes of the fleet: fills the probe selector and the comparison table,
+    // both of which stay hidden until an agent has pushed results here
+    const probeComparison = document.getElementById('probe-comparison');
+
+    function formatMedian(value) {
+        return value === null || value === undefined ? '\u2013' : value.toFixed(1);
+    }
+
+    async function refreshProbes() {
+        let data;
+        try {
+            const response = await fetch(`/api/probes?time_frame=${timeFrameSelect.value}`);
+            if (!response.ok) {
+                throw new Error(`HTTP error! status: ${response.status}`);
+            }
+            data = await response.json();
+        } catch (error) {
+            console.error('Error fetching probes:', error);
+            return;
+        }
+
+        const fleet = data.probes.length > 1;
+        document.getElementById('probe-select-group').hidden = !fleet;
+        probeComparison.hidden = !fleet;
+
+        const selected = probeSelect.value;
+        probeSelect.replaceChildren(...data.probes.map(probe => {
+            const option = document.createElement('option');
+            option.value = probe.probe_id;
+            option.textContent = probe.probe_id === 'local' ? 'This instance' : probe.probe_id;
+            return option;
+        }));
+        probeSelect.value = data.probes.some(probe => probe.probe_id === selected) ? selected : 'local';
+
+        const tbody = probeComparison.querySelector('tbody');
+        tbody.replaceChildren(...data.probes.map(probe => {
+            const row = document.createElement('tr');
+            const cells = [
+                probe.probe_id === 'local' ? 'This instance' : probe.probe_id,
+                probe.tests,
+                formatMedian(probe.medians.download),
+                formatMedian(probe.medians.upload),
+                formatMedian(probe.medians.ping),
+                probe.last_seen ? new Date(probe.last_seen).toLocaleString() : '\u2013'
+            ];
+            cells.forEach(value => {
+                const cell = document.createElement('td');
+                cell.textContent = value;
+                row.appendChild(cell);
+            });
+            return row;
+        }));
+    }
+
+    // Day of week / time of day heatmap, coloured from worst (red) to best (green) cell
+    const heatmapTable = document.getElementById('heatmap');
+    const heatmapMetric = document.getElementById('heatmap-metric');
+    const heatmapStat = document.getElementById('heatmap-stat');
+    const heatmapNote = document.getElementById('heatmap-note');
+    let heatmapData = null;
+
+    async function refreshHeatmap() {
+        try {
+            const response = await fetch(`/api/heatmap?time_frame=${timeFrameSelect.value}&metric=${heatmapMetric.value}`);
+            if (!response.ok) {
+                throw new Error(`HTTP error! status: ${response.status}`);
+            }
+            heatmapData = await response.json();
+        } catch (error) {
+            console.error('Error fetching heatmap:', error);
+            return;
+        }
+        renderHeatmap();
+    }
+
+    function renderHeatmap() {
+        if (!heatmapData) {
+            return;
+        }
+        const metric = Object.keys(heatmapData.cells)[0];
+        const grid = heatmapData.cells[metric][heatmapStat.value];
+        const values = grid.flat().filter(value => value !== null);
+        const min = Math.min(...values);
+        const max = Math.max(...values);
+        const higherIsBetter = metric !== 'ping';
+
+        const header = document.createElement('tr');
+        header.appendChild(document.createElement('th'));
+        heatmapData.column_labels.forEach(label => {
+            const th = document.createElement('th');
+            th.textContent = label.slice(0, 2);
+            header.appendChild(th);
+        });
+        const rows = heatmapData.row_labels.map((label, i) => {
+            const row = document.createElement('tr');
+            const th = document.createElement('th');
+            th.textContent = label;
+            row.appendChild(th);
+            grid[i].forEach((value, j) => {
+                const cell = document.createElement('td');
+                if (value === null) {
+                    cell.className = 'empty';
+                } else {
+                    const score = max > min ? (value - min) / (max - min) : 1;
+                    cell.style.backgroundColor = `hsl(${Math.round((higherIsBetter ? score : 1 - score) * 120)}, 65%, 70%)`;
+                    cell.textContent = Math.round(value);
+                    cell.title = `${label} ${heatmapData.column_labels[j]}: ${value.toFixed(1)} (${heatmapData.cells[metric].count[i][j]} tests)`;
+                }
+                row.appendChild(cell);
+            });
+            return row;
+        });
+        heatmapTable.replaceChildren(header, ...rows);
+        heatmapNote.hidden = !heatmapData.covered_start;
+        if (heatmapData.covered_start) {
+            heatmapNote.textContent = `Times of day are only kept since ${new Date(heatmapData.covered_start).toLocaleDateString()}, so older results are not included.`;
+        }
+    }
+
+    heatmapMetric.addEventListener('change', refreshHeatmap);
+    heatmapStat.addEventListener('change', renderHeatmap);
+
     // Event listener for time frame selection
     timeFrameSelect.addEventListener('change', refreshData);
+    timeFrameSelect.addEventListener('change', refreshHeatmap);
+    timeFrameSelect.addEventListener('change', refreshProbeData);
+    timeFrameSelect.addEventListener('change', refreshProbes);
+    probeSelect.addEventListener('change', refreshData);
 
     // Initial data load
     refreshData();
+    refreshProbeData();
+    refreshProbes();
+    refreshHeatmap();
 
-    // Set an interval to automatically refresh the data every 5 minutes
+    // New measurements are pushed over Server-Sent Events. While the stream is
+    // unavailable (old browser, too many dashboards, server restart), poll
+    // every 5 minutes instead.
     const FIVE_MINUTES_IN_MS = 5 * 60 * 1000;
-    setInterval(refreshData, FIVE_MINUTES_IN_MS);
+    const testStatusElement = document.getElementById('test-status');
+    let pollTimer = null;
+
+    function startPolling() {
+        if (pollTimer === null) {
+            pollTimer = setInterval(pollData, FIVE_MINUTES_IN_MS);
+        }
+    }
+
+    function stopPolling() {
+        if (pollTimer !== null) {
+            clearInterval(pollTimer);
+            pollTimer = null;
+        }
+    }
+
+    function showTestStatus(status) {
+        if (!testStatusElement) {
+            return;
+        }
+        testStatusElement.hidden = status.state !== 'running';
+        testStatusElement.textContent = status.state === 'running' ? 'Speed test in progress\u2026' : '';
+    }
+
+    if ('EventSource' in window) {
+        const source = new EventSource('/api/stream');
+        source.addEventListener('open', () => {
+            stopPolling();
+            pollData(); // Catch up on anything missed while disconnected
+        });
+        source.addEventListener('error', startPolling);
+        source.addEventListener('status', event => showTestStatus(JSON.parse(event.data)));
+        source.addEventListener('event', () => refreshEvents());
+        // Dashboards asking for the same window share one cached response on the server
+        source.addEventListener('measurement', () => {
+            pollData();
+            refreshProbes();
+            refreshHeatmap();
+        });
+    } else {
+        startPolling();
+    }
+    // Probe windows are short, so they are refreshed every minute
+    setInterval(refreshProbeData, 60 * 1000);
 });
\ No newline at end of file
@@ -0,0 +1,85 @@
+# Server-Sent Events fan-out.
+#
+# Dashboards subscribe to /api/stream instead of polling on a timer. Every
+# event is formatted once by Broadcaster.publish() and put on a small queue
+# per connected client, so the cost of an event does not depend on how many
+# dashboards are open and no client ever touches the database through the
+# stream. A client that stops reading is disconnected instead of holding
+# events in memory; its EventSource reconnects and catches up by polling.
+
+import json
+import queue
+import threading
+
+def format_event(event, data, event_id=None):
+    """Encodes one SSE message; `data` is sent as JSON."""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return ("\n".join(lines) + "\n\n").encode()
+
+class _Client:
+    def __init__(self, queue_size):
+        self.queue = queue.Queue(queue_size)
+        self.closed = False
+
+class Broadcaster:
+    """Delivers published events to every subscribed client queue."""
+
+    def __init__(self, max_clients=32, queue_size=16):
+        self.max_clients = max_clients
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._clients = set()
+        self._next_id = 1
+
+    def subscribe(self):
+        """Returns a new client queue, or None if max_clients are already connected."""
+        with self._lock:
+            if len(self._clients) >= self.max_clients:
+                return None
+            client = _Client(self.queue_size)
+            self._clients.add(client)
+            return client
+
+    def unsubscribe(self, client):
+        with self._lock:
+            self._clients.discard(client)
+
+    def client_count(self):
+        with self._lock:
+            return len(self._clients)
+
+    def publish(self, event, data):
+        """Sends an event to all clients; clients whose queue is full are disconnected."""
+        with self._lock:
+            message = format_event(event, data, self._next_id)
+            self._next_id += 1
+            clients = list(self._clients)
+        for client in clients:
+            try:
+                client.queue.put_nowait(message)
+            except queue.Full:
+                # The client reconnects and catches up by polling
+                client.closed = True
+                self.unsubscribe(client)
+
+    def stream(self, client, initial=(), heartbeat=15):
+        """Yields the messages for one subscribed client until it disconnects.
+
+        `initial` messages are sent first. A comment line goes out every
+        `heartbeat` seconds without events, which keeps proxies from closing
+        the connection and lets the server notice clients that went away.
+        """
+        try:
+            yield b"retry: 10000\n\n"
+            yield from initial
+            while not client.closed:
+                try:
+                    yield client.queue.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield b": keep-alive\n\n"
+        finally:
+            self.unsubscribe(client)
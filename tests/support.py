@@ -0,0 +1,33 @@
+import os
+import tempfile
+import unittest
+
+import app
+
+class AppTestCase(unittest.TestCase):
+    """Runs each test against a new database in a temporary data directory, without background jobs."""
+
+    def setUp(self):
+        data_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(data_dir.cleanup)
+        app.db_path = os.path.join(data_dir.name, "network_tests.db")
+        app.log_path = os.path.join(data_dir.name, "app.log")
+        app.scheduler = None # Lets create_app() initialize again
+        app.create_app(background=False)
+        self.addCleanup(self.close_db)
+        self.client = app.app.test_client()
+
+    def close_db(self):
+        app.get_db().close()
+        app._db_local.conn = None
+
+    def insert_tests(self, rows):
+        """Stores (epoch ms, download, upload, latency) rows as local results and rebuilds the rollups."""
+        conn = app.get_db()
+        with conn:
+            conn.executemany(
+                "INSERT INTO network_tests (timestamp, download_mbps, upload_mbps, latency_ms) VALUES (?, ?, ?, ?)", rows
+            )
+        with conn:
+            app.rebuild_rollups(conn)
+        app.response_cache.clear()
@@ -0,0 +1,75 @@
+import random
+import unittest
+from datetime import datetime, timedelta
+
+from benchmark import synthetic_rows
+from detection import LEVEL_SHIFT_TESTS, RECOVERY_TESTS, Detector
+
+START = datetime(2026, 1, 5)
+STEP = timedelta(minutes=15)
+
+def noisy_values(rng, download=100.0, upload=20.0, latency=20.0, noise=0.1):
+    return {
+        "download_mbps": rng.gauss(download, download * noise),
+        "upload_mbps": rng.gauss(upload, upload * noise),
+        "latency_ms": rng.gauss(latency, latency * noise),
+    }
+
+class DetectorTest(unittest.TestCase):
+    def setUp(self):
+        self.detector = Detector()
+        self.rng = random.Random(1)
+        self.when = START
+        self.changes = []
+
+    def feed(self, count, **levels):
+        """Feeds `count` noisy results at the given levels, recording (time, metric, change) of every start and end."""
+        for _ in range(count):
+            for metric, change, _ in self.detector.update(noisy_values(self.rng, **levels), self.when):
+                if change != "continue":
+                    self.changes.append((self.when, metric, change))
+            self.when += STEP
+
+    def starts(self):
+        return [change for change in self.changes if change[2] == "start"]
+
+    def test_noise_opens_no_degradation(self):
+        self.feed(30 * 96)
+        self.assertEqual(self.starts(), [])
+
+    def test_single_outliers_open_no_degradation(self):
+        self.feed(7 * 96)
+        for _ in range(20):
+            self.feed(1, download=20, latency=200)
+            self.feed(2)
+        self.assertEqual(self.starts(), [])
+
+    def test_sustained_drop_opens_and_closes_a_degradation(self):
+        self.feed(7 * 96)
+        drop_start = self.when
+        self.feed(8, download=60)
+        self.assertEqual(len(self.starts()), 1)
+        started, metric, _ = self.starts()[0]
+        self.assertEqual(metric, "download_mbps")
+        self.assertLessEqual(started - drop_start, 4 * STEP)
+
+        self.feed(RECOVERY_TESTS)
+        self.assertEqual(self.changes[-1][1:], ("download_mbps", "end"))
+
+    def test_lasting_drop_becomes_the_new_normal(self):
+        self.feed(7 * 96)
+        self.feed(LEVEL_SHIFT_TESTS + 7 * 96, download=60)
+        self.assertEqual([change for _, _, change in self.changes], ["start", "end"])
+
+    def test_a_year_of_synthetic_history(self):
+        # Slow spells and latency spikes hit single tests, a few percent of the time
+        detector = Detector()
+        starts = 0
+        for timestamp, download, upload, latency, _, _ in sorted(synthetic_rows(35040, 365, 1)):
+            values = {"download_mbps": download, "upload_mbps": upload, "latency_ms": latency}
+            changes = detector.update(values, datetime.fromtimestamp(timestamp / 1000))
+            starts += sum(change == "start" for _, change, _ in changes)
+        self.assertLessEqual(starts, 5)
+
+if __name__ == "__main__":
+    unittest.main()
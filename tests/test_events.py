@@ -0,0 +1,34 @@
+from datetime import datetime
+
+import app
+from measurement import run_job
+from tests.support import AppTestCase
+
+class RecordFailedTestTest(AppTestCase):
+    def record(self, **results):
+        conn = app.get_db()
+        with conn:
+            return app.record_failed_test(conn, datetime.now(), dict(app.FAILED_RESULT, **results))
+
+    def events(self):
+        return self.client.get("/api/events?time_frame=day").get_json()["events"]
+
+    def test_network_failures_are_one_outage(self):
+        self.record(error="Connection refused")
+        self.record(error="Timed out")
+        events = self.events()
+        self.assertEqual([event["kind"] for event in events], ["outage"])
+        self.assertIsNone(events[0]["end"])
+        self.assertEqual(events[0]["detail"], {"failed_tests": 2, "error": "Timed out"})
+
+    def test_failures_of_the_test_itself_are_failed_tests(self):
+        self.record(**run_job({"backend": "http"}))
+        self.record(error="Worker exited with code 1.", worker_error=True)
+        self.record(error="Traceback (most recent call last):\n  ...\nKeyError: 'server'\n", unexpected=True)
+        self.record(error="HTTP Error 429", rate_limited=True)
+        events = self.events()
+        self.assertEqual([event["kind"] for event in events], ["failed_test"] * 4)
+        self.assertTrue(events[0]["detail"]["misconfigured"])
+        self.assertTrue(events[1]["detail"]["worker_error"])
+        self.assertEqual(events[2]["detail"], {"error": "KeyError: 'server'", "unexpected": True})
+        self.assertTrue(events[3]["detail"]["rate_limited"])
@@ -0,0 +1,110 @@
+import time
+
+import app
+from tests.support import AppTestCase
+
+TOKEN = "fleet-secret"
+
+class FleetTestCase(AppTestCase):
+    """Runs against an instance that accepts results from agents."""
+
+    def setUp(self):
+        super().setUp()
+        app.settings["ingest_token"] = TOKEN
+        self.now = int(time.time() * 1000)
+
+    def results(self, count, download=100.0):
+        return [
+            {"timestamp": self.now - (count - i) * 60000, "download_mbps": download + i, "upload_mbps": 10.0, "latency_ms": 20.0}
+            for i in range(count)
+        ]
+
+    def ingest(self, probe_id, results, token=TOKEN):
+        return self.client.post(
+            "/api/ingest",
+            json={"probe_id": probe_id, "results": results},
+            headers={"Authorization": f"Bearer {token}"} if token else {},
+        )
+
+class FleetIngestionTest(FleetTestCase):
+    def network_data(self, **args):
+        response = self.client.get("/api/network_data", query_string={"time_frame": "all", **args})
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()["time_series"]
+
+    def test_duplicates_are_ignored(self):
+        results = self.results(5)
+        first = self.ingest("branch", results).get_json()
+        self.assertEqual((first["accepted"], first["duplicates"]), (5, 0))
+        # A retry of a partly delivered batch only adds the new results
+        second = self.ingest("branch", results + [{"timestamp": self.now, "download_mbps": 1.0}]).get_json()
+        self.assertEqual((second["accepted"], second["duplicates"]), (1, 5))
+        self.assertEqual(len(self.network_data(probe="branch")), 6)
+
+    def test_token_is_checked(self):
+        self.assertEqual(self.ingest("branch", self.results(1), token=None).status_code, 401)
+        self.assertEqual(self.ingest("branch", self.results(1), token="wrong").status_code, 401)
+        app.settings["ingest_token"] = ""
+        self.assertEqual(self.ingest("branch", self.results(1)).status_code, 403)
+        self.assertEqual(app.get_db().execute("SELECT COUNT(*) FROM probe_results").fetchone()[0], 0)
+
+    def test_local_probe_id_is_rejected(self):
+        self.assertEqual(self.ingest(app.LOCAL_PROBE_ID, self.results(1)).status_code, 400)
+
+    def test_probe_filter(self):
+        self.insert_tests([(self.now - 30000, 900.0, 90.0, 9.0)])
+        self.ingest("branch", self.results(3, download=100))
+        self.ingest("home", self.results(2, download=200))
+
+        self.assertEqual([point["download_mbps"] for point in self.network_data(probe="branch")], [100, 101, 102])
+        self.assertEqual([point["download_mbps"] for point in self.network_data(probe="home")], [200, 201])
+        self.assertEqual([point["download_mbps"] for point in self.network_data(probe=app.LOCAL_PROBE_ID)], [900])
+        self.assertEqual([point["download_mbps"] for point in self.network_data()], [900])
+
+class ProbesTest(FleetTestCase):
+    def probes(self):
+        response = self.client.get("/api/probes", query_string={"time_frame": "all"})
+        self.assertEqual(response.status_code, 200)
+        return {probe["probe_id"]: probe for probe in response.get_json()["probes"]}
+
+    def test_counts_and_medians(self):
+        self.insert_tests([(self.now - 60000 * i, 50.0 + i, 5.0, 10.0) for i in range(3)])
+        self.ingest("branch", self.results(4, download=100))
+        self.ingest("home", [{"timestamp": self.now, "download_mbps": 7.0, "upload_mbps": None, "latency_ms": 3.0}])
+
+        probes = self.probes()
+        self.assertEqual(list(probes), [app.LOCAL_PROBE_ID, "branch", "home"])
+        self.assertEqual(probes[app.LOCAL_PROBE_ID]["tests"], 3)
+        self.assertEqual(probes[app.LOCAL_PROBE_ID]["medians"]["download"], 51.0)
+        self.assertEqual(probes["branch"]["tests"], 4)
+        # Even count: the mean of the two middle values
+        self.assertEqual(probes["branch"]["medians"], {"download": 101.5, "upload": 10.0, "ping": 20.0})
+        self.assertEqual(probes["home"]["medians"], {"download": 7.0, "upload": None, "ping": 3.0})
+
+    def test_new_results_are_not_hidden_by_the_cache(self):
+        self.ingest("branch", self.results(2))
+        self.assertEqual(self.probes()["branch"]["tests"], 2)
+        self.ingest("branch", [{"timestamp": self.now, "download_mbps": 1.0}])
+        self.assertEqual(self.probes()["branch"]["tests"], 3)
+
+class ProbeRetentionTest(FleetTestCase):
+    def test_old_probe_data_is_removed(self):
+        day_ms = 24 * 3600 * 1000
+        for probe_id in ("branch", "home"):
+            self.ingest(probe_id, [
+                {"timestamp": self.now - days * day_ms, "download_mbps": 100.0} for days in (40, 20, 1)
+            ])
+        conn = app.get_db()
+        with conn:
+            conn.executemany(
+                "INSERT INTO latency_probes (timestamp, target, sent, lost) VALUES (?, ?, 12, 0)",
+                [(self.now - days * day_ms, "1.1.1.1:443") for days in (40, 20, 1)],
+            )
+
+        app.apply_retention()
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM probe_results").fetchone()[0], 6)
+
+        app.settings["probe_retention_days"] = 30
+        app.apply_retention()
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM probe_results").fetchone()[0], 4)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM latency_probes").fetchone()[0], 2)
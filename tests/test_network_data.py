@@ -0,0 +1,126 @@
+import random
+import time
+from datetime import datetime, timedelta
+
+import app
+from tests.support import AppTestCase
+
+HOUR_MS = 3600 * 1000
+
+def synthetic_rows(count, step_ms, seed=1):
+    rng = random.Random(seed)
+    start = int(time.time() * 1000) - count * step_ms
+    return [
+        (start + i * step_ms, rng.uniform(50, 300), rng.uniform(5, 40), rng.uniform(5, 80))
+        for i in range(count)
+    ]
+
+class DownsampleRowsTest(AppTestCase):
+    def rows(self, count):
+        return [
+            dict(zip(("timestamp", *app.SERIES_KEYS), row))
+            for row in synthetic_rows(count, 60 * 1000)
+        ]
+
+    def test_at_most_max_points_rows_keeping_first_and_last(self):
+        rows = self.rows(10000)
+        for max_points in (3, 5, 8, 100, 1000):
+            with self.subTest(max_points=max_points):
+                sampled = app.downsample_rows(rows, max_points)
+                self.assertLessEqual(len(sampled), max_points)
+                self.assertIs(sampled[0], rows[0])
+                self.assertIs(sampled[-1], rows[-1])
+                timestamps = [row["timestamp"] for row in sampled]
+                self.assertEqual(timestamps, sorted(set(timestamps)))
+
+    def test_short_series_are_unchanged(self):
+        rows = self.rows(50)
+        self.assertEqual(app.downsample_rows(rows, 100), rows)
+
+    def test_network_data_respects_max_points(self):
+        self.insert_tests(synthetic_rows(2000, 60 * 1000))
+        data = self.client.get("/api/network_data?time_frame=week&max_points=100").get_json()
+        self.assertEqual(data["resolution"], "raw")
+        self.assertLessEqual(len(data["time_series"]), 100)
+
+class KeysetPaginationTest(AppTestCase):
+    def fetch_all_pages(self, query):
+        timestamps = []
+        cursor = None
+        pages = 0
+        while True:
+            url = f"/api/network_data?{query}&limit=7" + (f"&cursor={cursor}" if cursor is not None else "")
+            data = self.client.get(url + "&format=columnar").get_json()
+            pages += 1
+            page = data["columns"]["timestamp"]
+            self.assertLessEqual(len(page), 7)
+            timestamps.extend(page)
+            cursor = data["next_cursor"]
+            if cursor is None:
+                return timestamps, pages
+
+    def test_raw_pages_neither_overlap_nor_skip_rows(self):
+        rows = synthetic_rows(50, 60 * 1000)
+        self.insert_tests(rows)
+        timestamps, pages = self.fetch_all_pages("time_frame=all&resolution=raw")
+        self.assertEqual(timestamps, [row[0] for row in rows])
+        self.assertEqual(pages, 8)
+
+    def test_rollup_pages_neither_overlap_nor_skip_buckets(self):
+        self.insert_tests(synthetic_rows(40 * 4, HOUR_MS // 4))
+        buckets = [row["bucket"] for row in app.get_db().execute("SELECT bucket FROM network_tests_hourly ORDER BY bucket")]
+        timestamps, _ = self.fetch_all_pages("time_frame=all&resolution=hourly")
+        self.assertEqual(timestamps, buckets)
+
+class ResolutionTest(AppTestCase):
+    def test_short_history_is_served_raw(self):
+        self.insert_tests(synthetic_rows(57, 24 * HOUR_MS))
+        data = self.client.get("/api/network_data?time_frame=all").get_json()
+        self.assertEqual(data["resolution"], "raw")
+        self.assertEqual(len(data["time_series"]), 57)
+
+    def test_all_keeps_the_history_that_retention_removed_from_the_raw_rows(self):
+        self.insert_tests(synthetic_rows(365 * 4, 6 * HOUR_MS))
+        app.settings["raw_retention_days"] = 7
+        app.apply_retention()
+        data = self.client.get("/api/network_data?time_frame=all").get_json()
+        self.assertEqual(data["resolution"], "daily")
+        self.assertGreaterEqual(len(data["time_series"]), 365)
+
+    def network_data_between(self, days_ago_start, days_ago_end):
+        now = datetime.now()
+        return self.client.get("/api/network_data", query_string={
+            "start": (now - timedelta(days=days_ago_start)).isoformat(),
+            "end": (now - timedelta(days=days_ago_end)).isoformat(),
+        }).get_json()
+
+    def test_ranges_older_than_retention_fall_back_to_rollups(self):
+        self.insert_tests(synthetic_rows(365 * 4, 6 * HOUR_MS))
+        app.settings["raw_retention_days"] = 7
+        app.settings["hourly_retention_days"] = 90
+        app.apply_retention()
+
+        recent = self.network_data_between(3, 1)
+        self.assertEqual(recent["resolution"], "raw")
+        self.assertEqual(len(recent["time_series"]), 8)
+
+        # Short enough to be served raw, but the raw rows are gone
+        week = self.network_data_between(25, 20)
+        self.assertEqual(week["resolution"], "hourly")
+        self.assertAlmostEqual(len(week["time_series"]), 20, delta=1) # Buckets at both ends may be partial
+
+        # Served hourly by its length, but only the daily rollups reach back that far
+        months = self.network_data_between(200, 150)
+        self.assertEqual(months["resolution"], "daily")
+        self.assertAlmostEqual(len(months["time_series"]), 50, delta=1)
+
+    def test_heatmap_reports_when_retention_cut_the_hourly_history(self):
+        self.insert_tests(synthetic_rows(365 * 4, 6 * HOUR_MS))
+        data = self.client.get("/api/heatmap?time_frame=all").get_json()
+        self.assertIsNone(data["covered_start"])
+
+        app.settings["hourly_retention_days"] = 90
+        app.apply_retention()
+        data = self.client.get("/api/heatmap?time_frame=all").get_json()
+        oldest_hourly = app.get_db().execute("SELECT MIN(bucket) FROM network_tests_hourly").fetchone()[0]
+        self.assertEqual(data["covered_start"], app.from_epoch_ms(oldest_hourly).isoformat())
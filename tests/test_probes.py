@@ -0,0 +1,114 @@
+import asyncio
+import socket
+import threading
+import unittest
+
+from probes import LatencyProber, probe_target, summarize_samples
+
+async def answer_http(reader, writer):
+    await reader.readline()
+    writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n")
+    await writer.drain()
+    writer.close()
+
+async def answer_garbage(reader, writer):
+    writer.write(b"SSH-2.0-stand-in\r\n")
+    await writer.drain()
+    writer.close()
+
+async def never_answer(reader, writer):
+    await reader.read() # Until the probe gives up and disconnects
+    writer.close()
+
+def closed_port():
+    """A local port nothing listens on, so connecting to it is refused."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+class StandInServer:
+    """A local asyncio server running on its own thread, for probes that run on another one."""
+
+    def __init__(self, handler):
+        self.loop = asyncio.new_event_loop()
+        self.server = self.loop.run_until_complete(asyncio.start_server(handler, "127.0.0.1", 0))
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.server.close()
+        self.loop.close()
+
+class ProbeTargetTest(unittest.TestCase):
+    def probe(self, handler, target_format, timeout=1):
+        async def run():
+            server = await asyncio.start_server(handler, "127.0.0.1", 0)
+            async with server:
+                port = server.sockets[0].getsockname()[1]
+                return await probe_target(target_format.format(port=port), timeout)
+        return asyncio.run(run())
+
+    def test_tcp_connect(self):
+        latency = self.probe(never_answer, "127.0.0.1:{port}")
+        self.assertIsNotNone(latency)
+        self.assertGreaterEqual(latency, 0)
+
+    def test_http_head(self):
+        self.assertIsNotNone(self.probe(answer_http, "http://127.0.0.1:{port}/health"))
+
+    def test_http_answer_that_is_not_http_is_lost(self):
+        self.assertIsNone(self.probe(answer_garbage, "http://127.0.0.1:{port}/"))
+
+    def test_http_without_answer_times_out(self):
+        self.assertIsNone(self.probe(never_answer, "http://127.0.0.1:{port}/", timeout=0.2))
+
+    def test_refused_connection_is_lost(self):
+        self.assertIsNone(asyncio.run(probe_target(f"127.0.0.1:{closed_port()}", 1)))
+
+class SummarizeSamplesTest(unittest.TestCase):
+    def test_loss_and_jitter(self):
+        summary = summarize_samples([10.0, None, 14.0, 11.0, None])
+        self.assertEqual(summary["sent"], 5)
+        self.assertEqual(summary["lost"], 2)
+        self.assertEqual(summary["min_ms"], 10.0)
+        self.assertEqual(summary["max_ms"], 14.0)
+        self.assertAlmostEqual(summary["avg_ms"], 35 / 3)
+        # Mean absolute difference of consecutive answered probes: (4 + 3) / 2
+        self.assertAlmostEqual(summary["jitter_ms"], 3.5)
+
+    def test_all_lost(self):
+        summary = summarize_samples([None, None])
+        self.assertEqual((summary["sent"], summary["lost"]), (2, 2))
+        self.assertIsNone(summary["avg_ms"])
+        self.assertIsNone(summary["jitter_ms"])
+
+class LatencyProberTest(unittest.TestCase):
+    def test_windows_against_stand_in_servers(self):
+        server = StandInServer(answer_http)
+        self.addCleanup(server.close)
+        live = f"http://127.0.0.1:{server.port}/"
+        dead = f"127.0.0.1:{closed_port()}"
+        windows = []
+        received = threading.Event()
+
+        def on_window(window_start, summaries):
+            windows.append((window_start, summaries))
+            received.set()
+
+        prober = LatencyProber([live, dead], on_window, interval=0.02, window=0.2, timeout=0.5)
+        prober.start()
+        self.addCleanup(prober.stop)
+        self.assertTrue(received.wait(5), "no window was reported")
+
+        _, summaries = windows[0]
+        self.assertEqual(set(summaries), {live, dead})
+        self.assertGreater(summaries[live]["sent"], 1)
+        self.assertEqual(summaries[live]["lost"], 0)
+        self.assertIsNotNone(summaries[live]["jitter_ms"])
+        self.assertEqual(summaries[dead]["lost"], summaries[dead]["sent"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import json
+import random
+import unittest
+
+from app import QuantileSketch
+
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+def exact_quantile(sorted_values, q):
+    """The order statistic QuantileSketch.quantile estimates: rank q * (n - 1), rounded down."""
+    return sorted_values[int(q * (len(sorted_values) - 1))]
+
+class QuantileSketchTest(unittest.TestCase):
+    def assert_accurate(self, sketch, values):
+        values = sorted(values)
+        for q in QUANTILES:
+            exact = exact_quantile(values, q)
+            estimate = sketch.quantile(q)
+            self.assertLessEqual(
+                abs(estimate - exact), QuantileSketch.RELATIVE_ACCURACY * exact,
+                f"q={q}: estimate {estimate}, exact {exact}"
+            )
+
+    def test_merged_sketches_are_within_relative_accuracy(self):
+        rng = random.Random(42)
+        distributions = {
+            "speeds": lambda: rng.uniform(5, 950),
+            "latencies": lambda: rng.lognormvariate(3, 0.8),
+            "bimodal": lambda: rng.gauss(300, 20) if rng.random() < 0.8 else rng.gauss(40, 10),
+        }
+        for name, draw in distributions.items():
+            with self.subTest(distribution=name):
+                merged = QuantileSketch()
+                values = []
+                # Hourly rollups of different sizes, merged the way the API combines them
+                for _ in range(200):
+                    part = [max(draw(), 0.01) for _ in range(rng.randint(1, 60))]
+                    sketch = QuantileSketch()
+                    for value in part:
+                        sketch.add(value)
+                    merged.merge(sketch)
+                    values.extend(part)
+                self.assertEqual(merged.count, len(values))
+                self.assert_accurate(merged, values)
+
+    def test_stored_form_round_trips(self):
+        rng = random.Random(7)
+        values = [rng.uniform(1, 500) for _ in range(1000)] + [0.0] * 10
+        sketch = QuantileSketch()
+        for value in values:
+            sketch.add(value)
+        restored = QuantileSketch.from_dict(json.loads(json.dumps(sketch.to_dict())))
+        self.assertEqual(restored.count, len(values))
+        self.assert_accurate(restored, values)
+
+    def test_empty_sketch_has_no_quantiles(self):
+        self.assertIsNone(QuantileSketch().quantile(0.5))
+
+if __name__ == "__main__":
+    unittest.main()
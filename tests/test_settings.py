@@ -0,0 +1,42 @@
+import copy
+from unittest import mock
+
+import app
+from tests.support import AppTestCase
+
+class ManageSettingsTest(AppTestCase):
+    def post_settings(self, **changes):
+        data = {"test_interval_minutes": app.settings["test_interval_minutes"], **changes}
+        return self.client.post("/api/settings", json=data)
+
+    def test_rejected_request_changes_nothing(self):
+        before = copy.deepcopy(app.settings)
+        with mock.patch.object(app, "scheduler") as scheduler, mock.patch.object(app, "restart_latency_prober") as restart:
+            response = self.post_settings(
+                test_interval_minutes=5,
+                probe_enabled=True,
+                probe_targets=["127.0.0.1:9"],
+                test_timeout_seconds=10,
+                http_engine_duration_seconds=60,
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(app.settings, before)
+        self.assertEqual(app.load_settings(), before)
+        scheduler.reschedule_job.assert_not_called()
+        restart.assert_not_called()
+
+    def test_accepted_request_is_applied(self):
+        with mock.patch.object(app, "scheduler") as scheduler, mock.patch.object(app, "restart_latency_prober") as restart:
+            response = self.post_settings(test_interval_minutes=5, probe_targets=["127.0.0.1:9"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(app.settings["test_interval_minutes"], 5)
+        self.assertEqual(app.load_settings()["probe_targets"], ["127.0.0.1:9"])
+        scheduler.reschedule_job.assert_called_once_with("speedtest_job", trigger="interval", minutes=5)
+        restart.assert_called_once_with()
+
+    def test_local_agent_probe_id_is_rejected_before_anything_changes(self):
+        before = copy.deepcopy(app.settings)
+        response = self.post_settings(agent_enabled=True, agent_central_url="http://central:5000", agent_probe_id=app.LOCAL_PROBE_ID)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(app.settings, before)
+        self.assertEqual(app.load_settings(), before)